@@ -0,0 +1,36 @@
+#!/bin/bash
+
+# set environment variables from .env file for the script to authenticate using service principal
+# Load environment variables from .env file
+if [ -f .env ]; then
+  echo "Loading environment variables from .env file..."
+  export $(grep -v '^#' .env | xargs)
+else
+  echo ".env file not found."
+  exit 1
+fi
+
+# Navigate to the directory of the script
+cd "$(dirname "$0")"
+config_file="$(pwd)/config.yaml"
+
+# Navigate to the indexer directory
+cd ../indexer || exit
+
+# rebuild_index.py builds <IndexName>-v<N> next to the live index, checks its
+# document count and sample-query recall, then points IndexAlias at it and
+# deletes older versions. Queries should use IndexAlias as their index name.
+# Extra arguments are passed through, e.g. --labels, --keep-versions or --timeout.
+echo "Rebuilding index..."
+python rebuild_index.py \
+  --config "$config_file" \
+  --verbose \
+  "$@"
+
+# display success message only if the new version went live
+if [ $? -eq 0 ]; then
+  echo "Index rebuilt successfully."
+else
+  echo "Index rebuild failed, the alias was left unchanged."
+  exit 1
+fi
@@ -0,0 +1,428 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+from openai import AsyncAzureOpenAI
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character estimate
+    tiktoken = None
+
+
+_logger = logging.getLogger(__name__)
+
+# Azure OpenAI embedding limits: 2048 inputs per request, 8191 tokens per input
+MAX_ITEMS_PER_REQUEST = 2048
+MAX_TOKENS_PER_INPUT = 8191
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when installed, otherwise estimates ~4 chars per token."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self._encoding = tiktoken.get_encoding(encoding_name) if tiktoken else None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+
+class TokenRateTracker:
+    """Sliding one-minute window of tokens sent, used to stay under a TPM quota."""
+
+    def __init__(self, tokens_per_minute: int = 0):
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()
+        self._lock = asyncio.Lock()
+
+    def _trim(self, now: float):
+        while self._window and self._window[0][0] <= now - 60:
+            self._window.popleft()
+
+    def used(self) -> int:
+        self._trim(time.monotonic())
+        return sum(_tokens for _, _tokens in self._window)
+
+    async def reserve(self, tokens: int):
+        """Wait until ``tokens`` fit in the quota, then record them."""
+        async with self._lock:
+            while self.tokens_per_minute:
+                _now = time.monotonic()
+                self._trim(_now)
+                _used = sum(_tokens for _, _tokens in self._window)
+                if not self._window or _used + tokens <= self.tokens_per_minute:
+                    break
+                await asyncio.sleep(max(self._window[0][0] + 60 - _now, 0.01))
+            self._window.append((time.monotonic(), tokens))
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that halves on throttling and grows back one slot per success streak."""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def on_throttle(self):
+        async with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+    async def on_success(self):
+        async with self._condition:
+            self._successes += 1
+            if self.limit < self.max_concurrency and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+
+def retry_after_seconds(error) -> float:
+    """Read ``retry-after-ms``/``retry-after`` from a throttled response, if any."""
+    _response = getattr(error, "response", None)
+    if _response is None:
+        return 0.0
+    _headers = _response.headers
+    try:
+        if _headers.get("retry-after-ms"):
+            return float(_headers["retry-after-ms"]) / 1000
+        if _headers.get("retry-after"):
+            return float(_headers["retry-after"])
+    except ValueError:
+        pass
+    return 0.0
+
+
+class AsyncEmbeddingClient:
+    """Batched asyncio embedding client for Azure OpenAI.
+
+    Texts are packed into requests bounded by item and token count, up to
+    ``max_concurrency`` requests are kept in flight, and 429 responses pause all
+    senders for the advertised ``retry-after`` while the concurrency limit backs off.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        deployment: str,
+        dimensions: int = None,
+        api_key: str = None,
+        api_version: str = "2024-06-01",
+        max_items_per_request: int = 16,
+        max_tokens_per_request: int = 8000,
+        max_concurrency: int = 4,
+        tokens_per_minute: int = 0,
+        max_retries: int = 8,
+    ):
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.dimensions = dimensions
+        self.api_key = api_key or os.getenv("AZURE_OPENAI_KEY")
+        self.api_version = api_version
+        self.max_items_per_request = min(max_items_per_request, MAX_ITEMS_PER_REQUEST)
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_retries = max_retries
+        self.token_counter = TokenCounter()
+        self.rate_tracker = TokenRateTracker(tokens_per_minute)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self._client = None
+        self._paused_until = 0.0
+        self._started = None
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.texts_embedded = 0
+        self.tokens_sent = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncAzureOpenAI(
+                api_version=self.api_version,
+                azure_endpoint=self.endpoint,
+                api_key=self.api_key,
+                max_retries=0,
+            )
+        return self._client
+
+    def pack(self, texts: list):
+        """Group text positions into batches bounded by item and token count."""
+        _batches = []
+        _batch = []
+        _batch_tokens = 0
+        for _position, _text in enumerate(texts):
+            _tokens = min(self.token_counter.count(_text), MAX_TOKENS_PER_INPUT)
+            if _batch and (
+                len(_batch) >= self.max_items_per_request
+                or _batch_tokens + _tokens > self.max_tokens_per_request
+            ):
+                _batches.append((_batch, _batch_tokens))
+                _batch = []
+                _batch_tokens = 0
+            _batch.append(_position)
+            _batch_tokens += _tokens
+        if _batch:
+            _batches.append((_batch, _batch_tokens))
+        return _batches
+
+    async def _wait_for_pause(self):
+        _delay = self._paused_until - time.monotonic()
+        if _delay > 0:
+            await asyncio.sleep(_delay)
+
+    async def _send(self, inputs: list, tokens: int):
+        _kwargs = {"model": self.deployment, "input": inputs}
+        if self.dimensions:
+            _kwargs["dimensions"] = self.dimensions
+        _backoff = 1.0
+        # Reserved once, retries of a rejected request don't use quota twice
+        await self.rate_tracker.reserve(tokens)
+        for _attempt in range(self.max_retries + 1):
+            await self._wait_for_pause()
+            await self.limiter.acquire()
+            _delay = 0.0
+            try:
+                self.requests += 1
+                _response = await self.client.embeddings.create(**_kwargs)
+            except openai.RateLimitError as e:
+                self.throttled += 1
+                _delay = retry_after_seconds(e) or _backoff * (1 + random.random())
+                # Every sender waits out the throttle window, not just this one
+                self._paused_until = max(self._paused_until, time.monotonic() + _delay)
+                await self.limiter.on_throttle()
+                _logger.debug("Throttled, backing off %.2fs (limit %d)", _delay, self.limiter.limit)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                _delay = _backoff * (1 + random.random())
+                _logger.debug("Embedding request failed (%s), retrying in %.2fs", e, _delay)
+            else:
+                await self.limiter.on_success()
+                self.texts_embedded += len(inputs)
+                self.tokens_sent += _response.usage.total_tokens if _response.usage else tokens
+                return [_item.embedding for _item in sorted(_response.data, key=lambda d: d.index)]
+            finally:
+                await self.limiter.release()
+            self.retries += 1
+            _backoff = min(_backoff * 2, 60.0)
+            await asyncio.sleep(_delay)
+        raise RuntimeError(f"Embedding request failed after {self.max_retries} retries")
+
+    async def embed(self, texts: list):
+        """Embed texts, returning one vector per text in input order."""
+        if self._started is None:
+            self._started = time.perf_counter()
+        _vectors = [None] * len(texts)
+
+        async def _run(positions, tokens):
+            _result = await self._send([texts[_position] for _position in positions], tokens)
+            for _position, _vector in zip(positions, _result):
+                _vectors[_position] = _vector
+
+        await asyncio.gather(*(_run(_positions, _tokens) for _positions, _tokens in self.pack(texts)))
+        return _vectors
+
+    async def embed_query(self, text: str):
+        return (await self.embed([text]))[0]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self):
+        _elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "texts": self.texts_embedded,
+            "tokens": self.tokens_sent,
+            "seconds": round(_elapsed, 3),
+            "texts_per_second": round(self.texts_embedded / _elapsed, 2) if _elapsed else 0.0,
+            "tokens_per_minute": round(self.tokens_sent / _elapsed * 60, 1) if _elapsed else 0.0,
+            "window_tokens": self.rate_tracker.used(),
+            "concurrency_limit": self.limiter.limit,
+        }
+
+
+class EmbeddingEngine:
+    """Synchronous facade running an :class:`AsyncEmbeddingClient` on a background loop.
+
+    Lets thread-based callers (the push indexer, CLI query path) share one client,
+    one connection pool and one rate budget.
+    """
+
+    def __init__(self, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self.client = self._call(self._create(kwargs))
+
+    @staticmethod
+    async def _create(kwargs):
+        # asyncio primitives must be created on the loop that uses them
+        return AsyncEmbeddingClient(**kwargs)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def embed(self, texts: list):
+        return self._call(self.client.embed(texts))
+
+    def embed_query(self, text: str):
+        return self._call(self.client.embed_query(text))
+
+    def stats(self):
+        return self.client.stats()
+
+    def close(self):
+        self._call(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint, omit with --mock",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI model dimensions",
+        default=None,
+    )
+    parser.add_argument(
+        "--texts",
+        type=int,
+        help="Number of synthetic chunks to embed",
+        default=2000,
+    )
+    parser.add_argument(
+        "--max-items-per-request",
+        type=int,
+        help="Maximum chunks per embedding request",
+        default=16,
+    )
+    parser.add_argument(
+        "--max-tokens-per-request",
+        type=int,
+        help="Maximum tokens per embedding request",
+        default=8000,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        help="Embedding requests in flight",
+        default=4,
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        help="Client-side tokens-per-minute budget (0 disables)",
+        default=0,
+    )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Benchmark against a local fake embeddings endpoint",
+        default=False,
+    )
+    parser.add_argument(
+        "--mock-tokens-per-minute",
+        type=int,
+        help="Quota enforced by the fake endpoint (0 disables)",
+        default=0,
+    )
+    parser.add_argument(
+        "--mock-latency-ms",
+        type=float,
+        help="Latency added by the fake endpoint",
+        default=20.0,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    if not _args.mock and not _args.azure_openai_endpoint:
+        parser.error("--azure-openai-endpoint is required unless --mock is set")
+
+    _server = None
+    _endpoint = _args.azure_openai_endpoint
+    if _args.mock:
+        from fake_azure import FakeAzureServer
+
+        _server = FakeAzureServer(
+            dimensions=_args.azure_openai_model_dimensions or 1536,
+            tokens_per_minute=_args.mock_tokens_per_minute,
+            latency_ms=_args.mock_latency_ms,
+        ).start()
+        _endpoint = _server.endpoint
+        os.environ.setdefault("AZURE_OPENAI_KEY", "fake")
+
+    _random = random.Random(0)
+    _words = ["benefit", "plan", "coverage", "employee", "handbook", "deductible", "role", "policy"]
+    _texts = [
+        " ".join(_random.choice(_words) for _ in range(_random.randint(50, 400)))
+        for _ in range(_args.texts)
+    ]
+
+    _engine = EmbeddingEngine(
+        endpoint=_endpoint,
+        deployment=_args.azure_openai_embedding_deployment,
+        dimensions=_args.azure_openai_model_dimensions,
+        max_items_per_request=_args.max_items_per_request,
+        max_tokens_per_request=_args.max_tokens_per_request,
+        max_concurrency=_args.max_concurrency,
+        tokens_per_minute=_args.tokens_per_minute,
+    )
+    try:
+        _engine.embed(_texts)
+        print(json.dumps(_engine.stats()))
+    finally:
+        _engine.close()
+        if _server is not None:
+            _server.stop()
+
+
+if __name__ == "__main__":
+    main()
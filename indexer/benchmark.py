@@ -0,0 +1,490 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from azure.search.documents.models import VectorizedQuery
+
+from chunker import extract_pages
+from clients import get_factory
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+QUERY_MODES = ("keyword", "vector", "hybrid", "semantic")
+QUERY_SETS = ("config", "notebooks", "synthetic")
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_NOTEBOOK_QUERY_PATTERN = re.compile(r"(?:user_question|search_query)\s*=\s*\"([^\"]+)\"")
+_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'-]+")
+
+
+def config_queries(config_path: str) -> list:
+    """The ``TestQuery`` of a deployment config."""
+    with open(config_path, "r", encoding="utf-8") as _file:
+        _query = (yaml.safe_load(_file).get("variables") or {}).get("TestQuery")
+    return [_query] if _query else []
+
+
+def notebook_queries(notebook_dir: str) -> list:
+    """Questions assigned to ``user_question`` or ``search_query`` in the notebooks."""
+    _queries = []
+    for _path in sorted(glob.glob(os.path.join(notebook_dir, "*.ipynb"))):
+        with open(_path, "r", encoding="utf-8") as _file:
+            _notebook = json.load(_file)
+        for _cell in _notebook.get("cells", []):
+            if _cell.get("cell_type") == "code":
+                _queries.extend(_NOTEBOOK_QUERY_PATTERN.findall("".join(_cell.get("source", []))))
+    return list(dict.fromkeys(_queries))
+
+
+def synthetic_queries(source_dir: str, count: int, seed: int = 0) -> list:
+    """Random 3-8 word spans of the source documents, a stand-in for user traffic."""
+    _words = []
+    for _path in sorted(glob.glob(os.path.join(source_dir, "**", "*"), recursive=True)):
+        if os.path.isfile(_path):
+            with open(_path, "rb") as _file:
+                for _, _text in extract_pages(_path, _file.read()):
+                    _words.extend(_WORD_PATTERN.findall(_text))
+    if not _words:
+        return []
+    _random = random.Random(seed)
+    _queries = []
+    for _ in range(count):
+        _length = _random.randint(3, 8)
+        _start = _random.randrange(max(len(_words) - _length, 1))
+        _queries.append(" ".join(_words[_start : _start + _length]))
+    return _queries
+
+
+def file_queries(path: str) -> list:
+    """One query per line, or JSON lines with a ``query`` or ``question`` field."""
+    _queries = []
+    with open(path, "r", encoding="utf-8") as _file:
+        for _line in _file:
+            _line = _line.strip()
+            if not _line:
+                continue
+            if _line.startswith("{"):
+                _record = json.loads(_line)
+                _line = _record.get("query") or _record.get("question")
+            _queries.append(_line)
+    return _queries
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SearchBenchmark:
+    """Replays query sets against an index at several concurrency levels.
+
+    Every query records ``embed`` (vector modes), ``search`` and ``total``
+    latency. A replay reports QPS and p50/p95/p99 per stage.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.search_client = get_factory(
+            args.search_endpoint, pool_maxsize=max(args.concurrency)
+        ).search_client(args.index_name)
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from async_embedder import EmbeddingEngine
+
+            self._engine = EmbeddingEngine(
+                endpoint=self.args.azure_openai_endpoint,
+                deployment=self.args.azure_openai_embedding_deployment,
+                dimensions=self.args.azure_openai_model_dimensions,
+                max_concurrency=max(self.args.concurrency),
+            )
+        return self._engine
+
+    def query(self, text: str, mode: str, recorder: LatencyRecorder):
+        _args = self.args
+        _started = time.perf_counter()
+        _kwargs = {"top": _args.top}
+        if mode != "keyword":
+            with recorder.time("embed"):
+                _vector = self.engine.embed_query(text)
+            _kwargs["vector_queries"] = [
+                VectorizedQuery(
+                    vector=_vector,
+                    k_nearest_neighbors=_args.k_nearest_neighbors,
+                    fields="vector",
+                    exhaustive=_args.exhaustive,
+                )
+            ]
+        if mode == "semantic":
+            _kwargs["query_type"] = "semantic"
+            _kwargs["semantic_configuration_name"] = f"{_args.index_name}-semantic-config"
+        with recorder.time("search"):
+            _results = list(
+                self.search_client.search(search_text=None if mode == "vector" else text, **_kwargs)
+            )
+        recorder.record("total", time.perf_counter() - _started)
+        return len(_results)
+
+    def replay(self, queries: list, mode: str, concurrency: int):
+        _recorder = LatencyRecorder()
+        _workload = queries * self.args.iterations
+        _errors = 0
+
+        def _run(text):
+            try:
+                return self.query(text, mode, _recorder)
+            except Exception:
+                _logger.exception("Query failed: %s", text)
+                return None
+
+        _started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as _executor:
+            _hits = list(_executor.map(_run, _workload))
+        _elapsed = time.perf_counter() - _started
+        _errors = sum(1 for _hit in _hits if _hit is None)
+        _completed = len(_workload) - _errors
+        return {
+            "mode": mode,
+            "concurrency": concurrency,
+            "queries": len(_workload),
+            "errors": _errors,
+            "seconds": round(_elapsed, 3),
+            "qps": round(_completed / _elapsed, 2) if _elapsed else 0.0,
+            "latency": _recorder.summary(),
+        }
+
+    def run(self, queries: list):
+        _results = []
+        if self.args.warmup:
+            for _mode in self.args.modes:
+                self.replay(queries[: self.args.warmup], _mode, 1)
+        for _mode in self.args.modes:
+            for _concurrency in self.args.concurrency:
+                _result = self.replay(queries, _mode, _concurrency)
+                logging.info(
+                    "%s x%d: %.1f qps, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms",
+                    _mode,
+                    _concurrency,
+                    _result["qps"],
+                    _result["latency"]["total"]["p50_ms"],
+                    _result["latency"]["total"]["p95_ms"],
+                    _result["latency"]["total"]["p99_ms"],
+                )
+                _results.append(_result)
+        return _results
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.close()
+
+
+def ingest(args):
+    """Push-ingest ``--source-dir`` into the benchmark index and return the ingestion stats."""
+    from push_indexer import build_parser, ingest as push_ingest
+
+    _argv = [
+        "--search-endpoint", args.search_endpoint,
+        "--index-name", args.index_name,
+        "--source-dir", args.source_dir,
+        "--azure-openai-endpoint", args.azure_openai_endpoint,
+        "--azure-openai-embedding-deployment", args.azure_openai_embedding_deployment,
+    ]
+    if args.azure_openai_model_dimensions:
+        _argv += ["--azure-openai-model-dimensions", str(args.azure_openai_model_dimensions)]
+    if getattr(args, "pipeline", False):
+        _argv.append("--pipeline")
+    return push_ingest(build_parser().parse_args(_argv))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Replays whose QPS dropped or p95 rose by more than ``tolerance`` percent against a baseline."""
+    _baseline = {(_run["mode"], _run["concurrency"]): _run for _run in baseline.get("queries", [])}
+    _regressions = []
+    for _run in results.get("queries", []):
+        _before = _baseline.get((_run["mode"], _run["concurrency"]))
+        if _before is None:
+            continue
+        _checks = [
+            ("qps", _before["qps"], _run["qps"], -1),
+            ("p95_ms", _before["latency"]["total"]["p95_ms"], _run["latency"]["total"]["p95_ms"], 1),
+        ]
+        for _metric, _old, _new, _direction in _checks:
+            if _old and _direction * (_new - _old) / _old * 100 > tolerance:
+                _regressions.append(
+                    {
+                        "mode": _run["mode"],
+                        "concurrency": _run["concurrency"],
+                        "metric": _metric,
+                        "baseline": _old,
+                        "current": _new,
+                    }
+                )
+    _ingest_before = (baseline.get("ingestion") or {}).get("docs_per_second")
+    _ingest_now = (results.get("ingestion") or {}).get("docs_per_second")
+    if _ingest_before and _ingest_now and (_ingest_before - _ingest_now) / _ingest_before * 100 > tolerance:
+        _regressions.append(
+            {"metric": "docs_per_second", "baseline": _ingest_before, "current": _ingest_now}
+        )
+    return _regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint (ignored with --mock)",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        default="benchmark",
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint (ignored with --mock)",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI model dimensions",
+        default=None,
+    )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Benchmark against an in-process fake search and embedding endpoint",
+        default=False,
+    )
+    parser.add_argument(
+        "--mock-vector-algorithm",
+        choices=("exhaustive", "hnsw"),
+        help="Vector algorithm of the fake search endpoint",
+        default="hnsw",
+    )
+    parser.add_argument(
+        "--mock-latency-ms",
+        type=float,
+        help="Artificial latency of fake embedding requests",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        help="Documents to ingest before querying (required with --mock), also used for synthetic queries",
+        default=None,
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Ingest through the staged concurrent pipeline",
+        default=False,
+    )
+    parser.add_argument(
+        "--query-sets",
+        nargs="+",
+        choices=QUERY_SETS,
+        help="Built-in query sets to replay",
+        default=list(QUERY_SETS),
+    )
+    parser.add_argument(
+        "--queries-file",
+        type=str,
+        help="Extra queries, one per line or JSON lines with a query field",
+        default=None,
+    )
+    parser.add_argument(
+        "--synthetic-queries",
+        type=int,
+        help="Number of synthetic queries sampled from --source-dir",
+        default=50,
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=QUERY_MODES,
+        help="Query modes to benchmark",
+        default=["keyword", "vector", "hybrid"],
+    )
+    parser.add_argument(
+        "--concurrency",
+        nargs="+",
+        type=int,
+        help="Concurrency levels to replay at",
+        default=[1, 4, 16],
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        help="Passes over the query set per replay",
+        default=1,
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        help="Queries per mode sent before timing",
+        default=5,
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Results per query",
+        default=5,
+    )
+    parser.add_argument(
+        "--k-nearest-neighbors",
+        type=int,
+        help="Vector query k",
+        default=50,
+    )
+    parser.add_argument(
+        "--exhaustive",
+        action="store_true",
+        help="Force exhaustive vector search",
+        default=False,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Results file of a previous run to compare against",
+        default=None,
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="Allowed regression against --baseline, in percent",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        # Per-request SDK logging would dominate the output
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+
+    _server = None
+    if _args.mock:
+        if not _args.source_dir:
+            parser.error("--mock requires --source-dir")
+        from fake_azure import FakeAzureServer
+
+        os.environ.setdefault("AZURE_SEARCH_KEY", "fake")
+        os.environ.setdefault("AZURE_OPENAI_KEY", "fake")
+        _server = FakeAzureServer(
+            dimensions=_args.azure_openai_model_dimensions or 1536,
+            latency_ms=_args.mock_latency_ms,
+            vector_algorithm=_args.mock_vector_algorithm,
+        ).start()
+        _args.search_endpoint = _server.endpoint
+        _args.azure_openai_endpoint = _server.endpoint
+    elif not _args.search_endpoint:
+        parser.error("--search-endpoint is required without --mock")
+    if set(_args.modes) - {"keyword"} and not _args.azure_openai_endpoint:
+        parser.error("vector modes need --azure-openai-endpoint")
+
+    _queries = []
+    if "config" in _args.query_sets:
+        _queries += config_queries(os.path.join(_REPO_ROOT, "deployments", "config.yaml"))
+    if "notebooks" in _args.query_sets:
+        _queries += notebook_queries(os.path.join(_REPO_ROOT, "Experimental Notebooks"))
+    if "synthetic" in _args.query_sets and _args.source_dir:
+        _queries += synthetic_queries(_args.source_dir, _args.synthetic_queries)
+    if _args.queries_file:
+        _queries += file_queries(_args.queries_file)
+    if not _queries:
+        parser.error("no queries to replay")
+
+    _results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {
+            "mock": _args.mock,
+            "vector_algorithm": _args.mock_vector_algorithm if _args.mock else "service",
+            "index_name": _args.index_name,
+            "query_count": len(_queries),
+            "top": _args.top,
+            "k_nearest_neighbors": _args.k_nearest_neighbors,
+            "exhaustive": _args.exhaustive,
+            "iterations": _args.iterations,
+        },
+        "ingestion": None,
+        "queries": [],
+    }
+    _benchmark = None
+    try:
+        if _args.source_dir:
+            _results["ingestion"] = ingest(_args)
+        _benchmark = SearchBenchmark(_args)
+        _results["queries"] = _benchmark.run(_queries)
+    finally:
+        if _benchmark is not None:
+            _benchmark.close()
+        if _server is not None:
+            _server.stop()
+
+    _exit_code = 0
+    if _args.baseline:
+        with open(_args.baseline, "r", encoding="utf-8") as _file:
+            _regressions = compare(_results, json.load(_file), _args.tolerance)
+        _results["regressions"] = _regressions
+        for _regression in _regressions:
+            logging.warning("Regression %s", _regression)
+        _exit_code = 1 if _regressions else 0
+
+    _output = json.dumps(_results, indent=2)
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            _file.write(_output)
+        logging.info("Results written to %s", _args.output)
+    else:
+        print(_output)
+    return _exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
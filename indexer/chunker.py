@@ -0,0 +1,345 @@
+import argparse
+import io
+import json
+import logging
+import os
+import re
+import time
+import tracemalloc
+from collections import namedtuple
+
+from pypdf import PdfReader
+
+
+_logger = logging.getLogger(__name__)
+
+# Defaults of the SplitSkill used by every skillset mode in skillset.py
+DEFAULT_MAXIMUM_PAGE_LENGTH = 2000
+DEFAULT_PAGE_OVERLAP_LENGTH = 500
+
+CHUNKING_MODES = ("pages", "tokens", "markdown")
+
+_SENTENCE_PATTERN = re.compile(r"[^.!?\n]*(?:[.!?]+[\"')\]]*|\n+|$)\s*")
+_HEADER_PATTERN = re.compile(r"^(#{1,3})\s+(.*?)\s*#*\s*$")
+
+Chunk = namedtuple("Chunk", ["text", "page_number", "headers"])
+
+
+def extract_pages(name: str, data: bytes):
+    """Extract text from a source document page by page.
+
+    Args:
+        name (str): blob or file name, used to pick the parser
+        data (bytes): raw document content
+
+    Returns:
+        generator: (page_number, text) tuples, page numbers start at 1
+    """
+    if name.lower().endswith(".pdf"):
+        _reader = PdfReader(io.BytesIO(data))
+        for _page_number, _page in enumerate(_reader.pages, start=1):
+            yield _page_number, _page.extract_text() or ""
+    else:
+        yield 1, data.decode("utf-8", errors="ignore")
+
+
+def split_units(text: str):
+    """Split text into sentence-like units, keeping trailing whitespace."""
+    for _match in _SENTENCE_PATTERN.finditer(text):
+        _unit = _match.group(0)
+        if _unit:
+            yield _unit
+
+
+class Chunker:
+    """Local re-implementation of the SplitSkill ``pages`` mode plus token and markdown modes.
+
+    Every method is a generator over (page_number, text) pairs, so a document is
+    never materialized as a full list of chunks.
+
+    Args:
+        mode (str): ``pages`` (characters), ``tokens`` or ``markdown`` (header-aware pages)
+        maximum_page_length (int): maximum chunk size, in characters or tokens
+        page_overlap_length (int): overlap carried into the next chunk, same unit
+        token_counter: object with a ``count(text)`` method, used by ``tokens`` mode
+    """
+
+    def __init__(
+        self,
+        mode: str = "pages",
+        maximum_page_length: int = DEFAULT_MAXIMUM_PAGE_LENGTH,
+        page_overlap_length: int = DEFAULT_PAGE_OVERLAP_LENGTH,
+        token_counter=None,
+    ):
+        if mode not in CHUNKING_MODES:
+            raise ValueError(f"Unknown chunking mode {mode}, expected one of {CHUNKING_MODES}")
+        if page_overlap_length >= maximum_page_length:
+            raise ValueError("page_overlap_length must be smaller than maximum_page_length")
+        self.mode = mode
+        self.maximum_page_length = maximum_page_length
+        self.page_overlap_length = page_overlap_length
+        if mode == "tokens":
+            if token_counter is None:
+                from async_embedder import TokenCounter
+
+                token_counter = TokenCounter()
+            self.measure = token_counter.count
+        else:
+            self.measure = len
+
+    def _hard_split(self, unit: str):
+        """Break a unit longer than a page on whitespace, or mid-word as a last resort."""
+        _words = re.findall(r"\S+\s*", unit)
+        _piece = ""
+        for _word in _words:
+            if _piece and self.measure(_piece + _word) > self.maximum_page_length:
+                yield _piece
+                _piece = ""
+            while self.measure(_word) > self.maximum_page_length:
+                _cut = max(1, len(_word) * self.maximum_page_length // self.measure(_word))
+                yield _word[:_cut]
+                _word = _word[_cut:]
+            _piece += _word
+        if _piece:
+            yield _piece
+
+    def _overlap(self, text: str) -> str:
+        """Trailing words of a chunk that fit in ``page_overlap_length``."""
+        if not self.page_overlap_length:
+            return ""
+        _window = self.page_overlap_length * (1 if self.measure is len else 8)
+        _tail = text[-_window:]
+        if len(text) > _window and not text[-_window - 1].isspace():
+            # Never start the overlap in the middle of a word
+            _space = _tail.find(" ")
+            _tail = _tail[_space:] if _space >= 0 else ""
+        while _tail and self.measure(_tail) > self.page_overlap_length:
+            _space = _tail.find(" ", 1)
+            _tail = _tail[_space:] if _space > 0 else ""
+        return _tail.lstrip()
+
+    def split_text(self, text: str):
+        """Yield overlapping chunks of one text, breaking at sentence boundaries."""
+        _splitter = _PageSplitter(self)
+        yield from _splitter.feed(text)
+        yield from _splitter.finish()
+
+    def chunk_pages(self, pages):
+        """Yield :class:`Chunk` records for an iterable of (page_number, text) pairs.
+
+        Chunks end at page boundaries so each has one page number, but the
+        overlap carries into the next page's first chunk as SplitSkill's
+        overlap does over the whole document. Markdown chunks end at headers
+        without carrying an overlap.
+        """
+        _splitter = _PageSplitter(self)
+        if self.mode != "markdown":
+            for _page_number, _text in pages:
+                _splitter.page_number = _page_number
+                for _text_chunk, _chunk_page in _splitter.feed(_text, with_pages=True):
+                    yield Chunk(_text_chunk, _chunk_page, {})
+                for _text_chunk, _chunk_page in _splitter.finish(with_pages=True, carry_overlap=True):
+                    yield Chunk(_text_chunk, _chunk_page, {})
+            return
+
+        # Markdown sections are fed line by line so a long section (or a PDF
+        # without headers) never accumulates in memory
+        _headers = {}
+        for _page_number, _text in pages:
+            _splitter.page_number = _page_number
+            for _line in _text.splitlines(keepends=True):
+                _match = _HEADER_PATTERN.match(_line)
+                if _match:
+                    for _text_chunk, _chunk_page in _splitter.finish(with_pages=True):
+                        yield Chunk(_text_chunk, _chunk_page, dict(_headers))
+                    _level = len(_match.group(1))
+                    _headers = {
+                        _key: _value
+                        for _key, _value in _headers.items()
+                        if int(_key[-1]) < _level
+                    }
+                    _headers[f"header_{_level}"] = _match.group(2)
+                    continue
+                for _text_chunk, _chunk_page in _splitter.feed(_line, with_pages=True):
+                    yield Chunk(_text_chunk, _chunk_page, dict(_headers))
+        for _text_chunk, _chunk_page in _splitter.finish(with_pages=True):
+            yield Chunk(_text_chunk, _chunk_page, dict(_headers))
+
+
+class _PageSplitter:
+    """Incremental state of :meth:`Chunker.split_text`: text is fed in, chunks come out."""
+
+    def __init__(self, chunker: Chunker):
+        self.chunker = chunker
+        self.page_number = None
+        self._current = ""
+        self._current_size = 0
+        self._current_page = None
+        self._has_new_content = False
+
+    def _emit(self, with_pages: bool):
+        _chunk = self._current.strip()
+        if _chunk:
+            yield (_chunk, self._current_page) if with_pages else _chunk
+
+    def feed(self, text: str, with_pages: bool = False):
+        _chunker = self.chunker
+        _measure = _chunker.measure
+        _maximum = _chunker.maximum_page_length
+        for _unit in split_units(text):
+            for _piece in (
+                _chunker._hard_split(_unit) if _measure(_unit) > _maximum else (_unit,)
+            ):
+                _size = _measure(_piece)
+                if self._has_new_content and self._current_size + _size > _maximum:
+                    yield from self._emit(with_pages)
+                    self._current = _chunker._overlap(self._current)
+                    self._current_size = _measure(self._current)
+                    self._has_new_content = False
+                if not self._has_new_content:
+                    self._make_room(_size)
+                    self._current_page = self.page_number
+                self._current += _piece
+                self._current_size += _size
+                self._has_new_content = True
+
+    def _make_room(self, size: int):
+        """Trim the overlap so it leaves room for at least the next piece."""
+        _measure = self.chunker.measure
+        while self._current and self._current_size + size > self.chunker.maximum_page_length:
+            _space = self._current.find(" ", 1)
+            self._current = self._current[_space:].lstrip() if _space > 0 else ""
+            self._current_size = _measure(self._current)
+
+    def finish(self, with_pages: bool = False, carry_overlap: bool = False):
+        """Emit the last chunk, ``carry_overlap`` starts the next text with its overlap."""
+        _current = ""
+        if self._has_new_content:
+            yield from self._emit(with_pages)
+            if carry_overlap:
+                _current = self.chunker._overlap(self._current)
+                if _current and not _current[-1].isspace():
+                    _current += " "
+        elif carry_overlap:
+            _current = self._current
+        self._current = _current
+        self._current_size = self.chunker.measure(_current)
+        self._has_new_content = False
+
+
+def benchmark(paths: list, modes, maximum_page_length: int, page_overlap_length: int, maximum_tokens: int, overlap_tokens: int):
+    """Chunk every file with every mode and report counts, sizes and chunks/sec.
+
+    Text extraction happens once up front so the timings and peak memory cover
+    chunking only.
+    """
+    _documents = []
+    for _path in paths:
+        with open(_path, "rb") as _file:
+            _documents.append(list(extract_pages(_path, _file.read())))
+
+    _results = []
+    for _mode in modes:
+        _is_tokens = _mode == "tokens"
+        _chunker = Chunker(
+            _mode,
+            maximum_tokens if _is_tokens else maximum_page_length,
+            overlap_tokens if _is_tokens else page_overlap_length,
+        )
+        _chunks = 0
+        _characters = 0
+        tracemalloc.start()
+        _started = time.perf_counter()
+        for _pages in _documents:
+            for _chunk in _chunker.chunk_pages(_pages):
+                _chunks += 1
+                _characters += len(_chunk.text)
+        _seconds = time.perf_counter() - _started
+        _peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        _results.append(
+            {
+                "mode": _mode,
+                "files": len(paths),
+                "chunks": _chunks,
+                "avg_chunk_chars": round(_characters / _chunks, 1) if _chunks else 0,
+                "seconds": round(_seconds, 3),
+                "chunks_per_second": round(_chunks / _seconds, 1) if _seconds else 0.0,
+                "peak_memory_bytes": _peak,
+            }
+        )
+    return _results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Files or directories to chunk",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=CHUNKING_MODES,
+        help="Chunking modes to benchmark",
+        default=list(CHUNKING_MODES),
+    )
+    parser.add_argument(
+        "--maximum-page-length",
+        type=int,
+        help="Maximum chunk length in characters",
+        default=DEFAULT_MAXIMUM_PAGE_LENGTH,
+    )
+    parser.add_argument(
+        "--page-overlap-length",
+        type=int,
+        help="Chunk overlap in characters",
+        default=DEFAULT_PAGE_OVERLAP_LENGTH,
+    )
+    parser.add_argument(
+        "--maximum-tokens",
+        type=int,
+        help="Maximum chunk length in tokens for the tokens mode",
+        default=512,
+    )
+    parser.add_argument(
+        "--overlap-tokens",
+        type=int,
+        help="Chunk overlap in tokens for the tokens mode",
+        default=128,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _files = []
+    for _path in _args.paths:
+        if os.path.isdir(_path):
+            for _root, _dirs, _names in os.walk(_path):
+                _files.extend(os.path.join(_root, _name) for _name in sorted(_names))
+        else:
+            _files.append(_path)
+
+    for _result in benchmark(
+        _files,
+        _args.modes,
+        _args.maximum_page_length,
+        _args.page_overlap_length,
+        _args.maximum_tokens,
+        _args.overlap_tokens,
+    ):
+        print(json.dumps(_result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AccessToken, AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient, SearchIndexerClient
+
+
+_logger = logging.getLogger(__name__)
+
+CREDENTIAL_KINDS = ("key", "cli", "default")
+
+# Refresh cached AAD tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+
+class CachedTokenCredential:
+    """Wrap a token credential so each scope's token is fetched once until it nears expiry.
+
+    ``AzureCliCredential`` shells out to ``az`` on every ``get_token`` call, which
+    costs far more than the search request it authorizes.
+    """
+
+    def __init__(self, credential, refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.fetches = 0
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        _token = self._tokens.get(key)
+        if _token is not None and _token.expires_on - self.refresh_margin > time.time():
+            return _token
+        return None
+
+    def get_token(self, *scopes, **kwargs) -> AccessToken:
+        _key = (scopes, kwargs.get("tenant_id"), kwargs.get("claims"))
+        with self._lock:
+            _token = self._cached(_key)
+            if _token is None:
+                _token = self.credential.get_token(*scopes, **kwargs)
+                self._tokens[_key] = _token
+                self.fetches += 1
+            return _token
+
+    def close(self):
+        _close = getattr(self.credential, "close", None)
+        if _close is not None:
+            _close()
+
+
+class AsyncCachedTokenCredential(CachedTokenCredential):
+    """Async counterpart of :class:`CachedTokenCredential` for ``azure.identity.aio`` credentials."""
+
+    def __init__(self, credential, refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        super().__init__(credential, refresh_margin)
+        self._lock = asyncio.Lock()
+
+    async def get_token(self, *scopes, **kwargs) -> AccessToken:
+        _key = (scopes, kwargs.get("tenant_id"), kwargs.get("claims"))
+        async with self._lock:
+            _token = self._cached(_key)
+            if _token is None:
+                _token = await self.credential.get_token(*scopes, **kwargs)
+                self._tokens[_key] = _token
+                self.fetches += 1
+            return _token
+
+    async def close(self):
+        await self.credential.close()
+
+
+class ClientFactory:
+    """Hands out Azure AI Search clients that share credentials and pooled HTTP connections.
+
+    Every sync client rides on one ``requests`` session, so TLS sessions and
+    keep-alive connections are reused across SearchClient, SearchIndexClient
+    and SearchIndexerClient calls. Async clients share one ``aiohttp`` session
+    per event loop. Clients are cached per (kind, index, credential).
+
+    Args:
+        search_endpoint (str): Azure AI Search endpoint
+        credential_kind (str): default credential, ``key``, ``cli`` or ``default``
+        pool_connections (int): number of host pools kept by the session
+        pool_maxsize (int): keep-alive connections per host, size it to the concurrency
+        connection_timeout (float): seconds to establish a connection
+        read_timeout (float): seconds to wait for a response
+    """
+
+    def __init__(
+        self,
+        search_endpoint: str,
+        credential_kind: str = "key",
+        pool_connections: int = 4,
+        pool_maxsize: int = 32,
+        connection_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+    ):
+        if credential_kind not in CREDENTIAL_KINDS:
+            raise ValueError(f"Unknown credential kind {credential_kind}, expected one of {CREDENTIAL_KINDS}")
+        self.search_endpoint = search_endpoint
+        self.credential_kind = credential_kind
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connection_timeout = connection_timeout
+        self.read_timeout = read_timeout
+        self._credentials = {}
+        self._clients = {}
+        self._session = None
+        self._transport = None
+        self._async_sessions = {}
+        self._lock = threading.RLock()
+
+    def credential(self, kind: str = None):
+        """Return the cached credential of ``kind`` (the factory default when omitted)."""
+        _kind = kind or self.credential_kind
+        with self._lock:
+            if _kind not in self._credentials:
+                if _kind == "key":
+                    self._credentials[_kind] = AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+                elif _kind == "cli":
+                    from azure.identity import AzureCliCredential
+
+                    self._credentials[_kind] = CachedTokenCredential(AzureCliCredential())
+                elif _kind == "default":
+                    from azure.identity import DefaultAzureCredential
+
+                    self._credentials[_kind] = CachedTokenCredential(DefaultAzureCredential())
+                else:
+                    raise ValueError(f"Unknown credential kind {_kind}, expected one of {CREDENTIAL_KINDS}")
+            return self._credentials[_kind]
+
+    @property
+    def transport(self) -> RequestsTransport:
+        with self._lock:
+            if self._transport is None:
+                self._session = requests.Session()
+                _adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    pool_block=False,
+                )
+                self._session.mount("https://", _adapter)
+                self._session.mount("http://", _adapter)
+                # session_owner=False keeps the pool alive when one client is closed
+                self._transport = RequestsTransport(
+                    session=self._session,
+                    session_owner=False,
+                    connection_timeout=self.connection_timeout,
+                    read_timeout=self.read_timeout,
+                )
+            return self._transport
+
+    def _client(self, key, build):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = build()
+            return self._clients[key]
+
+    def search_client(self, index_name: str, credential: str = None) -> SearchClient:
+        return self._client(
+            ("search", index_name, credential),
+            lambda: SearchClient(
+                self.search_endpoint,
+                index_name,
+                credential=self.credential(credential),
+                transport=self.transport,
+            ),
+        )
+
+    def index_client(self, credential: str = None) -> SearchIndexClient:
+        return self._client(
+            ("index", None, credential),
+            lambda: SearchIndexClient(
+                self.search_endpoint,
+                credential=self.credential(credential),
+                transport=self.transport,
+            ),
+        )
+
+    def indexer_client(self, credential: str = None) -> SearchIndexerClient:
+        return self._client(
+            ("indexer", None, credential),
+            lambda: SearchIndexerClient(
+                self.search_endpoint,
+                credential=self.credential(credential),
+                transport=self.transport,
+            ),
+        )
+
+    def async_credential(self, kind: str = None):
+        """Credential usable by ``aio`` clients; AAD credentials come from ``azure.identity.aio``."""
+        _kind = kind or self.credential_kind
+        if _kind == "key":
+            return self.credential("key")
+        _key = f"aio-{_kind}"
+        with self._lock:
+            if _key not in self._credentials:
+                if _kind == "cli":
+                    from azure.identity.aio import AzureCliCredential
+
+                    self._credentials[_key] = AsyncCachedTokenCredential(AzureCliCredential())
+                elif _kind == "default":
+                    from azure.identity.aio import DefaultAzureCredential
+
+                    self._credentials[_key] = AsyncCachedTokenCredential(DefaultAzureCredential())
+                else:
+                    raise ValueError(f"Unknown credential kind {_kind}, expected one of {CREDENTIAL_KINDS}")
+            return self._credentials[_key]
+
+    def async_transport(self):
+        """Transport over an ``aiohttp`` session owned by the running event loop.
+
+        Must be called from inside the loop that will use the clients.
+        """
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        _loop = asyncio.get_running_loop()
+        with self._lock:
+            _session = self._async_sessions.get(_loop)
+            if _session is None or _session.closed:
+                _session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=self.pool_maxsize * self.pool_connections,
+                        limit_per_host=self.pool_maxsize,
+                        keepalive_timeout=60,
+                    ),
+                    timeout=aiohttp.ClientTimeout(
+                        sock_connect=self.connection_timeout,
+                        sock_read=self.read_timeout,
+                    ),
+                )
+                self._async_sessions[_loop] = _session
+        return AioHttpTransport(session=_session, session_owner=False)
+
+    def async_search_client(self, index_name: str, credential: str = None):
+        from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+        _loop = asyncio.get_running_loop()
+        return self._client(
+            ("aio-search", index_name, credential, _loop),
+            lambda: AsyncSearchClient(
+                self.search_endpoint,
+                index_name,
+                credential=self.async_credential(credential),
+                transport=self.async_transport(),
+            ),
+        )
+
+    def async_index_client(self, credential: str = None):
+        from azure.search.documents.indexes.aio import SearchIndexClient as AsyncSearchIndexClient
+
+        _loop = asyncio.get_running_loop()
+        return self._client(
+            ("aio-index", None, credential, _loop),
+            lambda: AsyncSearchIndexClient(
+                self.search_endpoint,
+                credential=self.async_credential(credential),
+                transport=self.async_transport(),
+            ),
+        )
+
+    def stats(self):
+        _token_fetches = {
+            _kind: _credential.fetches
+            for _kind, _credential in self._credentials.items()
+            if isinstance(_credential, CachedTokenCredential)
+        }
+        return {
+            "clients": len(self._clients),
+            "token_fetches": _token_fetches,
+            "pool_maxsize": self.pool_maxsize,
+        }
+
+    async def aclose(self):
+        """Close the async clients, credentials and session of the running loop."""
+        _loop = asyncio.get_running_loop()
+        with self._lock:
+            _clients = [
+                (_key, _client) for _key, _client in self._clients.items()
+                if _key[0].startswith("aio-") and _key[-1] is _loop
+            ]
+            for _key, _client in _clients:
+                del self._clients[_key]
+            _session = self._async_sessions.pop(_loop, None)
+            _credentials = [
+                self._credentials.pop(_key)
+                for _key in [_key for _key in self._credentials if _key.startswith("aio-")]
+            ]
+        for _key, _client in _clients:
+            await _client.close()
+        for _credential in _credentials:
+            await _credential.close()
+        if _session is not None:
+            await _session.close()
+
+    def close(self):
+        with self._lock:
+            for _key, _client in list(self._clients.items()):
+                if not _key[0].startswith("aio-"):
+                    _client.close()
+                    del self._clients[_key]
+            for _key, _credential in list(self._credentials.items()):
+                if isinstance(_credential, CachedTokenCredential) and not _key.startswith("aio-"):
+                    _credential.close()
+                    del self._credentials[_key]
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                self._transport = None
+
+
+_factories = {}
+_factories_lock = threading.Lock()
+
+
+def get_factory(search_endpoint: str, credential_kind: str = "key", **kwargs) -> ClientFactory:
+    """Process-wide :class:`ClientFactory` for an endpoint and credential kind."""
+    with _factories_lock:
+        _key = (search_endpoint, credential_kind)
+        if _key not in _factories:
+            _factories[_key] = ClientFactory(search_endpoint, credential_kind, **kwargs)
+        return _factories[_key]
+
+
+def benchmark(search_endpoint: str, index_name: str, requests_count: int, credential_kind: str):
+    """Compare document-count calls through fresh clients against pooled factory clients."""
+    _results = {}
+    _started = time.perf_counter()
+    for _ in range(requests_count):
+        _factory = ClientFactory(search_endpoint, credential_kind)
+        _factory.search_client(index_name).get_document_count()
+        _factory.close()
+    _results["fresh_client_ms"] = round((time.perf_counter() - _started) * 1000 / requests_count, 2)
+
+    _factory = ClientFactory(search_endpoint, credential_kind)
+    _factory.search_client(index_name).get_document_count()
+    _started = time.perf_counter()
+    for _ in range(requests_count):
+        _factory.search_client(index_name).get_document_count()
+    _results["pooled_client_ms"] = round((time.perf_counter() - _started) * 1000 / requests_count, 2)
+    _results.update(_factory.stats())
+    _factory.close()
+    return _results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        required=True,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        required=True,
+    )
+    parser.add_argument(
+        "--credential",
+        choices=CREDENTIAL_KINDS,
+        help="Credential used by the clients",
+        default="key",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        help="Number of requests per benchmark mode",
+        default=20,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    print(benchmark(_args.search_endpoint, _args.index_name, _args.requests, _args.credential))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from async_embedder import TokenCounter
+
+
+_logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+ContextBlock = namedtuple("ContextBlock", ["title", "parent_id", "pages", "chunk_ids", "text", "score"])
+Context = namedtuple("Context", ["text", "blocks", "stats"])
+
+
+def overlap_length(left: str, right: str, min_overlap: int = 50) -> int:
+    """Length of the longest suffix of ``left`` that ``right`` starts with, 0 when shorter than ``min_overlap``.
+
+    The chunker starts every chunk with the trailing words of the previous
+    one, so consecutive chunks of a document overlap exactly.
+    """
+    _probe = right[:min_overlap]
+    if len(_probe) < min_overlap:
+        return 0
+    _start = left.find(_probe)
+    while _start != -1:
+        if right.startswith(left[_start:]):
+            return len(left) - _start
+        _start = left.find(_probe, _start + 1)
+    return 0
+
+
+def shingles(text: str, size: int = 5) -> frozenset:
+    _words = _WORD_PATTERN.findall(text.lower())
+    if len(_words) <= size:
+        return frozenset([tuple(_words)])
+    return frozenset(tuple(_words[_index : _index + size]) for _index in range(len(_words) - size + 1))
+
+
+def format_block(block: ContextBlock) -> str:
+    """Source entry in the prompt, same ``[title]: text`` form as the notebooks."""
+    return f"[{block.title}]: {block.text}\n"
+
+
+class ContextBuilder:
+    """Assembles retrieved chunks into a prompt context under a token budget.
+
+    Chunks of the same ``parent_id`` whose text overlaps (the chunker's
+    ``page_overlap_length`` carry-over) are stitched into one block. A chunk
+    contained in another, or whose word 5-gram Jaccard similarity to a kept
+    block reaches ``duplicate_threshold``, is dropped. Blocks are then packed
+    best score first; a block that does not fit is skipped so a smaller,
+    lower-ranked one can still use the remaining budget.
+
+    Args:
+        max_tokens (int): budget of the sources text, 0 for no limit
+        min_overlap (int): shortest overlap, in characters, that merges two chunks
+        duplicate_threshold (float): shingle similarity at which a chunk is a near duplicate
+        encoding_name (str): tiktoken encoding of the chat model
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 3000,
+        min_overlap: int = 50,
+        duplicate_threshold: float = 0.9,
+        encoding_name: str = "o200k_base",
+    ):
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        self.duplicate_threshold = duplicate_threshold
+        self.token_counter = TokenCounter(encoding_name)
+        self._lock = threading.Lock()
+        self._totals = {
+            "queries": 0,
+            "input_tokens": 0,
+            "deduplicated_tokens": 0,
+            "output_tokens": 0,
+            "merged": 0,
+            "duplicates": 0,
+            "over_budget": 0,
+        }
+
+    @staticmethod
+    def _score(document: dict) -> float:
+        _reranker_score = document.get("reranker_score", document.get("@search.reranker_score"))
+        if _reranker_score is not None:
+            return _reranker_score
+        return document.get("score", document.get("@search.score")) or 0.0
+
+    def _merge(self, documents: list):
+        """Stitch overlapping chunks of one document, returns (blocks, merged count)."""
+        _blocks = []
+        _merged = 0
+        for _document in documents:
+            _text = (_document.get("chunk") or "").strip()
+            _page = _document.get("page_number")
+            _block = ContextBlock(
+                _document.get("title"),
+                _document.get("parent_id"),
+                [_page] if _page is not None else [],
+                [_document.get("chunk_id")],
+                _text,
+                self._score(_document),
+            )
+            # Keep stitching until the block overlaps nothing else of its document
+            _changed = True
+            while _changed:
+                _changed = False
+                for _index, _other in enumerate(_blocks):
+                    if _other.parent_id != _block.parent_id or _other.parent_id is None:
+                        continue
+                    if _block.text in _other.text or _other.text in _block.text:
+                        _text = max(_other.text, _block.text, key=len)
+                    else:
+                        _after = overlap_length(_other.text, _block.text, self.min_overlap)
+                        _before = 0 if _after else overlap_length(_block.text, _other.text, self.min_overlap)
+                        if _after:
+                            _text = _other.text + _block.text[_after:]
+                        elif _before:
+                            _text = _block.text + _other.text[_before:]
+                        else:
+                            continue
+                    _block = ContextBlock(
+                        _block.title,
+                        _block.parent_id,
+                        sorted(set(_other.pages + _block.pages), key=str),
+                        _other.chunk_ids + _block.chunk_ids,
+                        _text,
+                        max(_other.score, _block.score),
+                    )
+                    del _blocks[_index]
+                    _merged += 1
+                    _changed = True
+                    break
+            _blocks.append(_block)
+        return _blocks, _merged
+
+    def build(self, documents: list) -> Context:
+        """Merge, deduplicate and pack ``documents`` (search results, best first) into a context."""
+        _documents = sorted(documents, key=self._score, reverse=True)
+        _blocks, _merged = self._merge(_documents)
+        _blocks.sort(key=lambda _block: _block.score, reverse=True)
+
+        _kept = []
+        _kept_shingles = []
+        _duplicates = 0
+        for _block in _blocks:
+            _shingles = shingles(_block.text)
+            if any(
+                len(_shingles & _other) / (len(_shingles | _other) or 1) >= self.duplicate_threshold
+                for _other in _kept_shingles
+            ):
+                _duplicates += 1
+                continue
+            _kept.append(_block)
+            _kept_shingles.append(_shingles)
+
+        _packed = []
+        _used = 0
+        _deduplicated_tokens = 0
+        _over_budget = 0
+        for _block in _kept:
+            _tokens = self.token_counter.count(format_block(_block)) + 1
+            _deduplicated_tokens += _tokens
+            if self.max_tokens and _used + _tokens > self.max_tokens:
+                _over_budget += 1
+                continue
+            _packed.append(_block)
+            _used += _tokens
+
+        _text = "\n\n".join(format_block(_block) for _block in _packed)
+        _input_tokens = self.token_counter.count(
+            "\n\n".join(f"[{_document.get('title')}]: {_document.get('chunk')}\n" for _document in documents)
+        )
+        _output_tokens = self.token_counter.count(_text)
+        _stats = {
+            "chunks": len(documents),
+            "blocks": len(_packed),
+            "merged": _merged,
+            "duplicates": _duplicates,
+            "over_budget": _over_budget,
+            "input_tokens": _input_tokens,
+            # Before packing, so merge and dedup savings are told apart from the budget cut
+            "deduplicated_tokens": _deduplicated_tokens,
+            "output_tokens": _output_tokens,
+            "saved_tokens": _input_tokens - _output_tokens,
+        }
+        with self._lock:
+            self._totals["queries"] += 1
+            for _name in ("input_tokens", "deduplicated_tokens", "output_tokens", "merged", "duplicates", "over_budget"):
+                self._totals[_name] += _stats[_name]
+        return Context(_text, _packed, _stats)
+
+    def stats(self):
+        with self._lock:
+            _totals = dict(self._totals)
+        _queries = _totals["queries"] or 1
+        _totals["saved_tokens"] = _totals["input_tokens"] - _totals["output_tokens"]
+        _totals["avg_saved_tokens"] = round(_totals["saved_tokens"] / _queries, 1)
+        _totals["saved_ratio"] = round(_totals["saved_tokens"] / (_totals["input_tokens"] or 1), 4)
+        return _totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-endpoint", type=str, help="Azure AI Search endpoint", required=True)
+    parser.add_argument("--index-name", type=str, help="Azure AI Search index name", required=True)
+    parser.add_argument("--azure-openai-endpoint", type=str, help="Azure OpenAI endpoint", required=True)
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument("--azure-openai-model-dimensions", type=int, help="Azure OpenAI model dimensions", default=None)
+    parser.add_argument(
+        "--azure-openai-chat-deployment",
+        type=str,
+        help="Chat deployment, when set every query is answered with the raw and the packed context",
+        default=None,
+    )
+    parser.add_argument("--azure-openai-api-version", type=str, help="Azure OpenAI API version", default="2024-06-01")
+    parser.add_argument("--query", nargs="+", help="Queries to run", default=None)
+    parser.add_argument(
+        "--queries-file",
+        type=str,
+        help="Queries, one per line or JSON lines with a query field",
+        default=None,
+    )
+    parser.add_argument("--source-dir", type=str, help="Documents to sample synthetic queries from", default=None)
+    parser.add_argument("--synthetic-queries", type=int, help="Number of synthetic queries", default=20)
+    parser.add_argument("--top", type=int, help="Chunks retrieved per query", default=10)
+    parser.add_argument("--max-tokens", type=int, help="Token budget of the sources, 0 for none", default=3000)
+    parser.add_argument("--min-overlap", type=int, help="Shortest overlap in characters that merges chunks", default=50)
+    parser.add_argument(
+        "--duplicate-threshold",
+        type=float,
+        help="Word 5-gram similarity at which a chunk is a near duplicate",
+        default=0.9,
+    )
+    parser.add_argument("--output", type=str, help="Write the report as JSON to this file", default=None)
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+
+    from openai import AzureOpenAI
+
+    from async_embedder import EmbeddingEngine
+    from benchmark import file_queries, synthetic_queries
+    from clients import get_factory
+    from hybrid_search import HybridRetriever
+    from metrics import LatencyRecorder
+    from rag_service import build_messages
+
+    _queries = list(_args.query or [])
+    if _args.queries_file:
+        _queries += file_queries(_args.queries_file)
+    if _args.source_dir:
+        _queries += synthetic_queries(_args.source_dir, _args.synthetic_queries)
+    if not _queries:
+        parser.error("Pass --query, --queries-file or --source-dir")
+
+    _engine = EmbeddingEngine(
+        endpoint=_args.azure_openai_endpoint,
+        deployment=_args.azure_openai_embedding_deployment,
+        dimensions=_args.azure_openai_model_dimensions,
+    )
+    _retriever = HybridRetriever(
+        get_factory(_args.search_endpoint).search_client(_args.index_name),
+        embed=_engine.embed_query,
+        top=_args.top,
+        select=None,
+    )
+    _builder = ContextBuilder(_args.max_tokens, _args.min_overlap, _args.duplicate_threshold)
+    _chat_client = None
+    if _args.azure_openai_chat_deployment:
+        _chat_client = AzureOpenAI(
+            api_version=_args.azure_openai_api_version,
+            azure_endpoint=_args.azure_openai_endpoint,
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+        )
+    _recorder = LatencyRecorder()
+
+    _per_query = []
+    for _query in _queries:
+        _documents = _retriever.retrieve(_query).documents
+        with _recorder.time("build"):
+            _context = _builder.build(_documents)
+        _entry = {"query": _query, **_context.stats}
+        if _chat_client is not None:
+            for _name, _messages in (
+                ("raw", build_messages(_query, _documents)),
+                ("packed", build_messages(_query, _documents, _context.text)),
+            ):
+                _started = time.perf_counter()
+                _chat_client.chat.completions.create(
+                    model=_args.azure_openai_chat_deployment, temperature=0, messages=_messages
+                )
+                _recorder.record(f"generate_{_name}", time.perf_counter() - _started)
+        _per_query.append(_entry)
+        logging.info(
+            "%s: %s -> %s -> %s tokens (%s merged, %s duplicates)",
+            _query,
+            _context.stats["input_tokens"],
+            _context.stats["deduplicated_tokens"],
+            _context.stats["output_tokens"],
+            _context.stats["merged"],
+            _context.stats["duplicates"],
+        )
+    _retriever.close()
+    _engine.close()
+
+    _report = {"totals": _builder.stats(), "latency": _recorder.summary(), "queries": _per_query}
+    print(json.dumps(_report, indent=2))
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_report, _file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,7 @@ import os
 from azure.identity import ClientSecretCredential, DefaultAzureCredential
 from azure.identity import AzureCliCredential
 from azure.storage.blob import BlobServiceClient
-from azure.core.credentials import AzureKeyCredential
 
-from azure.search.documents.indexes import SearchIndexerClient
 from azure.search.documents.indexes.models import (
     SearchIndexerDataContainer,
     SearchIndexerDataSourceConnection,
@@ -17,11 +15,17 @@ from azure.search.documents.indexes.models import (
     SoftDeleteColumnDeletionDetectionPolicy,
 )
 
+from clients import get_factory
+
 logging.basicConfig(level=logging.DEBUG)
 
 
 _logger = logging.getLogger(__name__)
 
+# Blob metadata marking a document deleted; the indexer then removes its chunks
+SOFT_DELETE_COLUMN = "Status"
+SOFT_DELETE_MARKER = "Deleted"
+
 
 class AISearchDataSource:
 
@@ -63,33 +67,18 @@ class AISearchDataSource:
         finally:
             pass
 
-    def create_data_source(self):
-
+    def data_source_definition(self) -> SearchIndexerDataSourceConnection:
         _args = self.args
-
-        # _credential = ClientSecretCredential(os.getenv("AZURE_TENANT_ID"), os.getenv("AZURE_CLIENT_ID"), os.getenv("AZURE_CLIENT_SECRET"))
-        # _credential = AzureCliCredential()
-        # _credential = DefaultAzureCredential()
-
-        _search_endpoint = _args.search_endpoint
         _index_name = _args.index_name
         _subscription_id = _args.subscription_id
         _resource_group_name = _args.resource_group_name
         _storage_account_name = _args.storage_account_name
-        _storage_account_url = _args.storage_account_url
         _container_name = _args.container_name
 
-        self.ensure_container_exists(
-            storage_account_url=_storage_account_url,
-            container_name=_container_name,
-            credential=os.getenv("AZURE_STORAGE_KEY"),
-        )
-
         _search_blob_connection_string = f"ResourceId=/subscriptions/{_subscription_id}/resourceGroups/{_resource_group_name}/providers/Microsoft.Storage/storageAccounts/{_storage_account_name}"
         
-        # _indexer_client = SearchIndexerClient(_search_endpoint, _credential)
         _container = SearchIndexerDataContainer(name=_container_name)
-        _data_source_connection = SearchIndexerDataSourceConnection(
+        return SearchIndexerDataSourceConnection(
             name=f"{_index_name}-blob",
             type="azureblob",
             connection_string=_search_blob_connection_string,
@@ -98,10 +87,29 @@ class AISearchDataSource:
                 high_water_mark_column_name="metadata_storage_last_modified"
             ),
             data_deletion_detection_policy=SoftDeleteColumnDeletionDetectionPolicy(
-                soft_delete_column_name="Status",
-                soft_delete_marker_value="Deleted",
+                soft_delete_column_name=SOFT_DELETE_COLUMN,
+                soft_delete_marker_value=SOFT_DELETE_MARKER,
             ),
         )
+
+    def create_data_source(self):
+
+        _args = self.args
+
+        # _credential = ClientSecretCredential(os.getenv("AZURE_TENANT_ID"), os.getenv("AZURE_CLIENT_ID"), os.getenv("AZURE_CLIENT_SECRET"))
+        # _credential = AzureCliCredential()
+        # _credential = DefaultAzureCredential()
+
+        _search_endpoint = _args.search_endpoint
+
+        self.ensure_container_exists(
+            storage_account_url=_args.storage_account_url,
+            container_name=_args.container_name,
+            credential=os.getenv("AZURE_STORAGE_KEY"),
+        )
+
+        # _indexer_client = SearchIndexerClient(_search_endpoint, _credential)
+        _data_source_connection = self.data_source_definition()
         # try:
         #     _data_source = _indexer_client.create_or_update_data_source_connection(
         #         _data_source_connection
@@ -112,7 +120,7 @@ class AISearchDataSource:
         #     index_client = SearchIndexerClient(_search_endpoint, os.getenv("AZURE_SEARCH_KEY"))
         #     _data_source = index_client.create_or_update_data_source_connection(_data_source_connection)
 
-        index_client = SearchIndexerClient(_search_endpoint, AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY")))
+        index_client = get_factory(_search_endpoint).indexer_client()
         _data_source = index_client.create_or_update_data_source_connection(_data_source_connection)
 
         logging.info("Data source %s created or updated", _data_source.name)
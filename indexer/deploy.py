@@ -0,0 +1,413 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import yaml
+from azure.core.exceptions import ResourceNotFoundError
+
+from chunker import DEFAULT_MAXIMUM_PAGE_LENGTH, DEFAULT_PAGE_OVERLAP_LENGTH
+from clients import CREDENTIAL_KINDS, get_factory
+
+
+_logger = logging.getLogger(__name__)
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Resources in deployment order, each with the resources it references
+STEPS = ("datasource", "index", "skillset", "indexer")
+DEPENDENCIES = {
+    "datasource": (),
+    "index": (),
+    "skillset": ("index",),
+    "indexer": ("datasource", "index", "skillset"),
+}
+RUN_INDEXER = ("changed", "always", "never")
+
+# Paths of write-only or server-managed values, the service masks or omits them on reads; "*" is any list item
+IGNORED_PATHS = frozenset(
+    {
+        ("@odata.etag",),
+        ("credentials", "connectionString"),
+        ("cache", "storageConnectionString"),
+        ("knowledgeStore", "storageConnectionString"),
+        ("cognitiveServices", "key"),
+        ("skills", "*", "apiKey"),
+        ("vectorSearch", "vectorizers", "*", "azureOpenAIParameters", "apiKey"),
+    }
+)
+
+
+def load_config(path: str) -> dict:
+    """``variables`` of a deployment config such as ``deployments/config.yaml``."""
+    with open(path, "r", encoding="utf-8") as _file:
+        return yaml.safe_load(_file).get("variables") or {}
+
+
+def config_args(variables: dict) -> argparse.Namespace:
+    """Arguments of datasource.py, index.py, skillset.py and indexer.py from config variables.
+
+    Defaults match the ones deploy_indexer.sh passed on the command line.
+    """
+    _truncation_dimension = int(variables.get("TruncationDimension") or 0)
+    _use_ocr = bool(variables.get("use_ocr"))
+    return argparse.Namespace(
+        search_endpoint=variables["SearchEndpoint"],
+        azure_search_endpoint=variables["SearchEndpoint"],
+        index_name=variables["IndexName"],
+        subscription_id=variables["SubscriptionId"],
+        resource_group_name=variables["ResourceGroupName"],
+        storage_account_name=variables["StorageAccountName"],
+        storage_account_url=variables["StorageAccountUrl"],
+        container_name=variables["ContainerName"],
+        azure_openai_endpoint=variables["AzureOpenAiEndpoint"],
+        azure_openai_embedding_deployment_name=variables["AzureOpenAiEmbeddingDeploymentName"],
+        azure_openai_embedding_deployment=variables["AzureOpenAiEmbeddingDeploymentName"],
+        azure_openai_model_name=variables["AzureOpenAiModelName"],
+        azure_openai_model_dimensions=int(variables.get("AzureOpenAiModelDimensions") or 1536),
+        azure_ai_services_endpoint=variables["AzureAIServicesEndpoint"],
+        use_ocr=_use_ocr,
+        add_page_numbers=_use_ocr,
+        use_document_layout=bool(variables.get("use_document_layout")),
+        vector_type=variables.get("VectorType") or "float32",
+        vector_compression=variables.get("VectorCompression") or "none",
+        truncation_dimension=_truncation_dimension or None,
+        oversampling=None,
+        disable_rescoring=False,
+        rescore_storage_method="preserveOriginals",
+        discard_stored_vectors=False,
+        hnsw_m=int(variables.get("HnswM") or 4),
+        hnsw_ef_construction=int(variables.get("HnswEfConstruction") or 400),
+        hnsw_ef_search=int(variables.get("HnswEfSearch") or 500),
+        hnsw_metric=variables.get("HnswMetric") or "cosine",
+        maximum_page_length=int(variables.get("MaximumPageLength") or DEFAULT_MAXIMUM_PAGE_LENGTH),
+        page_overlap_length=int(variables.get("PageOverlapLength") or DEFAULT_PAGE_OVERLAP_LENGTH),
+        interval=variables.get("IndexerInterval") or "PT8H",
+        start_time=variables.get("IndexerStartTime") or "2024-10-01T00:00:00Z",
+        cache_storage_connection_string=os.getenv("AZURE_INDEXER_CACHE_CONNECTION_STRING"),
+        test_query=variables.get("TestQuery"),
+    )
+
+
+def rest_body(definition) -> dict:
+    """REST body of an SDK resource model, normalized by a serialize/deserialize round trip."""
+    _model = definition._to_generated() if hasattr(definition, "_to_generated") else definition
+    return type(_model).deserialize(_model.serialize()).serialize()
+
+
+def _strip(value, path=()):
+    if isinstance(value, dict):
+        return {
+            _key: _strip(_item, path + (_key,))
+            for _key, _item in value.items()
+            if path + (_key,) not in IGNORED_PATHS
+        }
+    if isinstance(value, list):
+        return [_strip(_item, path + ("*",)) for _item in value]
+    return value
+
+
+def _project(desired, deployed, path=()):
+    """``deployed`` restricted to the keys set in ``desired``, so server defaults are not a change."""
+    if isinstance(desired, dict) and isinstance(deployed, dict):
+        return {
+            _key: _project(_item, deployed.get(_key), path + (_key,))
+            for _key, _item in desired.items()
+            if path + (_key,) not in IGNORED_PATHS
+        }
+    if isinstance(desired, list) and isinstance(deployed, list) and len(desired) == len(deployed):
+        return [_project(_item, _other, path + ("*",)) for _item, _other in zip(desired, deployed)]
+    return deployed
+
+
+def fingerprint(body: dict) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def compare(desired: dict, deployed: dict):
+    """(desired hash, deployed hash, changed top-level keys); hashes only cover the keys ``desired`` sets.
+
+    Secrets and etags are left out since reads never return them, so a
+    rotated key alone is not detected; pass ``--force`` after rotating one.
+    """
+    _desired = _strip(desired)
+    if deployed is None:
+        return fingerprint(_desired), None, sorted(_desired)
+    _deployed = _project(desired, deployed)
+    _changed = sorted(_key for _key in _desired if _desired[_key] != _deployed.get(_key))
+    return fingerprint(_desired), fingerprint(_deployed), _changed
+
+
+class DeploymentOrchestrator:
+    """Deploys the data source, index, skillset and indexer of a config in one process.
+
+    Definitions are built from the same classes as the per-resource scripts.
+    Each is hashed against the deployed resource and only created or updated
+    when they differ, so a no-op deploy writes nothing and leaves the indexer's
+    change tracking alone. Steps run concurrently as soon as the resources
+    they reference are in place: the data source and the index first, then
+    the skillset, then the indexer.
+
+    Args:
+        args (argparse.Namespace): resource arguments, see :func:`config_args`
+        credential (str): credential kind of the search clients
+        force (bool): update every resource even when unchanged
+        dry_run (bool): only report what would change
+    """
+
+    def __init__(self, args, credential: str = "key", force: bool = False, dry_run: bool = False):
+        # datasource.py configures logging on import, so load it once logging is set up
+        from datasource import AISearchDataSource
+        from index import AISearchIndex
+        from indexer import AISearchIndexer
+        from skillset import AISearchSkillset
+
+        self.args = args
+        self.force = force
+        self.dry_run = dry_run
+        self.factory = get_factory(args.search_endpoint, credential)
+        self.index_client = self.factory.index_client()
+        self.indexer_client = self.factory.indexer_client()
+        self.builders = {
+            "datasource": AISearchDataSource(args),
+            "index": AISearchIndex(args),
+            "skillset": AISearchSkillset(args),
+            "indexer": AISearchIndexer(args),
+        }
+
+    def definition(self, step: str):
+        _builder = self.builders[step]
+        if step == "datasource":
+            return _builder.data_source_definition()
+        if step == "index":
+            return _builder.index_definition()
+        if step == "skillset":
+            return _builder.skillset_definition()
+        return _builder.indexer_definition()
+
+    def deployed(self, step: str, name: str):
+        """Deployed definition of a resource, ``None`` when it does not exist."""
+        try:
+            if step == "datasource":
+                return self.indexer_client.get_data_source_connection(name)
+            if step == "index":
+                return self.index_client.get_index(name)
+            if step == "skillset":
+                return self.indexer_client.get_skillset(name)
+            return self.indexer_client.get_indexer(name)
+        except ResourceNotFoundError:
+            return None
+
+    def apply(self, step: str, definition):
+        if step == "datasource":
+            _builder = self.builders[step]
+            _builder.ensure_container_exists(
+                storage_account_url=self.args.storage_account_url,
+                container_name=self.args.container_name,
+                credential=os.getenv("AZURE_STORAGE_KEY"),
+            )
+            self.indexer_client.create_or_update_data_source_connection(definition)
+        elif step == "index":
+            self.index_client.create_or_update_index(definition)
+        elif step == "skillset":
+            self.builders[step].check_index_dimensions()
+            self.indexer_client.create_or_update_skillset(definition)
+        else:
+            self.indexer_client.create_or_update_indexer(definition)
+
+    def deploy(self, step: str) -> dict:
+        _started = time.perf_counter()
+        _definition = self.definition(step)
+        _deployed = self.deployed(step, _definition.name)
+        _desired_hash, _deployed_hash, _changed = compare(
+            rest_body(_definition), rest_body(_deployed) if _deployed is not None else None
+        )
+        if _deployed is None:
+            _action = "create"
+        elif _desired_hash != _deployed_hash:
+            _action = "update"
+        else:
+            _action = "update" if self.force else "unchanged"
+        if _action != "unchanged" and not self.dry_run:
+            self.apply(step, _definition)
+        _result = {
+            "step": step,
+            "name": _definition.name,
+            "action": _action,
+            "applied": _action != "unchanged" and not self.dry_run,
+            "changed": _changed,
+            "hash": _desired_hash[:12],
+            "seconds": round(time.perf_counter() - _started, 3),
+        }
+        logging.info(
+            "%s %s: %s%s",
+            step,
+            _definition.name,
+            _action if not self.dry_run or _action == "unchanged" else f"would {_action}",
+            f" ({', '.join(_changed)})" if _changed and _action == "update" else "",
+        )
+        return _result
+
+    def run(self, max_workers: int = 4) -> dict:
+        """Deploy every step once its dependencies are done; dependents of a failed step are skipped."""
+        _results = {}
+        _pending = {}
+        _waiting = list(STEPS)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="deploy") as _executor:
+            while _waiting or _pending:
+                for _step in list(_waiting):
+                    _dependencies = [_results.get(_dependency) for _dependency in DEPENDENCIES[_step]]
+                    _blocked = any(
+                        _result is not None and _result["action"] in ("failed", "skipped") for _result in _dependencies
+                    )
+                    if _blocked:
+                        _results[_step] = {"step": _step, "action": "skipped", "applied": False}
+                        _waiting.remove(_step)
+                        _logger.warning("Skipping %s, a resource it references failed", _step)
+                    elif all(_result is not None for _result in _dependencies):
+                        _pending[_executor.submit(self.deploy, _step)] = _step
+                        _waiting.remove(_step)
+                if not _pending:
+                    continue
+                _done, _ = wait(list(_pending), return_when=FIRST_COMPLETED)
+                for _future in _done:
+                    _step = _pending.pop(_future)
+                    try:
+                        _results[_step] = _future.result()
+                    except Exception as e:
+                        _logger.error("Deploying %s failed: %s", _step, e)
+                        _results[_step] = {"step": _step, "action": "failed", "applied": False, "error": str(e)}
+        return _results
+
+    def run_indexer(self, results: dict, mode: str, monitor=None) -> int:
+        """Start the indexer when ``mode`` asks for it, returns the monitor exit code or 0."""
+        _changed = any(_result.get("applied") for _result in results.values())
+        if self.dry_run or mode == "never" or (mode == "changed" and not _changed):
+            logging.info("Not running the indexer (%s)", "dry run" if self.dry_run else f"run-indexer {mode}")
+            return 0
+        _indexer_name = results["indexer"]["name"]
+        if results["indexer"]["action"] == "create":
+            # The service starts a new indexer on creation, a second run would conflict with it
+            logging.info("%s started on creation", _indexer_name)
+            return monitor.wait() if monitor is not None else 0
+        _previous_run = monitor.run_id(monitor.status()) if monitor is not None else None
+        self.indexer_client.run_indexer(_indexer_name)
+        logging.info("Started %s", _indexer_name)
+        return monitor.wait(_previous_run) if monitor is not None else 0
+
+    def test(self, query: str):
+        """Smoke query of the deployed index, logs the hit count."""
+        _search_client = self.factory.search_client(self.args.index_name)
+        _results = list(_search_client.search(search_text=query, top=3, select=["title"]))
+        logging.info(
+            "Test query %r returned %d results %s", query, len(_results), [_result["title"] for _result in _results]
+        )
+        return len(_results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        type=str,
+        help="Deployment config with a variables section",
+        default=os.path.join(_REPO_ROOT, "deployments", "config.yaml"),
+    )
+    parser.add_argument(
+        "--credential",
+        choices=CREDENTIAL_KINDS,
+        help="Credential of the search clients",
+        default="key",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report which resources would be created or updated without changing anything",
+        default=False,
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Update every resource even when its definition is unchanged",
+        default=False,
+    )
+    parser.add_argument(
+        "--run-indexer",
+        choices=RUN_INDEXER,
+        help="Run the indexer after deploying: when a resource changed, always or never",
+        default="changed",
+    )
+    parser.add_argument(
+        "--monitor",
+        action="store_true",
+        help="Wait for the indexer run and exit non-zero when it fails",
+        default=False,
+    )
+    parser.add_argument(
+        "--skip-test",
+        action="store_true",
+        help="Do not run the config's TestQuery against the index",
+        default=False,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the deployment results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("azure").setLevel(logging.WARNING)
+
+    _variables = load_config(_args.config)
+    try:
+        _resource_args = config_args(_variables)
+    except KeyError as e:
+        parser.error(f"{_args.config} is missing variable {e.args[0]}")
+    if _resource_args.use_ocr and _resource_args.use_document_layout:
+        parser.error("use_ocr and use_document_layout can't be enabled at the same time")
+
+    _started = time.perf_counter()
+    _orchestrator = DeploymentOrchestrator(_resource_args, _args.credential, _args.force, _args.dry_run)
+    _results = _orchestrator.run()
+    _failed = [_step for _step, _result in _results.items() if _result["action"] in ("failed", "skipped")]
+    _exit_code = 1 if _failed else 0
+    if not _failed:
+        _monitor = None
+        if _args.monitor:
+            from indexer_monitor import IndexerMonitor
+
+            _monitor = IndexerMonitor(_orchestrator.indexer_client, _results["indexer"]["name"])
+        _exit_code = _orchestrator.run_indexer(_results, _args.run_indexer, _monitor)
+        if not _args.skip_test and not _args.dry_run and _resource_args.test_query:
+            _orchestrator.test(_resource_args.test_query)
+    logging.info(
+        "Deployment %s in %.1fs: %s",
+        "failed" if _failed else "finished",
+        time.perf_counter() - _started,
+        {_step: _result["action"] for _step, _result in _results.items()},
+    )
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_results, _file, indent=2)
+    sys.exit(_exit_code)
+
+
+if __name__ == "__main__":
+    main()
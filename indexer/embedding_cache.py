@@ -0,0 +1,219 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+
+_logger = logging.getLogger(__name__)
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# Keys per IN (...) query, below SQLite's bound variable limit
+_KEYS_PER_QUERY = 500
+
+
+def normalize_text(text: str) -> str:
+    """Normalize chunk text so cosmetic differences map to the same cache key."""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_name: str, dimensions: int, text: str) -> str:
+    """Cache key for (model name, dimensions, SHA-256 of normalized text)."""
+    _text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_name}:{int(dimensions)}:{_text_hash}"
+
+
+class EmbeddingCache:
+    """Persistent embedding cache stored as float32 blobs in a local SQLite file.
+
+    Entries are evicted least-recently-used first once the stored vectors exceed
+    ``max_bytes``. The cache is independent of the search index, so it survives
+    ``reset_index.py`` and is shared by every ingestion run and skillset mode
+    that embeds through :meth:`get_or_embed`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        _directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(_directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._connection.commit()
+        self._total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys: list):
+        """Return a {key: vector} dict for the keys present in the cache."""
+        _found = {}
+        _unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for _start in range(0, len(_unique), _KEYS_PER_QUERY):
+                _slice = _unique[_start:_start + _KEYS_PER_QUERY]
+                _rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(_slice))})",
+                    _slice,
+                ).fetchall()
+                for _key, _blob in _rows:
+                    _vector = array("f")
+                    _vector.frombytes(_blob)
+                    _found[_key] = _vector.tolist()
+            if _found:
+                _now = time.time()
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(_now, _key) for _key in _found],
+                )
+                self._connection.commit()
+        return _found
+
+    def put_many(self, items: dict):
+        """Store a {key: vector} dict and evict old entries if over budget."""
+        if not items:
+            return
+        _now = time.time()
+        _rows = []
+        for _key, _vector in items.items():
+            _blob = array("f", _vector).tobytes()
+            _rows.append((_key, _blob, len(_blob), _now))
+        with self._lock:
+            _previous = 0
+            for _start in range(0, len(_rows), _KEYS_PER_QUERY):
+                _slice = [_row[0] for _row in _rows[_start:_start + _KEYS_PER_QUERY]]
+                _previous += self._connection.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({','.join('?' * len(_slice))})",
+                    _slice,
+                ).fetchone()[0]
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                _rows,
+            )
+            self._total_bytes += sum(_row[2] for _row in _rows) - _previous
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Trim to 90% of the budget so eviction does not run on every insert
+        _target = int(self.max_bytes * 0.9)
+        _evicted = 0
+        for _key, _size in self._connection.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access"
+        ).fetchall():
+            if self._total_bytes <= _target:
+                break
+            self._connection.execute("DELETE FROM embeddings WHERE key = ?", (_key,))
+            self._total_bytes -= _size
+            _evicted += 1
+        _logger.debug("Evicted %d embeddings from %s", _evicted, self.path)
+
+    def get_or_embed(self, texts: list, model_name: str, dimensions: int, embed):
+        """Return embeddings for texts, calling ``embed`` only for unseen texts.
+
+        Args:
+            texts (list): chunk texts
+            model_name (str): embedding model name
+            dimensions (int): embedding dimensions
+            embed (callable): embeds a list of texts and returns a list of vectors
+
+        Returns:
+            list: one vector per input text
+        """
+        _keys = [cache_key(model_name, dimensions, _text) for _text in texts]
+        _found = self.get_many(_keys)
+
+        # Embed every distinct missing text once, even if it repeats in the input
+        _missing = {}
+        for _key, _text in zip(_keys, texts):
+            if _key not in _found and _key not in _missing:
+                _missing[_key] = _text
+        self.hits += sum(1 for _key in _keys if _key in _found)
+        self.misses += len(_missing)
+
+        if _missing:
+            _vectors = embed(list(_missing.values()))
+            _new = dict(zip(_missing.keys(), _vectors))
+            self.put_many(_new)
+            _found.update(_new)
+        return [_found[_key] for _key in _keys]
+
+    def stats(self):
+        with self._lock:
+            _entries = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        _lookups = self.hits + self.misses
+        return {
+            "entries": _entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / _lookups, 4) if _lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        help="Embedding cache file",
+        required=True,
+    )
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Remove every cached embedding",
+        default=False,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _cache = EmbeddingCache(_args.cache_path)
+    if _args.clear:
+        _cache.clear()
+        logging.info("Embedding cache %s cleared", _args.cache_path)
+    print(json.dumps(_cache.stats()))
+    _cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,653 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from embedding_cache import normalize_text
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+JUDGES = ("local", "promptflow")
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GOLDEN_SET = os.path.join(_REPO_ROOT, "deployments", "golden_set.jsonl")
+
+_WORD_PATTERN = re.compile(r"\w+")
+_CITATION_PATTERN = re.compile(r"\[[^\[\]]+\]")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it of on or that the their "
+    "they this to was what when where which who will with you your".split()
+)
+
+
+def load_golden_set(path: str) -> list:
+    """Golden set items from JSON lines with ``question`` and ``ground_truth``.
+
+    Optional fields: ``id`` (defaults to a hash of the question), ``filters``
+    (see :func:`filters.filter_from_dict`) and ``relevant_titles`` for
+    retrieval recall.
+    """
+    _items = []
+    with open(path, "r", encoding="utf-8") as _file:
+        for _number, _line in enumerate(_file, start=1):
+            if not _line.strip():
+                continue
+            _item = json.loads(_line)
+            if not _item.get("question") or "ground_truth" not in _item:
+                raise ValueError(f"{path}:{_number} needs question and ground_truth")
+            _item.setdefault("id", hashlib.sha256(_item["question"].encode("utf-8")).hexdigest()[:16])
+            _items.append(_item)
+    _ids = [_item["id"] for _item in _items]
+    if len(set(_ids)) != len(_ids):
+        raise ValueError(f"{path} has duplicate ids")
+    return _items
+
+
+def config_hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def _words(text: str) -> list:
+    return _WORD_PATTERN.findall(_CITATION_PATTERN.sub(" ", text or "").lower())
+
+
+def _content_words(text: str) -> set:
+    return {_word for _word in _words(text) if _word not in _STOPWORDS}
+
+
+def token_f1(answer: str, ground_truth: str) -> float:
+    """SQuAD-style token F1 between an answer and its ground truth."""
+    _answer = _words(answer)
+    _truth = _words(ground_truth)
+    if not _answer or not _truth:
+        return float(_answer == _truth)
+    _counts = {}
+    for _word in _truth:
+        _counts[_word] = _counts.get(_word, 0) + 1
+    _common = 0
+    for _word in _answer:
+        if _counts.get(_word):
+            _counts[_word] -= 1
+            _common += 1
+    if not _common:
+        return 0.0
+    _precision = _common / len(_answer)
+    _recall = _common / len(_truth)
+    return 2 * _precision * _recall / (_precision + _recall)
+
+
+class RetrievalCache:
+    """Search results of previous runs in a local SQLite file.
+
+    Keys cover everything that shapes retrieval (question, index, top, k,
+    filter, embedding deployment), so runs that only change the prompt,
+    model or judge reuse them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS retrievals (key TEXT PRIMARY KEY, documents TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            _row = self._connection.execute("SELECT documents FROM retrievals WHERE key = ?", (key,)).fetchone()
+            if _row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(_row[0])
+
+    def put(self, key: str, documents: list):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO retrievals (key, documents, created) VALUES (?, ?, ?)",
+                (key, json.dumps(documents), time.time()),
+            )
+            self._connection.commit()
+
+    def stats(self):
+        _lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / _lookups, 4) if _lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class LocalJudge:
+    """Deterministic lexical judge for offline runs.
+
+    Not a substitute for the GPT evaluators, but stable between runs, so a
+    prompt or retrieval change that moves these scores is worth a GPT run.
+
+    - ``f1_score``: token F1 of the answer against the ground truth
+    - ``similarity``: ground-truth content words found in the answer
+    - ``groundedness``: answer content words found in the context
+    - ``relevance``: question content words addressed by the answer
+    - ``citation_precision``: ``[title]`` markers naming a retrieved source
+    """
+
+    name = "local"
+
+    def __call__(self, question: str, answer: str, context: str, ground_truth: str, sources: list) -> dict:
+        _answer = _content_words(answer)
+        _truth = _content_words(ground_truth)
+        _context = _content_words(context)
+        _question = _content_words(question)
+        _markers = [_marker[1:-1].strip().casefold() for _marker in _CITATION_PATTERN.findall(answer or "")]
+        _titles = {(_source.get("title") or "").casefold() for _source in sources}
+        return {
+            "f1_score": round(token_f1(answer, ground_truth), 4),
+            "similarity": round(len(_answer & _truth) / len(_truth), 4) if _truth else 0.0,
+            "groundedness": round(len(_answer & _context) / len(_answer), 4) if _answer else 0.0,
+            "relevance": round(len(_answer & _question) / len(_question), 4) if _question else 0.0,
+            "citation_precision": (
+                round(sum(1 for _marker in _markers if _marker in _titles) / len(_markers), 4) if _markers else 0.0
+            ),
+        }
+
+
+class PromptflowJudge:
+    """``promptflow-evals`` ``QAEvaluator``, the GPT-based evaluators of the rag_eval notebook."""
+
+    name = "promptflow"
+
+    def __init__(self, endpoint: str, deployment: str):
+        from promptflow.core import AzureOpenAIModelConfiguration
+        from promptflow.evals.evaluators import QAEvaluator
+
+        self.evaluator = QAEvaluator(
+            AzureOpenAIModelConfiguration(
+                azure_endpoint=endpoint,
+                azure_deployment=deployment,
+                api_key=os.getenv("AZURE_OPENAI_KEY"),
+            )
+        )
+
+    def __call__(self, question: str, answer: str, context: str, ground_truth: str, sources: list) -> dict:
+        return self.evaluator(question=question, answer=answer, context=context, ground_truth=ground_truth)
+
+
+def retrieval_metrics(item: dict, sources: list) -> dict:
+    """Recall and hit of ``relevant_titles`` among the retrieved sources, empty without them."""
+    _relevant = {_title.casefold() for _title in item.get("relevant_titles") or ()}
+    if not _relevant:
+        return {}
+    _found = _relevant & {(_source.get("title") or "").casefold() for _source in sources}
+    return {
+        "retrieval_recall": round(len(_found) / len(_relevant), 4),
+        "retrieval_hit": 1.0 if _found else 0.0,
+    }
+
+
+def load_checkpoint(path: str, run_config: str) -> dict:
+    """{item id: result} already written to ``path`` by a run with the same configuration."""
+    _done = {}
+    _other = 0
+    if not os.path.exists(path):
+        return _done
+    with open(path, "r", encoding="utf-8") as _file:
+        for _line in _file:
+            if not _line.strip():
+                continue
+            try:
+                _row = json.loads(_line)
+            except json.JSONDecodeError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            if _row.get("config") == run_config:
+                _done[_row["id"]] = _row
+            else:
+                _other += 1
+    if _other:
+        _logger.info("Ignoring %d results of other configurations in %s", _other, path)
+    return _done
+
+
+class EvalRunner:
+    """Runs a golden set through retrieval, generation and a judge, checkpointing every result.
+
+    Retrieval and generation run ``concurrency`` items at a time; judging runs
+    in threads, ``eval_concurrency`` at a time, so a slow GPT judge overlaps
+    the next items' generation. Every finished item is appended to the output
+    file at once, and a rerun with the same configuration skips the items it
+    finds there.
+    """
+
+    def __init__(self, args, judge):
+        self.args = args
+        self.judge = judge
+        self.recorder = LatencyRecorder()
+        self.retrieval_cache = RetrievalCache(args.retrieval_cache_path) if args.retrieval_cache_path else None
+        self.system_message = None
+        if args.system_message_file:
+            with open(args.system_message_file, "r", encoding="utf-8") as _file:
+                self.system_message = _file.read()
+        self.context_builder = None
+        if args.context_max_tokens:
+            from context_builder import ContextBuilder
+
+            self.context_builder = ContextBuilder(max_tokens=args.context_max_tokens)
+        self.run_config = self._run_config()
+        self.errors = 0
+        self._factory = None
+        self._search_client = None
+        self._embedder = None
+        self._chat_client = None
+        self._write_lock = None
+
+    def _run_config(self) -> str:
+        from rag_service import SYSTEM_MESSAGE
+
+        _args = self.args
+        return config_hash(
+            self.retrieval_settings(),
+            self.system_message or SYSTEM_MESSAGE,
+            _args.azure_openai_chat_deployment,
+            _args.temperature,
+            _args.context_max_tokens,
+            self.judge.name,
+        )
+
+    def retrieval_settings(self) -> list:
+        _args = self.args
+        return [
+            # Fake results must never answer for the real service
+            "mock" if _args.mock else _args.search_endpoint,
+            _args.index_name,
+            _args.top,
+            _args.k_nearest_neighbors,
+            _args.azure_openai_embedding_deployment,
+            _args.azure_openai_model_dimensions,
+        ]
+
+    async def start(self):
+        from openai import AsyncAzureOpenAI
+
+        from async_embedder import AsyncEmbeddingClient
+        from clients import get_factory
+
+        _args = self.args
+        self._factory = get_factory(_args.search_endpoint, pool_maxsize=_args.concurrency)
+        self._search_client = self._factory.async_search_client(_args.index_name)
+        self._embedder = AsyncEmbeddingClient(
+            endpoint=_args.azure_openai_endpoint,
+            deployment=_args.azure_openai_embedding_deployment,
+            dimensions=_args.azure_openai_model_dimensions,
+            api_version=_args.azure_openai_api_version,
+            max_concurrency=_args.concurrency,
+        )
+        self._chat_client = AsyncAzureOpenAI(
+            api_version=_args.azure_openai_api_version,
+            azure_endpoint=_args.azure_openai_endpoint,
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+        )
+        self._write_lock = asyncio.Lock()
+
+    async def stop(self):
+        if self._embedder is not None:
+            await self._embedder.close()
+        if self._chat_client is not None:
+            await self._chat_client.close()
+        if self._factory is not None:
+            await self._factory.aclose()
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.close()
+
+    async def retrieve(self, item: dict) -> list:
+        """Hybrid semantic search, as the rag notebooks run it, through the retrieval cache."""
+        from azure.search.documents.models import VectorizedQuery
+
+        from filters import filter_from_dict
+
+        _args = self.args
+        _filter = filter_from_dict(item.get("filters"))
+        _key = config_hash(self.retrieval_settings(), normalize_text(item["question"]).casefold(), _filter)
+        if self.retrieval_cache is not None and not _args.refresh_retrieval:
+            _documents = self.retrieval_cache.get(_key)
+            if _documents is not None:
+                return _documents
+        with self.recorder.time("embed"):
+            _vector = await self._embedder.embed_query(item["question"])
+        with self.recorder.time("search"):
+            _results = await self._search_client.search(
+                search_text=item["question"],
+                top=_args.top,
+                vector_queries=[
+                    VectorizedQuery(vector=_vector, k_nearest_neighbors=_args.k_nearest_neighbors, fields="vector")
+                ],
+                filter=_filter,
+                query_type="semantic",
+                semantic_configuration_name=_args.semantic_configuration_name or f"{_args.index_name}-semantic-config",
+                select=["chunk_id", "parent_id", "title", "chunk"],
+            )
+            _documents = [
+                {
+                    "chunk_id": _result["chunk_id"],
+                    "parent_id": _result.get("parent_id"),
+                    "title": _result["title"],
+                    "chunk": _result["chunk"],
+                    "score": _result["@search.score"],
+                    "reranker_score": _result.get("@search.reranker_score"),
+                }
+                async for _result in _results
+            ]
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.put(_key, _documents)
+        return _documents
+
+    async def generate(self, question: str, documents: list):
+        """(answer, sources text) for ``question``."""
+        from rag_service import build_messages, build_sources
+
+        _sources = self.context_builder.build(documents).text if self.context_builder else build_sources(documents)
+        _messages = build_messages(question, documents, _sources)
+        if self.system_message:
+            _messages[0]["content"] = self.system_message
+        with self.recorder.time("generate"):
+            _response = await self._chat_client.chat.completions.create(
+                model=self.args.azure_openai_chat_deployment,
+                temperature=self.args.temperature,
+                messages=_messages,
+            )
+        return _response.choices[0].message.content or "", _sources
+
+    async def run_item(self, item: dict, generation: asyncio.Semaphore, evaluation: asyncio.Semaphore, output):
+        _started = time.perf_counter()
+        try:
+            async with generation:
+                _documents = await self.retrieve(item)
+                _answer, _context = await self.generate(item["question"], _documents)
+            async with evaluation:
+                with self.recorder.time("evaluate"):
+                    _scores = await asyncio.to_thread(
+                        self.judge, item["question"], _answer, _context, item["ground_truth"], _documents
+                    )
+        except Exception:
+            self.errors += 1
+            _logger.exception("Item %s failed, it is retried on the next run", item["id"])
+            return None
+        _row = {
+            "id": item["id"],
+            "config": self.run_config,
+            "question": item["question"],
+            "ground_truth": item["ground_truth"],
+            "answer": _answer,
+            "sources": [_document["title"] for _document in _documents],
+            "scores": {**_scores, **retrieval_metrics(item, _documents)},
+            "seconds": round(time.perf_counter() - _started, 3),
+        }
+        async with self._write_lock:
+            output.write(json.dumps(_row) + "\n")
+            output.flush()
+        return _row
+
+    async def run(self, items: list) -> dict:
+        _args = self.args
+        _done = load_checkpoint(_args.output, self.run_config)
+        _pending = [_item for _item in items if _item["id"] not in _done]
+        logging.info("%d items, %d already evaluated, %d to run", len(items), len(items) - len(_pending), len(_pending))
+        _started = time.perf_counter()
+        await self.start()
+        try:
+            _generation = asyncio.Semaphore(_args.concurrency)
+            _evaluation = asyncio.Semaphore(_args.eval_concurrency)
+            with open(_args.output, "a", encoding="utf-8") as _output:
+                _rows = await asyncio.gather(
+                    *(self.run_item(_item, _generation, _evaluation, _output) for _item in _pending)
+                )
+        finally:
+            await self.stop()
+        _elapsed = time.perf_counter() - _started
+        for _row in _rows:
+            if _row is not None:
+                _done[_row["id"]] = _row
+        _results = [_done[_item["id"]] for _item in items if _item["id"] in _done]
+        return self.summary(_results, len(items), len(_pending), _elapsed)
+
+    def summary(self, results: list, total: int, ran: int, seconds: float) -> dict:
+        _metrics = {}
+        for _row in results:
+            for _name, _value in _row["scores"].items():
+                if isinstance(_value, (int, float)) and not isinstance(_value, bool):
+                    _metrics.setdefault(_name, []).append(_value)
+        return {
+            "config": self.run_config,
+            "judge": self.judge.name,
+            "items": total,
+            "evaluated": len(results),
+            "ran": ran,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "items_per_second": round((ran - self.errors) / seconds, 2) if seconds else 0.0,
+            "metrics": {_name: round(sum(_values) / len(_values), 4) for _name, _values in sorted(_metrics.items())},
+            "latency": self.recorder.summary(),
+            "retrieval_cache": self.retrieval_cache.stats() if self.retrieval_cache is not None else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--golden-set",
+        type=str,
+        help="JSON lines with question, ground_truth and optional id, filters and relevant_titles",
+        default=DEFAULT_GOLDEN_SET,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Per-item results as JSON lines, also the checkpoint a rerun resumes from",
+        default="eval_results.jsonl",
+    )
+    parser.add_argument(
+        "--summary-output",
+        type=str,
+        help="Write the run summary as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        default="ragsearch",
+    )
+    parser.add_argument(
+        "--semantic-configuration-name",
+        type=str,
+        help="Semantic configuration (defaults to <index-name>-semantic-config)",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI embedding dimensions",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-chat-deployment",
+        type=str,
+        help="Azure OpenAI chat deployment answering the questions",
+        default="gpt-4o-mini",
+    )
+    parser.add_argument(
+        "--azure-openai-judge-deployment",
+        type=str,
+        help="Azure OpenAI deployment of the promptflow judge",
+        default="gpt-4o-mini",
+    )
+    parser.add_argument(
+        "--azure-openai-api-version",
+        type=str,
+        help="Azure OpenAI API version",
+        default="2024-06-01",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Number of sources passed to the model",
+        default=5,
+    )
+    parser.add_argument(
+        "--k-nearest-neighbors",
+        type=int,
+        help="Vector query k",
+        default=50,
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        help="Chat completion temperature, 0 keeps reruns comparable",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--system-message-file",
+        type=str,
+        help="Prompt to evaluate instead of the RAG service's system message",
+        default=None,
+    )
+    parser.add_argument(
+        "--context-max-tokens",
+        type=int,
+        help="Pack the sources with the context builder under this budget, 0 joins them as the notebooks do",
+        default=0,
+    )
+    parser.add_argument(
+        "--judge",
+        choices=JUDGES,
+        help="promptflow runs the notebook's GPT QAEvaluator, local a deterministic lexical judge",
+        default="promptflow",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Items retrieved and generated at once",
+        default=8,
+    )
+    parser.add_argument(
+        "--eval-concurrency",
+        type=int,
+        help="Items judged at once",
+        default=4,
+    )
+    parser.add_argument(
+        "--retrieval-cache-path",
+        type=str,
+        help="SQLite file caching search results between runs, empty to disable",
+        default=".eval_cache/retrievals.db",
+    )
+    parser.add_argument(
+        "--refresh-retrieval",
+        action="store_true",
+        help="Search again and overwrite cached results, e.g. after re-indexing",
+        default=False,
+    )
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Run offline against fake_azure: stub embeddings and chat, local judge, index built from --source-dir",
+        default=False,
+    )
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        help="Documents indexed for --mock",
+        default=os.path.join(_REPO_ROOT, "Data"),
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+
+    _server = None
+    if _args.mock:
+        from benchmark import ingest
+        from fake_azure import FakeAzureServer
+
+        os.environ.setdefault("AZURE_SEARCH_KEY", "fake")
+        os.environ.setdefault("AZURE_OPENAI_KEY", "fake")
+        _args.azure_openai_model_dimensions = _args.azure_openai_model_dimensions or 256
+        _server = FakeAzureServer(dimensions=_args.azure_openai_model_dimensions).start()
+        _args.search_endpoint = _server.endpoint
+        _args.azure_openai_endpoint = _server.endpoint
+        _args.judge = "local"
+    elif not _args.search_endpoint or not _args.azure_openai_endpoint:
+        parser.error("--search-endpoint and --azure-openai-endpoint are required without --mock")
+
+    try:
+        _items = load_golden_set(_args.golden_set)
+        if _args.judge == "promptflow":
+            try:
+                _judge = PromptflowJudge(_args.azure_openai_endpoint, _args.azure_openai_judge_deployment)
+            except ImportError:
+                parser.error("--judge promptflow needs promptflow-evals installed, or use --judge local")
+        else:
+            _judge = LocalJudge()
+        if _server is not None:
+            logging.info("Indexing %s into the fake service: %s", _args.source_dir, ingest(_args))
+        _summary = asyncio.run(EvalRunner(_args, _judge).run(_items))
+    finally:
+        if _server is not None:
+            _server.stop()
+
+    _output = json.dumps(_summary, indent=2)
+    if _args.summary_output:
+        with open(_args.summary_output, "w", encoding="utf-8") as _file:
+            _file.write(_output)
+    print(_output)
+    return 1 if _summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,599 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import re
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from hnsw import HnswGraph
+from local_index import KeywordIndex, cosine_score, facet_counts, reciprocal_rank_fusion
+from odata import parse_filter
+
+
+_logger = logging.getLogger(__name__)
+
+_INDEX_DOCS_PATTERN = re.compile(r"^/indexes(?:\('(?P<quoted>[^']+)'\)|/(?P<plain>[^/]+))/docs/(?:search\.)?index$")
+_INDEX_COUNT_PATTERN = re.compile(r"^/indexes(?:\('(?P<quoted>[^']+)'\)|/(?P<plain>[^/]+))/docs/\$count$")
+_INDEX_SEARCH_PATTERN = re.compile(r"^/indexes(?:\('(?P<quoted>[^']+)'\)|/(?P<plain>[^/]+))/docs/search\.post\.search$")
+_EMBEDDINGS_PATTERN = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/embeddings$")
+_CHAT_PATTERN = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/chat/completions$")
+_TOKEN_PATTERN = re.compile(r"\w+")
+_SOURCE_PATTERN = re.compile(r"^\[(?P<title>[^\]]+)\]:\s*(?P<text>.+)$", re.MULTILINE)
+
+VECTOR_ALGORITHMS = ("exhaustive", "hnsw")
+
+
+def fake_embedding(text: str, dimensions: int = 1536):
+    """Deterministic feature-hashed embedding so that similar texts stay close.
+
+    Args:
+        text (str): text to embed
+        dimensions (int): vector dimensions
+
+    Returns:
+        list: unit-length vector
+    """
+    _vector = [0.0] * dimensions
+    for _token in _TOKEN_PATTERN.findall(text.lower()):
+        _digest = hashlib.blake2b(_token.encode("utf-8"), digest_size=8).digest()
+        _bucket = int.from_bytes(_digest[:4], "little") % dimensions
+        _sign = 1.0 if _digest[4] & 1 else -1.0
+        _vector[_bucket] += _sign
+    _norm = math.sqrt(sum(_value * _value for _value in _vector)) or 1.0
+    return [_value / _norm for _value in _vector]
+
+
+def fake_answer(prompt: str) -> str:
+    """Deterministic grounded answer: the first sentence of up to two sources, cited by title."""
+    _sources = _SOURCE_PATTERN.findall(prompt.split("Sources:", 1)[-1])
+    if not _sources:
+        return "I don't know."
+    _sentences = []
+    for _title, _text in _sources[:2]:
+        _sentence = re.split(r"(?<=[.!?])\s", _text.strip(), maxsplit=1)[0]
+        _sentences.append(f"{_sentence} [{_title}]")
+    return " ".join(_sentences)
+
+
+def _tokens(text: str):
+    return _TOKEN_PATTERN.findall((text or "").lower())
+
+
+
+class FakeAzureState:
+    """In-memory documents of every fake index, shared by all request handlers."""
+
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        tokens_per_minute: int = 0,
+        latency_ms: float = 0.0,
+        token_latency_ms: float = 0.0,
+        vector_algorithm: str = "exhaustive",
+        hnsw_parameters: dict = None,
+    ):
+        if vector_algorithm not in VECTOR_ALGORITHMS:
+            raise ValueError(f"Unknown vector algorithm {vector_algorithm}, expected one of {VECTOR_ALGORITHMS}")
+        self.dimensions = dimensions
+        self.tokens_per_minute = tokens_per_minute
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.vector_algorithm = vector_algorithm
+        self.hnsw_parameters = hnsw_parameters or {}
+        self.indexes = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self._vector_indexes = {}
+        self._text_indexes = {}
+        self._build_lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self._token_window = deque()
+
+    def reserve_tokens(self, tokens: int):
+        """Admit a request against the tokens-per-minute quota.
+
+        Returns:
+            float: 0 when admitted, otherwise seconds until enough quota frees up
+        """
+        if not self.tokens_per_minute:
+            return 0.0
+        with self.lock:
+            _now = time.monotonic()
+            while self._token_window and self._token_window[0][0] <= _now - 60:
+                self._token_window.popleft()
+            _used = sum(_tokens for _, _tokens in self._token_window)
+            if _used + tokens > self.tokens_per_minute and self._token_window:
+                self.throttled += 1
+                _freed = 0
+                for _timestamp, _tokens in self._token_window:
+                    _freed += _tokens
+                    if _used - _freed + tokens <= self.tokens_per_minute:
+                        return max(_timestamp + 60 - _now, 0.001)
+                return 60.0
+            self._token_window.append((_now, tokens))
+            return 0.0
+
+    def index_documents(self, index_name: str, actions: list):
+        _results = []
+        with self.lock:
+            _documents = self.indexes.setdefault(index_name, {})
+            self.versions[index_name] = self.versions.get(index_name, 0) + 1
+            for _action in actions:
+                _action = dict(_action)
+                _kind = _action.pop("@search.action", "upload")
+                _key = _action.get("chunk_id")
+                if _kind == "delete":
+                    _documents.pop(_key, None)
+                elif _kind in ("merge", "mergeOrUpload") and _key in _documents:
+                    _documents[_key].update(_action)
+                else:
+                    _documents[_key] = _action
+                _results.append(
+                    {"key": _key, "status": True, "errorMessage": None, "statusCode": 200}
+                )
+        return _results
+
+    def text_index(self, index_name: str) -> KeywordIndex:
+        """BM25 index of ``title`` and ``chunk`` terms, rebuilt after every change."""
+        with self._build_lock:
+            with self.lock:
+                _version = self.versions.get(index_name, 0)
+                _cached = self._text_indexes.get(index_name)
+                if _cached is not None and _cached[0] == _version:
+                    return _cached[1]
+                _documents = list(self.indexes.get(index_name, {}).items())
+            _keyword_index = KeywordIndex(_documents)
+            self._text_indexes[index_name] = (_version, _keyword_index)
+            return _keyword_index
+
+    def vector_index(self, index_name: str, field: str):
+        """Chunk ids, normalized vector matrix and HNSW graph of an index, rebuilt after every change."""
+        with self._build_lock:
+            with self.lock:
+                _version = self.versions.get(index_name, 0)
+                _cached = self._vector_indexes.get((index_name, field))
+                if _cached is not None and _cached[0] == _version:
+                    return _cached[1:]
+                _documents = [
+                    (_key, _document[field])
+                    for _key, _document in self.indexes.get(index_name, {}).items()
+                    if _document.get(field)
+                ]
+            _keys = [_key for _key, _ in _documents]
+            _matrix = np.asarray([_vector for _, _vector in _documents], dtype=np.float32)
+            if len(_documents):
+                _matrix /= np.maximum(np.linalg.norm(_matrix, axis=1, keepdims=True), 1e-12)
+            _graph = None
+            if self.vector_algorithm == "hnsw" and len(_documents):
+                _started = time.perf_counter()
+                _graph = HnswGraph(_matrix.shape[1], **self.hnsw_parameters)
+                for _row in _matrix:
+                    _graph.add(_row)
+                _logger.info(
+                    "Built HNSW graph of %s over %d vectors in %.2fs",
+                    index_name,
+                    len(_documents),
+                    time.perf_counter() - _started,
+                )
+            self._vector_indexes[(index_name, field)] = (_version, _keys, _matrix, _graph)
+            return _keys, _matrix, _graph
+
+    def _vector_ranking(self, index_name: str, vector_query: dict, allowed=None):
+        """(score, chunk_id) of the ``k`` nearest documents, through HNSW unless exhaustive."""
+        _field = (vector_query.get("fields") or "vector").split(",")[0]
+        _keys, _matrix, _graph = self.vector_index(index_name, _field)
+        if not _keys:
+            return []
+        if vector_query.get("kind") == "text":
+            _vector = fake_embedding(vector_query.get("text", ""), _matrix.shape[1])
+        else:
+            _vector = vector_query.get("vector") or []
+        _query = np.asarray(_vector, dtype=np.float32)
+        _query /= max(float(np.linalg.norm(_query)), 1e-12)
+        _k = vector_query.get("k") or 50
+        if _graph is not None and not vector_query.get("exhaustive"):
+            _nodes = None
+            if allowed is not None:
+                _nodes = {_node for _node, _key in enumerate(_keys) if _key in allowed}
+            _neighbors = _graph.search(_query, _k, allowed=_nodes)
+        else:
+            _similarities = _matrix @ _query
+            if allowed is not None:
+                _similarities[[_key not in allowed for _key in _keys]] = -np.inf
+            _positions = [
+                _position
+                for _position in np.argsort(-_similarities)[:_k]
+                if np.isfinite(_similarities[_position])
+            ]
+            _neighbors = [(float(_similarities[_position]), int(_position)) for _position in _positions]
+        return [(cosine_score(_similarity), _keys[_position]) for _similarity, _position in _neighbors]
+
+    def search(self, index_name: str, body: dict):
+        """Keyword, vector or hybrid (RRF-fused) search with an approximate semantic rerank."""
+        with self.lock:
+            _documents = dict(self.indexes.get(index_name, {}))
+        _allowed = None
+        if body.get("filter"):
+            _predicate = parse_filter(body["filter"])
+            _allowed = {_key for _key, _document in _documents.items() if _predicate(_document)}
+        _post_filter = (body.get("vectorFilterMode") or "").lower() == "postfilter"
+
+        _text = body.get("search")
+        _rankings = []
+        if _text and _text != "*":
+            _rankings.append(self.text_index(index_name).rank(_text, _allowed))
+        for _vector_query in body.get("vectorQueries") or []:
+            _ranking = self._vector_ranking(index_name, _vector_query, None if _post_filter else _allowed)
+            if _post_filter and _allowed is not None:
+                _ranking = [_item for _item in _ranking if _item[1] in _allowed]
+            _rankings.append(_ranking)
+
+        if not _rankings:
+            _scored = [(1.0, _key) for _key in _documents if _allowed is None or _key in _allowed]
+        elif len(_rankings) == 1:
+            _scored = _rankings[0]
+        else:
+            _scored = reciprocal_rank_fusion(_rankings)
+        _scored = [(_score, _key) for _score, _key in _scored if _key in _documents]
+
+        _reranker_scores = {}
+        if body.get("queryType") == "semantic":
+            # Rerank the top 50 by query term coverage, scaled to the 0-4 reranker range
+            _terms = set(_tokens(_text or " ".join(
+                _query.get("text", "") for _query in body.get("vectorQueries") or []
+            )))
+            _head = _scored[:50]
+            for _score, _key in _head:
+                _covered = _terms.intersection(_tokens(_documents[_key].get("chunk", "")))
+                _reranker_scores[_key] = 4.0 * len(_covered) / (len(_terms) or 1)
+            _head = sorted(_head, key=lambda _item: -_reranker_scores[_item[1]])
+            _scored = _head + _scored[50:]
+
+        for _clause in reversed([_clause.split() for _clause in (body.get("orderby") or "").split(",") if _clause.strip()]):
+            _scored = sorted(
+                _scored,
+                key=lambda _item: _documents[_item[1]].get(_clause[0]) or "",
+                reverse=len(_clause) > 1 and _clause[1].lower() == "desc",
+            )
+
+        _skip = body.get("skip") or 0
+        _top = 50 if body.get("top") is None else body["top"]
+        _select = [_field.strip() for _field in body["select"].split(",")] if body.get("select") else None
+        _value = []
+        for _score, _key in _scored[_skip : _skip + _top]:
+            _result = {
+                _name: _field_value
+                for _name, _field_value in _documents[_key].items()
+                if (_select is None and _name != "vector") or (_select and _name in _select)
+            }
+            _result["@search.score"] = _score
+            if _key in _reranker_scores:
+                _result["@search.rerankerScore"] = _reranker_scores[_key]
+            _value.append(_result)
+        _response = {"value": _value}
+        if body.get("count"):
+            _response["@odata.count"] = len(_scored)
+        if body.get("facets"):
+            _response["@search.facets"] = facet_counts(
+                [_documents[_key] for _, _key in _scored], body["facets"]
+            )
+        return _response
+
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    server_version = "FakeAzure/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY keep-alive
+    # clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        _logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _read_json(self):
+        _length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(_length) or b"{}")
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        _body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(_body)))
+        for _name, _value in (headers or {}).items():
+            self.send_header(_name, _value)
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def do_GET(self):
+        _state = self.server.state
+        _path = self.path.split("?", 1)[0]
+        _match = _INDEX_COUNT_PATTERN.match(_path)
+        if _match:
+            _index_name = _match.group("quoted") or _match.group("plain")
+            with _state.lock:
+                _count = len(_state.indexes.get(_index_name, {}))
+            self._send_json(200, _count)
+            return
+        self._send_json(404, {"error": {"code": "NotFound", "message": _path}})
+
+    def do_POST(self):
+        _state = self.server.state
+        with _state.lock:
+            _state.requests += 1
+        _path = self.path.split("?", 1)[0]
+
+        _match = _INDEX_DOCS_PATTERN.match(_path)
+        if _match:
+            _index_name = _match.group("quoted") or _match.group("plain")
+            _body = self._read_json()
+            _results = _state.index_documents(_index_name, _body.get("value", []))
+            self._send_json(200, {"value": _results})
+            return
+
+        _match = _INDEX_SEARCH_PATTERN.match(_path)
+        if _match:
+            _index_name = _match.group("quoted") or _match.group("plain")
+            self._send_json(200, _state.search(_index_name, self._read_json()))
+            return
+
+        _match = _EMBEDDINGS_PATTERN.match(_path)
+        if _match:
+            self._handle_embeddings(_match.group("deployment"), self._read_json())
+            return
+
+        _match = _CHAT_PATTERN.match(_path)
+        if _match:
+            self._handle_chat(_match.group("deployment"), self._read_json())
+            return
+
+        self._send_json(404, {"error": {"code": "NotFound", "message": _path}})
+
+    def _handle_embeddings(self, deployment: str, body: dict):
+        _inputs = body.get("input", [])
+        if isinstance(_inputs, str):
+            _inputs = [_inputs]
+        _dimensions = int(body.get("dimensions") or self.server.state.dimensions)
+        _base64 = body.get("encoding_format") == "base64"
+        _tokens = sum(len(_TOKEN_PATTERN.findall(_text)) for _text in _inputs)
+        _retry_after = self.server.state.reserve_tokens(_tokens)
+        if _retry_after:
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                {
+                    "Retry-After": str(math.ceil(_retry_after)),
+                    "retry-after-ms": str(int(_retry_after * 1000)),
+                },
+            )
+            return
+        if self.server.state.latency_ms:
+            time.sleep(self.server.state.latency_ms / 1000)
+        _data = []
+        for _position, _text in enumerate(_inputs):
+            _vector = fake_embedding(_text, _dimensions)
+            if _base64:
+                _vector = base64.b64encode(struct.pack(f"<{_dimensions}f", *_vector)).decode("ascii")
+            _data.append({"object": "embedding", "index": _position, "embedding": _vector})
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "data": _data,
+                "model": deployment,
+                "usage": {"prompt_tokens": _tokens, "total_tokens": _tokens},
+            },
+        )
+
+
+    def _handle_chat(self, deployment: str, body: dict):
+        _state = self.server.state
+        _prompt = next(
+            (
+                _message.get("content") or ""
+                for _message in reversed(body.get("messages", []))
+                if _message.get("role") == "user"
+            ),
+            "",
+        )
+        _answer = fake_answer(_prompt)
+        _prompt_tokens = sum(len(_tokens(_message.get("content") or "")) for _message in body.get("messages", []))
+        _completion_tokens = len(_tokens(_answer))
+        if _state.latency_ms:
+            time.sleep(_state.latency_ms / 1000)
+        _created = int(time.time())
+
+        if not body.get("stream"):
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": _created,
+                    "model": deployment,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": _answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": _prompt_tokens,
+                        "completion_tokens": _completion_tokens,
+                        "total_tokens": _prompt_tokens + _completion_tokens,
+                    },
+                },
+            )
+            return
+
+        # Server-sent events, one chunk per word; the connection closes after [DONE]
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        _pieces = re.findall(r"\S+\s*", _answer)
+        for _position, _piece in enumerate(_pieces):
+            if _state.token_latency_ms:
+                time.sleep(_state.token_latency_ms / 1000)
+            _chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": _created,
+                "model": deployment,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": _piece} if _position == 0 else {"content": _piece},
+                        "finish_reason": "stop" if _position == len(_pieces) - 1 else None,
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(_chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeAzureServer:
+    """Local stand-in for the Azure AI Search document API and Azure OpenAI.
+
+    Serves document indexing, keyword/vector/hybrid search, embeddings and
+    (streamed) chat completions. Point ``--search-endpoint`` and
+    ``--azure-openai-endpoint`` at :attr:`endpoint` to exercise ingestion and
+    query code without any Azure resources.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dimensions: int = 1536,
+        tokens_per_minute: int = 0,
+        latency_ms: float = 0.0,
+        token_latency_ms: float = 0.0,
+        vector_algorithm: str = "exhaustive",
+        hnsw_parameters: dict = None,
+    ):
+        self.state = FakeAzureState(
+            dimensions=dimensions,
+            tokens_per_minute=tokens_per_minute,
+            latency_ms=latency_ms,
+            token_latency_ms=token_latency_ms,
+            vector_algorithm=vector_algorithm,
+            hnsw_parameters=hnsw_parameters,
+        )
+        self.httpd = ThreadingHTTPServer((host, port), FakeAzureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        _host, _port = self.httpd.server_address[:2]
+        return f"http://{_host}:{_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info("Fake Azure endpoint listening on %s", self.endpoint)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Host to bind",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to bind",
+        default=8765,
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        help="Default embedding dimensions",
+        default=1536,
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        help="Embedding token quota, requests over it get 429 with retry-after (0 disables)",
+        default=0,
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        help="Artificial latency added to every embedding and chat request",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--token-latency-ms",
+        type=float,
+        help="Artificial delay between streamed chat completion chunks",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--vector-algorithm",
+        choices=VECTOR_ALGORITHMS,
+        help="Vector search algorithm for non-exhaustive queries",
+        default="exhaustive",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _server = FakeAzureServer(
+        _args.host,
+        _args.port,
+        _args.dimensions,
+        _args.tokens_per_minute,
+        _args.latency_ms,
+        _args.token_latency_ms,
+        _args.vector_algorithm,
+    )
+    logging.info("Fake Azure endpoint listening on %s", _server.endpoint)
+    try:
+        _server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import functools
+import math
+
+
+FILTER_MODES = ("auto", "preFilter", "postFilter")
+HEADER_FIELDS = ("header_1", "header_2", "header_3")
+# page_number is a string field, so ranges are enumerated into search.in
+MAX_PAGE_RANGE = 1000
+_DELIMITERS = (",", "|", ";", "~")
+
+
+def quote(value) -> str:
+    """OData string literal of ``value``."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _any_of(field: str, values) -> str:
+    _values = list(dict.fromkeys(str(_value) for _value in values))
+    if len(_values) == 1:
+        return f"{field} eq {quote(_values[0])}"
+    _delimiter = next(
+        (_delimiter for _delimiter in _DELIMITERS if not any(_delimiter in _value for _value in _values)), None
+    )
+    if _delimiter is None:
+        return "(" + " or ".join(f"{field} eq {quote(_value)}" for _value in _values) + ")"
+    return f"search.in({field}, {quote(_delimiter.join(_values))}, '{_delimiter}')"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_filter(
+    parent_ids: tuple = (),
+    titles: tuple = (),
+    blob_paths: tuple = (),
+    pages: tuple = None,
+    headers: tuple = (),
+    expression: str = None,
+):
+    """Compile structured metadata filters into an OData ``$filter``, ``None`` when empty.
+
+    Values of one field are OR-ed with ``search.in``, fields are AND-ed. Compiled
+    strings are cached, so repeated scopes return the identical string and hit
+    the search result cache.
+
+    Args:
+        parent_ids (tuple): document set, by ``parent_id``
+        titles (tuple): source file names
+        blob_paths (tuple): source blob paths
+        pages (tuple): inclusive (first, last) page range
+        headers (tuple): (``header_1``..``header_3``, value) pairs
+        expression (str): raw OData AND-ed with the rest
+
+    Raises:
+        ValueError: unknown header field or invalid page range
+    """
+    _clauses = []
+    for _field, _values in (("parent_id", parent_ids), ("title", titles), ("blob_path", blob_paths)):
+        if _values:
+            _clauses.append(_any_of(_field, _values))
+    if pages:
+        _first, _last = int(pages[0]), int(pages[-1])
+        if _first < 1 or _last < _first:
+            raise ValueError(f"Invalid page range {_first}-{_last}")
+        if _last - _first + 1 > MAX_PAGE_RANGE:
+            raise ValueError(f"Page range {_first}-{_last} is longer than {MAX_PAGE_RANGE} pages")
+        _clauses.append(_any_of("page_number", range(_first, _last + 1)))
+    for _field, _value in headers:
+        if _field not in HEADER_FIELDS:
+            raise ValueError(f"Unknown header field {_field}, expected one of {HEADER_FIELDS}")
+        _clauses.append(f"{_field} eq {quote(_value)}")
+    if expression and expression.strip():
+        _clauses.append(f"({expression})" if _clauses else expression)
+    return " and ".join(_clauses) or None
+
+
+def parse_page_range(value: str) -> tuple:
+    """``"3-7"`` -> ``(3, 7)``, ``"4"`` -> ``(4, 4)``."""
+    _first, _, _last = str(value).partition("-")
+    return int(_first), int(_last or _first)
+
+
+def _values(filters: dict, name: str) -> tuple:
+    """List filter ``name`` as a tuple, a bare string being a list of one."""
+    _value = filters.get(name)
+    if not _value:
+        return ()
+    if isinstance(_value, str):
+        return (_value,)
+    if not isinstance(_value, (list, tuple)):
+        raise ValueError(f"{name} must be a list of strings")
+    return tuple(_value)
+
+
+def filter_from_dict(filters: dict):
+    """Compile the ``filters`` object of an API request.
+
+    Accepts ``parent_ids``, ``titles``, ``blob_paths`` (lists, or one string), ``pages``
+    (``[first, last]`` or ``"3-7"``), ``headers`` (``{"header_1": "..."}``)
+    and ``expression`` (raw OData).
+    """
+    if not filters:
+        return None
+    _unknown = set(filters) - {"parent_ids", "titles", "blob_paths", "pages", "headers", "expression"}
+    if _unknown:
+        raise ValueError(f"Unknown filters {sorted(_unknown)}")
+    _pages = filters.get("pages")
+    if isinstance(_pages, str):
+        _pages = parse_page_range(_pages)
+    return compile_filter(
+        parent_ids=_values(filters, "parent_ids"),
+        titles=_values(filters, "titles"),
+        blob_paths=_values(filters, "blob_paths"),
+        pages=tuple(_pages) if _pages else None,
+        headers=tuple(sorted((filters.get("headers") or {}).items())),
+        expression=filters.get("expression"),
+    )
+
+
+def add_filter_arguments(parser):
+    """Add the structured filter options shared by the query CLIs."""
+    parser.add_argument(
+        "--parent-id",
+        nargs="+",
+        help="Only search these documents (parent_id)",
+        default=None,
+    )
+    parser.add_argument(
+        "--title",
+        nargs="+",
+        help="Only search these source files",
+        default=None,
+    )
+    parser.add_argument(
+        "--page-range",
+        type=parse_page_range,
+        help="Only search these pages, e.g. 3-7 (index needs --add-page-numbers)",
+        default=None,
+    )
+    parser.add_argument(
+        "--header",
+        nargs="+",
+        help="Only search these sections, e.g. header_1='Plan overview' (index needs --use-document-layout)",
+        default=None,
+    )
+    parser.add_argument(
+        "--filter",
+        help="Raw OData filter, AND-ed with the structured filters",
+        default=None,
+    )
+    parser.add_argument(
+        "--vector-filter-mode",
+        choices=FILTER_MODES,
+        help="Filter before or after the vector search, auto picks from the filter's selectivity",
+        default="auto",
+    )
+
+
+def filter_from_args(args):
+    """Compile the options added by :func:`add_filter_arguments`."""
+    _headers = []
+    for _header in args.header or ():
+        _field, _, _value = _header.partition("=")
+        _headers.append((_field.strip(), _value.strip().strip("'\"")))
+    return compile_filter(
+        parent_ids=tuple(args.parent_id or ()),
+        titles=tuple(args.title or ()),
+        pages=args.page_range,
+        headers=tuple(sorted(_headers)),
+        expression=args.filter,
+    )
+
+
+def choose_filter_mode(selectivity: float, mode: str = "auto", post_filter_threshold: float = 0.5) -> str:
+    """``preFilter`` or ``postFilter`` for a filter passing ``selectivity`` of the index.
+
+    Pre-filtering restricts the vector search to matching documents and always
+    returns ``k`` of them, so it is used for narrow scopes. When most documents
+    pass, post-filtering the unrestricted neighbors is cheaper.
+    """
+    if mode != "auto":
+        return mode
+    if selectivity is None or selectivity < post_filter_threshold:
+        return "preFilter"
+    return "postFilter"
+
+
+def post_filter_k(k: int, selectivity: float, limit: int = 1000) -> int:
+    """Neighbors to fetch so about ``k`` survive a post-filter passing ``selectivity``."""
+    if not selectivity:
+        return k
+    return min(max(k, math.ceil(k / selectivity)), limit)
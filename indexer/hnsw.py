@@ -0,0 +1,191 @@
+import heapq
+import math
+import random
+
+import numpy as np
+
+
+class HnswGraph:
+    """Hierarchical navigable small world graph over unit vectors (cosine similarity).
+
+    Mirrors the parameters of ``HnswAlgorithmConfiguration``: ``m`` bi-directional
+    links per node (``2 * m`` on the bottom layer), ``ef_construction`` candidates
+    while inserting and ``ef_search`` candidates while querying. Removed nodes
+    stay in the graph as routing points but are never returned.
+
+    Args:
+        dimensions (int): vector dimensions
+        m (int): links per node
+        ef_construction (int): candidate list size while building
+        ef_search (int): default candidate list size while searching
+        dtype: storage type of the vectors, ``float32`` or ``float16``
+        seed (int): level assignment seed, for reproducible graphs
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        m: int = 4,
+        ef_construction: int = 400,
+        ef_search: int = 500,
+        dtype=np.float32,
+        seed: int = 0,
+    ):
+        self.dimensions = dimensions
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.vectors = np.zeros((16, dimensions), dtype=dtype)
+        self.count = 0
+        self.deleted = set()
+        self._levels = []
+        self._layers = []
+        self._entry_point = None
+        self._level_multiplier = 1 / math.log(max(m, 2))
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return self.count - len(self.deleted)
+
+    def _similarities(self, query: np.ndarray, ids: list) -> np.ndarray:
+        return self.vectors[ids].astype(np.float32) @ query
+
+    def _search_layer(self, query: np.ndarray, entry_points: list, ef: int, level: int):
+        """Best-first search of one layer, returns up to ``ef`` (similarity, id) pairs, best first."""
+        _visited = set(entry_points)
+        _similarities = self._similarities(query, entry_points)
+        # Max-heap of candidates to expand and min-heap of the current best results
+        _candidates = [(-_similarity, _id) for _similarity, _id in zip(_similarities, entry_points)]
+        heapq.heapify(_candidates)
+        _best = [(_similarity, _id) for _similarity, _id in zip(_similarities, entry_points)]
+        heapq.heapify(_best)
+        while len(_best) > ef:
+            heapq.heappop(_best)
+        _layer = self._layers[level]
+        while _candidates:
+            _negative, _id = heapq.heappop(_candidates)
+            if -_negative < _best[0][0] and len(_best) >= ef:
+                break
+            _neighbors = [_neighbor for _neighbor in _layer.get(_id, ()) if _neighbor not in _visited]
+            if not _neighbors:
+                continue
+            _visited.update(_neighbors)
+            for _similarity, _neighbor in zip(self._similarities(query, _neighbors), _neighbors):
+                if len(_best) < ef or _similarity > _best[0][0]:
+                    heapq.heappush(_candidates, (-_similarity, _neighbor))
+                    heapq.heappush(_best, (_similarity, _neighbor))
+                    if len(_best) > ef:
+                        heapq.heappop(_best)
+        return sorted(_best, reverse=True)
+
+    def _select_neighbors(self, candidates: list, limit: int):
+        """Keep diverse neighbors: a candidate closer to a kept neighbor than to the node is skipped."""
+        _kept = []
+        for _similarity, _id in candidates:
+            if len(_kept) >= limit:
+                break
+            if _kept and (self._similarities(self.vectors[_id].astype(np.float32), _kept) > _similarity).any():
+                continue
+            _kept.append(_id)
+        if len(_kept) < limit:
+            # Top up with the nearest skipped candidates so sparse regions stay connected
+            _kept_set = set(_kept)
+            _kept.extend(
+                [_id for _, _id in candidates if _id not in _kept_set][: limit - len(_kept)]
+            )
+        return _kept
+
+    def add(self, vector) -> int:
+        """Insert a vector and return its id."""
+        _vector = np.asarray(vector, dtype=np.float32)
+        _norm = np.linalg.norm(_vector)
+        if _norm:
+            _vector = _vector / _norm
+        if self.count == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+        _id = self.count
+        self.vectors[_id] = _vector
+        self.count += 1
+
+        _level = int(-math.log(1 - self._random.random()) * self._level_multiplier)
+        self._levels.append(_level)
+        while len(self._layers) <= _level:
+            self._layers.append({})
+        for _layer_level in range(_level + 1):
+            self._layers[_layer_level][_id] = []
+
+        if self._entry_point is None:
+            self._entry_point = _id
+            return _id
+
+        _entry_points = [self._entry_point]
+        _top_level = self._levels[self._entry_point]
+        for _layer_level in range(_top_level, _level, -1):
+            _entry_points = [self._search_layer(_vector, _entry_points, 1, _layer_level)[0][1]]
+        for _layer_level in range(min(_level, _top_level), -1, -1):
+            _candidates = self._search_layer(_vector, _entry_points, self.ef_construction, _layer_level)
+            _limit = self.m * 2 if _layer_level == 0 else self.m
+            _neighbors = self._select_neighbors(_candidates, _limit)
+            _layer = self._layers[_layer_level]
+            _layer[_id] = _neighbors
+            for _neighbor in _neighbors:
+                _links = _layer[_neighbor]
+                _links.append(_id)
+                if len(_links) > _limit:
+                    _neighbor_vector = self.vectors[_neighbor].astype(np.float32)
+                    _ranked = sorted(
+                        zip(self._similarities(_neighbor_vector, _links), _links), reverse=True
+                    )
+                    _layer[_neighbor] = self._select_neighbors(_ranked, _limit)
+            _entry_points = [_id for _, _id in _candidates]
+        if _level > _top_level:
+            self._entry_point = _id
+        return _id
+
+    def remove(self, node_id: int):
+        self.deleted.add(node_id)
+
+    def search(self, vector, k: int, ef: int = None, allowed=None):
+        """Approximate ``k`` nearest neighbors as (cosine similarity, id), best first.
+
+        With ``allowed``, the candidate list widens until ``k`` allowed ids are
+        found or the whole graph was searched. An ``allowed`` set no larger than
+        the candidate list is searched exactly instead.
+
+        Args:
+            vector: query vector
+            k (int): number of neighbors
+            ef (int): candidate list size, defaults to ``ef_search``
+            allowed: optional container of ids that may be returned (filtering)
+        """
+        if self._entry_point is None:
+            return []
+        _query = np.asarray(vector, dtype=np.float32)
+        _norm = np.linalg.norm(_query)
+        if _norm:
+            _query = _query / _norm
+        _ef = max(ef or self.ef_search, k)
+        if allowed is not None and len(allowed) <= _ef:
+            return self._exact_search(_query, k, allowed)
+        _entry_points = [self._entry_point]
+        for _layer_level in range(self._levels[self._entry_point], 0, -1):
+            _entry_points = [self._search_layer(_query, _entry_points, 1, _layer_level)[0][1]]
+        while True:
+            _results = []
+            for _similarity, _id in self._search_layer(_query, _entry_points, _ef, 0):
+                if _id in self.deleted or (allowed is not None and _id not in allowed):
+                    continue
+                _results.append((float(_similarity), _id))
+                if len(_results) == k:
+                    return _results
+            if _ef >= self.count:
+                return _results
+            _ef = min(_ef * 2, self.count)
+
+    def _exact_search(self, query: np.ndarray, k: int, ids):
+        _ids = [_id for _id in ids if _id < self.count and _id not in self.deleted]
+        if not _ids:
+            return []
+        _similarities = self._similarities(query, _ids)
+        _top = np.argsort(-_similarities, kind="stable")[:k]
+        return [(float(_similarities[_index]), _ids[_index]) for _index in _top]
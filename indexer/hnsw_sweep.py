@@ -0,0 +1,348 @@
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+
+from hnsw import HnswGraph
+from metrics import LatencyRecorder
+from quantization_bench import hold_out
+from relevance_bench import OBJECTIVES, format_table, load_labels, pareto_front, score_ranking
+
+
+_logger = logging.getLogger(__name__)
+
+# Mirrors index.py, kept here so the sweep runs without the Azure SDK
+HNSW_M_RANGE = (4, 10)
+HNSW_EF_RANGE = (100, 1000)
+SWEEP_OBJECTIVES = ("ann_recall",) + OBJECTIVES
+PAGE_SIZE = 1000
+
+
+def load_local_corpus(path: str):
+    """(documents, vectors) of a local index built by ``push_indexer.py --local-index-path``."""
+    from local_index import LocalIndex
+
+    _index = LocalIndex(path)
+    try:
+        _rows = sorted(_index.keys)
+        _documents = [{"chunk_id": _index.keys[_row], **_index.documents[_index.keys[_row]]} for _row in _rows]
+        _vectors = np.asarray(_index.vectors[np.array(_rows, dtype=np.int64)], dtype=np.float32)
+    finally:
+        _index.close()
+    return _documents, _vectors
+
+
+def load_service_corpus(search_client, field: str = "vector"):
+    """(documents, vectors) of a service index, paged with ``skip``; the vector field must be retrievable."""
+    _documents = []
+    _vectors = []
+    while True:
+        _page = list(
+            search_client.search(
+                search_text="*",
+                select=["chunk_id", "title", "chunk", field],
+                top=PAGE_SIZE,
+                skip=len(_documents),
+            )
+        )
+        for _result in _page:
+            if not _result.get(field):
+                raise ValueError(f"{_result['chunk_id']} has no retrievable {field}, the index discards stored vectors")
+            _vectors.append(_result[field])
+            _documents.append({_name: _result.get(_name) for _name in ("chunk_id", "title", "chunk")})
+        if len(_page) < PAGE_SIZE:
+            break
+    return _documents, np.asarray(_vectors, dtype=np.float32).reshape(len(_vectors), -1)
+
+
+class HnswSweep:
+    """Measures HNSW parameter candidates on local graphs built from an index's vectors.
+
+    Every (``m``, ``ef_construction``) pair builds one :class:`hnsw.HnswGraph`,
+    timed and sized with ``tracemalloc``; every ``ef_search`` then runs the
+    queries on that graph. ``ann_recall`` is the overlap of the top ``k``
+    with exact cosine search; with labeled queries the recall, MRR and nDCG
+    of :func:`relevance_bench.score_ranking` are reported as well. The graph
+    is pure Python, so absolute build times and latencies are far above the
+    service's; use them to rank candidates, not to predict production numbers.
+    """
+
+    def __init__(self, args):
+        self.args = args
+
+    def load(self):
+        """Corpus documents, normalized corpus vectors, query vectors and labels (``None`` without)."""
+        _args = self.args
+        if _args.local_index_path:
+            _documents, _vectors = load_local_corpus(_args.local_index_path)
+        else:
+            from clients import get_factory
+
+            _search_client = get_factory(_args.search_endpoint).search_client(_args.index_name)
+            try:
+                _documents, _vectors = load_service_corpus(_search_client, _args.vector_field)
+            finally:
+                _search_client.close()
+        if not len(_documents):
+            raise ValueError("The index has no vectors to sweep")
+        _vectors /= np.maximum(np.linalg.norm(_vectors, axis=1, keepdims=True), 1e-12)
+
+        _labels = None
+        if _args.labels:
+            from async_embedder import EmbeddingEngine
+
+            _labels = load_labels(_args.labels)
+            _engine = EmbeddingEngine(
+                endpoint=_args.azure_openai_endpoint,
+                deployment=_args.azure_openai_embedding_deployment,
+                dimensions=_vectors.shape[1],
+            )
+            try:
+                _queries = np.asarray(_engine.embed([_label["query"] for _label in _labels]), dtype=np.float32)
+            finally:
+                _engine.close()
+        else:
+            _held_out, _keep = hold_out(len(_vectors), _args.sample_queries, np.random.default_rng(_args.seed))
+            _queries = _vectors[_held_out]
+            _vectors = _vectors[_keep]
+            _documents = [_documents[_position] for _position in _keep]
+        _queries /= np.maximum(np.linalg.norm(_queries, axis=1, keepdims=True), 1e-12)
+        return _documents, _vectors, _queries, _labels
+
+    def build(self, vectors: np.ndarray, m: int, ef_construction: int):
+        """(graph, seconds, bytes) of an HNSW graph over ``vectors``."""
+        tracemalloc.start()
+        _started = time.perf_counter()
+        _graph = HnswGraph(vectors.shape[1], m=m, ef_construction=ef_construction)
+        for _vector in vectors:
+            _graph.add(_vector)
+        _seconds = time.perf_counter() - _started
+        _bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return _graph, _seconds, _bytes
+
+    def run(self):
+        _args = self.args
+        _documents, _vectors, _queries, _labels = self.load()
+        _k = _args.k
+        _exact = [set(np.argsort(-(_vectors @ _query))[:_k].tolist()) for _query in _queries]
+        _rows = []
+        for _m in _args.m:
+            for _ef_construction in _args.ef_construction:
+                _graph, _build_seconds, _graph_bytes = self.build(_vectors, _m, _ef_construction)
+                logging.info(
+                    "m=%s efConstruction=%s: built %d nodes in %.2fs, %.1f KiB",
+                    _m,
+                    _ef_construction,
+                    len(_vectors),
+                    _build_seconds,
+                    _graph_bytes / 1024,
+                )
+                for _ef_search in _args.ef_search:
+                    _recorder = LatencyRecorder()
+                    _found = []
+                    for _query in _queries:
+                        with _recorder.time("search"):
+                            _found.append([_node for _, _node in _graph.search(_query, _k, ef=_ef_search)])
+                    _latency = _recorder.summary()["search"]
+                    _row = {
+                        "m": _m,
+                        "ef_construction": _ef_construction,
+                        "ef_search": _ef_search,
+                        "ann_recall": round(
+                            float(
+                                np.mean([len(_expected & set(_nodes)) / _k for _expected, _nodes in zip(_exact, _found)])
+                            ),
+                            4,
+                        ),
+                    }
+                    if _labels is not None:
+                        _scores = [
+                            score_ranking(_label["needles"], [_documents[_node] for _node in _nodes], _k)
+                            for _label, _nodes in zip(_labels, _found)
+                        ]
+                        for _name in OBJECTIVES:
+                            _row[_name] = round(sum(_score[_name] for _score in _scores) / len(_scores), 4)
+                    _row.update(
+                        {
+                            "p50_ms": _latency["p50_ms"],
+                            "p95_ms": _latency["p95_ms"],
+                            "build_seconds": round(_build_seconds, 3),
+                            "graph_bytes": _graph_bytes,
+                        }
+                    )
+                    _rows.append(_row)
+                    _logger.debug("%s", _row)
+        pareto_front(_rows, _args.objective)
+        return {
+            "backend": "local" if _args.local_index_path else "service",
+            "documents": len(_vectors),
+            "dimensions": _vectors.shape[1],
+            "queries": len(_queries),
+            "labeled": _labels is not None,
+            "k": _k,
+            "objective": _args.objective,
+            "vector_bytes": _vectors.nbytes,
+            "candidates": _rows,
+        }
+
+
+_TABLE_COLUMNS = (
+    ("m", "m"),
+    ("ef_construction", "efConstruction"),
+    ("ef_search", "efSearch"),
+    ("ann_recall", "ann_recall"),
+    ("recall", "recall"),
+    ("mrr", "mrr"),
+    ("ndcg", "ndcg"),
+    ("p50_ms", "p50_ms"),
+    ("p95_ms", "p95_ms"),
+    ("build_seconds", "build_s"),
+    ("graph_bytes", "graph_bytes"),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--local-index-path",
+        type=str,
+        help="Sweep the vectors of a local index built by push_indexer.py --local-index-path",
+        default=None,
+    )
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Sweep the vectors of a service index, its vector field must be retrievable",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        default="ragsearch",
+    )
+    parser.add_argument(
+        "--vector-field",
+        type=str,
+        help="Vector field of the service index",
+        default="vector",
+    )
+    parser.add_argument(
+        "--m",
+        nargs="+",
+        type=int,
+        help="HNSW links per node to try",
+        default=[4, 6, 8, 10],
+    )
+    parser.add_argument(
+        "--ef-construction",
+        nargs="+",
+        type=int,
+        help="HNSW build candidate list sizes to try",
+        default=[100, 400],
+    )
+    parser.add_argument(
+        "--ef-search",
+        nargs="+",
+        type=int,
+        help="HNSW query candidate list sizes to try",
+        default=[100, 500, 1000],
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        help="Neighbors per query, recall is measured at k",
+        default=10,
+    )
+    parser.add_argument(
+        "--labels",
+        type=str,
+        help="Labeled queries as JSON lines (see relevance_bench.py), held-out chunks are used without",
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-queries",
+        type=int,
+        help="Number of held-out chunks used as queries without --labels",
+        default=100,
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint, needed to embed --labels queries",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--objective",
+        choices=SWEEP_OBJECTIVES,
+        help="Quality metric of the Pareto front, label metrics need --labels",
+        default="ann_recall",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Query sampling seed",
+        default=0,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+    if not _args.search_endpoint and not _args.local_index_path:
+        parser.error("either --search-endpoint or --local-index-path is required")
+    if _args.labels and not _args.azure_openai_endpoint:
+        parser.error("--labels needs --azure-openai-endpoint to embed the queries")
+    if _args.objective != "ann_recall" and not _args.labels:
+        parser.error(f"--objective {_args.objective} needs --labels")
+    for _m in _args.m:
+        if not HNSW_M_RANGE[0] <= _m <= HNSW_M_RANGE[1]:
+            parser.error(f"--m values must be between {HNSW_M_RANGE[0]} and {HNSW_M_RANGE[1]}")
+    for _ef in _args.ef_construction + _args.ef_search:
+        if not HNSW_EF_RANGE[0] <= _ef <= HNSW_EF_RANGE[1]:
+            parser.error(
+                f"--ef-construction and --ef-search values must be between {HNSW_EF_RANGE[0]} and {HNSW_EF_RANGE[1]}"
+            )
+
+    _results = HnswSweep(_args).run()
+    print(format_table(_results["candidates"], _args.objective, _TABLE_COLUMNS))
+    _best = [_row for _row in _results["candidates"] if _row["pareto"]]
+    logging.info(
+        "Pareto-optimal (m, efConstruction, efSearch): %s",
+        [(_row["m"], _row["ef_construction"], _row["ef_search"]) for _row in _best],
+    )
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_results, _file, indent=2)
+        logging.info("Results written to %s", _args.output)
+
+
+if __name__ == "__main__":
+    main()
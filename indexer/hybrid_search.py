@@ -0,0 +1,419 @@
+import argparse
+import json
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.search.documents.models import VectorizedQuery
+
+from clients import get_factory
+from filters import add_filter_arguments, choose_filter_mode, filter_from_args, post_filter_k
+from local_index import RRF_K, reciprocal_rank_fusion
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+FUSION_METHODS = ("rrf", "weighted")
+DEFAULT_SELECT = ("chunk_id", "parent_id", "title", "chunk")
+
+RetrievalResult = namedtuple("RetrievalResult", ["documents", "confidence", "reranked"])
+
+
+def weighted_fusion(rankings: list, weights: list):
+    """Min-max normalize each (score, key) ranking to 0..1 and sum with ``weights``, best first."""
+    _fused = {}
+    for _ranking, _weight in zip(rankings, weights):
+        if not _ranking:
+            continue
+        _high = _ranking[0][0]
+        _low = _ranking[-1][0]
+        _span = (_high - _low) or 1.0
+        for _score, _key in _ranking:
+            _normalized = (_score - _low) / _span if _high != _low else 1.0
+            _fused[_key] = _fused.get(_key, 0.0) + _weight * _normalized
+    return sorted(((_score, _key) for _key, _score in _fused.items()), reverse=True)
+
+
+class HybridRetriever:
+    """Hybrid retrieval funnel: concurrent keyword and vector candidates, local fusion, conditional rerank.
+
+    The keyword and vector queries run in parallel, each fetching its own
+    candidate depth, and are fused client side with RRF or weighted min-max
+    scores. The semantic reranker runs over the top ``rerank_depth`` fused
+    candidates only when the fused confidence is below ``rerank_threshold``.
+    Confidence is the share of the fused top ``top`` that both legs return in
+    their own top ``top``. A single leg gives no agreement signal and counts
+    as 0, so keyword-only or vector-only retrieval always reranks.
+
+    Args:
+        search_client: ``SearchClient`` or ``LocalSearchClient``
+        embed: callable returning the vector of a query text
+        top (int): results returned
+        keyword_depth (int): keyword candidates, 0 disables the keyword leg
+        vector_depth (int): vector candidates, 0 disables the vector leg
+        fusion (str): ``rrf`` or ``weighted``
+        weights (tuple): (keyword, vector) weights of the fusion
+        rrf_k (int): RRF rank offset
+        rerank_depth (int): fused candidates sent to the semantic reranker (at most 50)
+        rerank_threshold (float): rerank when confidence is below this, 0 never reranks
+        semantic_configuration_name (str): semantic configuration, reranking is off without one
+        exhaustive (bool): brute-force the vector leg instead of HNSW, ``None`` lets the planner choose
+        planner (QueryPlanner): plans exhaustive or HNSW per query and estimates filter selectivity
+        filter_mode (str): ``auto``, ``preFilter`` or ``postFilter`` for filtered vector legs,
+            auto needs the planner's selectivity and otherwise pre-filters
+        select (tuple): fields to return, must include ``chunk_id``
+        recorder (LatencyRecorder): receives per-stage latency
+    """
+
+    def __init__(
+        self,
+        search_client,
+        embed=None,
+        top: int = 5,
+        keyword_depth: int = 50,
+        vector_depth: int = 50,
+        fusion: str = "rrf",
+        weights: tuple = (1.0, 1.0),
+        rrf_k: int = RRF_K,
+        rerank_depth: int = 20,
+        rerank_threshold: float = 0.5,
+        semantic_configuration_name: str = None,
+        exhaustive: bool = None,
+        planner=None,
+        filter_mode: str = "auto",
+        select: tuple = DEFAULT_SELECT,
+        recorder: LatencyRecorder = None,
+    ):
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSION_METHODS}")
+        if vector_depth and embed is None:
+            raise ValueError("The vector leg needs an embed callable")
+        self.search_client = search_client
+        self.embed = embed
+        self.top = top
+        self.keyword_depth = keyword_depth
+        self.vector_depth = vector_depth
+        self.fusion = fusion
+        self.weights = weights
+        self.rrf_k = rrf_k
+        self.rerank_depth = min(rerank_depth, 50)
+        self.rerank_threshold = rerank_threshold
+        self.semantic_configuration_name = semantic_configuration_name
+        self.exhaustive = exhaustive
+        self.planner = planner
+        self.filter_mode = filter_mode
+        self.select = list(select) if select else None
+        self.recorder = recorder or LatencyRecorder()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid")
+
+    def _keyword(self, query: str, filter: str):
+        with self.recorder.time("keyword"):
+            return list(
+                self.search_client.search(search_text=query, top=self.keyword_depth, filter=filter, select=self.select)
+            )
+
+    def _vector(self, query: str, filter: str):
+        with self.recorder.time("embed"):
+            _vector = self.embed(query)
+        _plan = self.planner.plan(filter) if self.planner is not None else None
+        _exhaustive = bool(self.exhaustive)
+        if _plan is not None and self.exhaustive is None:
+            _exhaustive = _plan.exhaustive
+        _k = self.vector_depth
+        _filter_mode = None
+        if filter:
+            _selectivity = _plan.selectivity if _plan is not None else None
+            _filter_mode = choose_filter_mode(_selectivity, self.filter_mode)
+            if _filter_mode == "postFilter":
+                _k = post_filter_k(_k, _selectivity)
+        _started = time.perf_counter()
+        with self.recorder.time("vector"):
+            _vector_query = VectorizedQuery(
+                vector=_vector,
+                k_nearest_neighbors=_k,
+                fields="vector",
+                exhaustive=_exhaustive,
+            )
+            _results = list(
+                self.search_client.search(
+                    search_text=None,
+                    vector_queries=[_vector_query],
+                    top=self.vector_depth,
+                    filter=filter,
+                    vector_filter_mode=_filter_mode,
+                    select=self.select,
+                )
+            )
+        if _plan is not None:
+            self.planner.record(_plan, time.perf_counter() - _started, query, filter)
+        return _results
+
+    def fuse(self, rankings: list):
+        """(score, chunk_id) fused ranking and its confidence in 0..1."""
+        _rankings = [_ranking for _ranking in rankings if _ranking is not None]
+        _weights = [_weight for _ranking, _weight in zip(rankings, self.weights) if _ranking is not None]
+        if self.fusion == "rrf":
+            _fused = reciprocal_rank_fusion(_rankings, k=self.rrf_k, weights=_weights)
+        else:
+            _fused = weighted_fusion(_rankings, _weights)
+        _confidence = 0.0
+        if len(_rankings) > 1 and _fused:
+            _agreed = set.intersection(*({_key for _, _key in _ranking[: self.top]} for _ranking in _rankings))
+            _head = [_key for _, _key in _fused[: self.top]]
+            _confidence = sum(_key in _agreed for _key in _head) / len(_head)
+        return _fused, _confidence
+
+    def rerank(self, query: str, keys: list, filter: str = None) -> list:
+        """Semantic reranker over ``keys``, returns chunk_ids by reranker score."""
+        _filter = f"search.in(chunk_id, '{','.join(keys)}', ',')"
+        if filter:
+            _filter = f"({filter}) and {_filter}"
+        with self.recorder.time("rerank"):
+            _results = self.search_client.search(
+                search_text=query,
+                query_type="semantic",
+                semantic_configuration_name=self.semantic_configuration_name,
+                filter=_filter,
+                top=len(keys),
+                select=["chunk_id"],
+            )
+            _scores = {_result["chunk_id"]: _result.get("@search.reranker_score") or 0.0 for _result in _results}
+        return sorted(keys, key=lambda _key: -_scores.get(_key, -1.0))
+
+    def retrieve(self, query: str, filter: str = None) -> RetrievalResult:
+        """Top ``top`` chunks for ``query``; ``@search.score`` holds the fused score."""
+        _started = time.perf_counter()
+        _keyword = self._executor.submit(self._keyword, query, filter) if self.keyword_depth else None
+        _vector = self._executor.submit(self._vector, query, filter) if self.vector_depth else None
+        _legs = [_keyword.result() if _keyword else None, _vector.result() if _vector else None]
+
+        with self.recorder.time("fuse"):
+            _documents = {}
+            _rankings = []
+            for _leg in _legs:
+                if _leg is None:
+                    _rankings.append(None)
+                    continue
+                _rankings.append([(_result["@search.score"], _result["chunk_id"]) for _result in _leg])
+                for _result in _leg:
+                    _documents.setdefault(_result["chunk_id"], _result)
+            _fused, _confidence = self.fuse(_rankings)
+        _scores = {_key: _score for _score, _key in _fused}
+        _keys = [_key for _, _key in _fused]
+
+        _reranked = False
+        if self.semantic_configuration_name and _keys and _confidence < self.rerank_threshold:
+            _head = self.rerank(query, _keys[: self.rerank_depth], filter)
+            _keys = _head + _keys[len(_head) :]
+            _reranked = True
+
+        _results = []
+        for _key in _keys[: self.top]:
+            _result = {
+                _name: _value for _name, _value in _documents[_key].items() if not _name.startswith("@search.")
+            }
+            _result["@search.score"] = _scores[_key]
+            _results.append(_result)
+        self.recorder.record("total", time.perf_counter() - _started)
+        return RetrievalResult(_results, _confidence, _reranked)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def funnel_report(retriever: HybridRetriever, queries: list, reference: dict, filter: str = None) -> dict:
+    """Recall@top against ``reference`` ({query: [chunk_id]}), rerank rate and latency of one funnel."""
+    retriever.recorder.reset()
+    _recall = []
+    _reranked = 0
+    for _query in queries:
+        _result = retriever.retrieve(_query, filter)
+        _expected = set(reference[_query])
+        _found = {_document["chunk_id"] for _document in _result.documents}
+        _recall.append(len(_found & _expected) / (len(_expected) or 1))
+        _reranked += _result.reranked
+    return {
+        "keyword_depth": retriever.keyword_depth,
+        "vector_depth": retriever.vector_depth,
+        "rerank_depth": retriever.rerank_depth,
+        f"recall@{retriever.top}": round(sum(_recall) / (len(_recall) or 1), 4),
+        "rerank_rate": round(_reranked / (len(queries) or 1), 4),
+        "latency": retriever.recorder.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-endpoint", type=str, help="Azure AI Search endpoint", required=True)
+    parser.add_argument("--index-name", type=str, help="Azure AI Search index name", required=True)
+    parser.add_argument("--azure-openai-endpoint", type=str, help="Azure OpenAI endpoint", required=True)
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI model dimensions",
+        default=None,
+    )
+    parser.add_argument("--semantic-configuration-name", type=str, help="Semantic configuration", default=None)
+    parser.add_argument("--query", nargs="+", help="Queries to run", default=None)
+    parser.add_argument(
+        "--queries-file",
+        type=str,
+        help="Queries, one per line or JSON lines with a query field",
+        default=None,
+    )
+    parser.add_argument("--source-dir", type=str, help="Documents to sample synthetic queries from", default=None)
+    parser.add_argument("--synthetic-queries", type=int, help="Number of synthetic queries", default=50)
+    parser.add_argument("--top", type=int, help="Results per query", default=5)
+    parser.add_argument(
+        "--keyword-depths",
+        nargs="+",
+        type=int,
+        help="Keyword candidate depths to compare",
+        default=[50],
+    )
+    parser.add_argument(
+        "--vector-depths",
+        nargs="+",
+        type=int,
+        help="Vector candidate depths to compare",
+        default=[50],
+    )
+    parser.add_argument("--rerank-depth", type=int, help="Fused candidates sent to the reranker", default=20)
+    parser.add_argument(
+        "--rerank-threshold",
+        type=float,
+        help="Rerank only when the fused confidence is below this (0 never, above 1 always)",
+        default=0.5,
+    )
+    parser.add_argument("--fusion", choices=FUSION_METHODS, help="Fusion method", default="rrf")
+    parser.add_argument("--keyword-weight", type=float, help="Fusion weight of the keyword leg", default=1.0)
+    parser.add_argument("--vector-weight", type=float, help="Fusion weight of the vector leg", default=1.0)
+    parser.add_argument(
+        "--reference-depth",
+        type=int,
+        help="Candidate depth of the exhaustive, always reranked reference funnel",
+        default=200,
+    )
+    add_filter_arguments(parser)
+    parser.add_argument("--output", type=str, help="Write the report as JSON to this file", default=None)
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+    try:
+        _filter = filter_from_args(_args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+
+    from async_embedder import EmbeddingEngine
+    from benchmark import file_queries, synthetic_queries
+    from query_cache import QueryEmbeddingCache
+
+    _queries = list(_args.query or [])
+    if _args.queries_file:
+        _queries += file_queries(_args.queries_file)
+    if _args.source_dir:
+        _queries += synthetic_queries(_args.source_dir, _args.synthetic_queries)
+    if not _queries:
+        parser.error("Pass --query, --queries-file or --source-dir")
+
+    _engine = EmbeddingEngine(
+        endpoint=_args.azure_openai_endpoint,
+        deployment=_args.azure_openai_embedding_deployment,
+        dimensions=_args.azure_openai_model_dimensions,
+    )
+    # Embeddings are computed once, so funnels are compared on search cost alone
+    _cache = QueryEmbeddingCache(_args.azure_openai_embedding_deployment, _args.azure_openai_model_dimensions)
+    _embed = lambda _text: _cache.get_or_embed(_text, _engine.embed_query)
+    for _query in _queries:
+        _embed(_query)
+
+    _search_client = get_factory(_args.search_endpoint).search_client(_args.index_name)
+    _planner = None
+    if _filter and _args.vector_filter_mode == "auto":
+        from query_planner import QueryPlanner
+
+        # Chooses pre- or post-filtering from the filter's selectivity
+        _planner = QueryPlanner(_search_client)
+    _common = dict(
+        embed=_embed,
+        filter_mode=_args.vector_filter_mode,
+        planner=_planner,
+        top=_args.top,
+        fusion=_args.fusion,
+        weights=(_args.keyword_weight, _args.vector_weight),
+        semantic_configuration_name=_args.semantic_configuration_name,
+    )
+    _reference_retriever = HybridRetriever(
+        _search_client,
+        keyword_depth=_args.reference_depth,
+        vector_depth=_args.reference_depth,
+        rerank_depth=50,
+        rerank_threshold=float("inf"),
+        exhaustive=True,
+        **_common,
+    )
+    _reference = {
+        _query: [_document["chunk_id"] for _document in _reference_retriever.retrieve(_query, _filter).documents]
+        for _query in _queries
+    }
+    _report = {
+        "queries": len(_queries),
+        "filter": _filter,
+        "reference": funnel_report(_reference_retriever, _queries, _reference, _filter),
+    }
+    _reference_retriever.close()
+
+    _report["funnels"] = []
+    for _keyword_depth in _args.keyword_depths:
+        for _vector_depth in _args.vector_depths:
+            _retriever = HybridRetriever(
+                _search_client,
+                keyword_depth=_keyword_depth,
+                vector_depth=_vector_depth,
+                rerank_depth=_args.rerank_depth,
+                rerank_threshold=_args.rerank_threshold,
+                **_common,
+            )
+            _funnel = funnel_report(_retriever, _queries, _reference, _filter)
+            _retriever.close()
+            _report["funnels"].append(_funnel)
+            logging.info(
+                "keyword %s vector %s: recall@%s %.3f, rerank rate %.2f, p50 %.1f ms",
+                _keyword_depth,
+                _vector_depth,
+                _args.top,
+                _funnel[f"recall@{_args.top}"],
+                _funnel["rerank_rate"],
+                _funnel["latency"]["total"]["p50_ms"],
+            )
+    _engine.close()
+
+    print(json.dumps(_report, indent=2))
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_report, _file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
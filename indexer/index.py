@@ -1,13 +1,12 @@
 import logging
 import argparse
-import os
 
-from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
     SearchField,
     SearchFieldDataType,
     VectorSearch,
     HnswAlgorithmConfiguration,
+    HnswParameters,
     VectorSearchProfile,
     AzureOpenAIVectorizer,
     AzureOpenAIVectorizerParameters,
@@ -16,10 +15,24 @@ from azure.search.documents.indexes.models import (
     SemanticPrioritizedFields,
     SemanticField,
     SearchIndex,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
+    BinaryQuantizationCompression,
+    RescoringOptions,
 )
 
-from azure.identity import AzureCliCredential
-from azure.core.credentials import AzureKeyCredential
+
+from clients import get_factory
+
+VECTOR_COMPRESSIONS = ("none", "scalar", "binary")
+# Narrow vector types; integer types need pre-quantized embeddings and are not offered
+VECTOR_TYPES = {"float32": "Edm.Single", "float16": "Edm.Half"}
+RESCORE_STORAGE_METHODS = ("preserveOriginals", "discardOriginals")
+# hamming only applies to packed binary (Edm.Byte) vectors, which are not offered
+HNSW_METRICS = ("cosine", "euclidean", "dotProduct")
+# Service limits of the HNSW parameters, inclusive
+HNSW_M_RANGE = (4, 10)
+HNSW_EF_RANGE = (100, 1000)
 
 
 class AISearchIndex:
@@ -27,10 +40,40 @@ class AISearchIndex:
     def __init__(self, args):
         self.args = args
 
-    def create_index(self):
+    def vector_compression(self):
+        """Compression configuration for the vector profile, ``None`` when uncompressed.
+
+        Scalar quantization stores int8 codes, binary quantization one bit per
+        dimension. Candidates are oversampled on the compressed vectors and, with
+        rescoring enabled, rescored against the full-precision originals.
+        """
+        _args = self.args
+        if _args.vector_compression == "none":
+            return None
+        _rescoring_options = RescoringOptions(
+            enable_rescoring=not _args.disable_rescoring,
+            default_oversampling=_args.oversampling,
+            rescore_storage_method=_args.rescore_storage_method,
+        )
+        _name = f"{_args.index_name}{_args.vector_compression.capitalize()}Quantization"
+        if _args.vector_compression == "scalar":
+            return ScalarQuantizationCompression(
+                compression_name=_name,
+                parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+                # Superseded by rescoring_options, the service rejects both
+                rerank_with_original_vectors=None,
+                rescoring_options=_rescoring_options,
+                truncation_dimension=_args.truncation_dimension,
+            )
+        return BinaryQuantizationCompression(
+            compression_name=_name,
+            rerank_with_original_vectors=None,
+            rescoring_options=_rescoring_options,
+            truncation_dimension=_args.truncation_dimension,
+        )
+
+    def index_definition(self) -> SearchIndex:
         _args = self.args
-        _credential = AzureCliCredential()
-        _search_endpoint = _args.search_endpoint
         _index_name = _args.index_name
         _add_page_numbers = _args.add_page_numbers
         _use_document_layout = _args.use_document_layout
@@ -41,12 +84,8 @@ class AISearchIndex:
         )
         _azure_openai_model_name = _args.azure_openai_model_name
         _azure_openai_model_dimensions = _args.azure_openai_model_dimensions
+        _compression = self.vector_compression()
 
-        # Create a search index
-        _index_client = SearchIndexClient(
-            endpoint=_search_endpoint,
-            credential=_credential,
-        )
         _fields = [
             SearchField(
                 name="parent_id",
@@ -94,10 +133,11 @@ class AISearchIndex:
             ),
             SearchField(
                 name="vector",
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                type=SearchFieldDataType.Collection(VECTOR_TYPES[_args.vector_type]),
                 vector_search_dimensions=_azure_openai_model_dimensions,
                 vector_search_profile_name=f"{_index_name}HnswProfile",
-                hidden=False,
+                hidden=_args.discard_stored_vectors,
+                stored=not _args.discard_stored_vectors,
             ),
         ]
 
@@ -113,23 +153,33 @@ class AISearchIndex:
             )
         if _use_document_layout:
             _fields.extend([
-                SearchField(name="header_1", type=SearchFieldDataType.String, sortable=False, filterable=False, facetable=False),
-                SearchField(name="header_2", type=SearchFieldDataType.String, sortable=False, filterable=False, facetable=False),
-                SearchField(name="header_3", type=SearchFieldDataType.String, sortable=False, filterable=False, facetable=False)
+                SearchField(name="header_1", type=SearchFieldDataType.String, sortable=False, filterable=True, facetable=True),
+                SearchField(name="header_2", type=SearchFieldDataType.String, sortable=False, filterable=True, facetable=True),
+                SearchField(name="header_3", type=SearchFieldDataType.String, sortable=False, filterable=True, facetable=True)
             ])
 
         # Configure the vector search configuration
         _vector_search = VectorSearch(
             algorithms=[
-                HnswAlgorithmConfiguration(name=f"{_index_name}Hnsw"),
+                HnswAlgorithmConfiguration(
+                    name=f"{_index_name}Hnsw",
+                    parameters=HnswParameters(
+                        m=_args.hnsw_m,
+                        ef_construction=_args.hnsw_ef_construction,
+                        ef_search=_args.hnsw_ef_search,
+                        metric=_args.hnsw_metric,
+                    ),
+                ),
             ],
             profiles=[
                 VectorSearchProfile(
                     name=f"{_index_name}HnswProfile",
                     algorithm_configuration_name=f"{_index_name}Hnsw",
                     vectorizer_name=f"{_index_name}OpenAI",
+                    compression_name=_compression.compression_name if _compression else None,
                 )
             ],
+            compressions=[_compression] if _compression else None,
             vectorizers=[
                 AzureOpenAIVectorizer(
                     vectorizer_name=f"{_index_name}OpenAI",
@@ -143,8 +193,11 @@ class AISearchIndex:
             ],
         )
 
+        # Versions built by rebuild_index.py keep the base index name, so
+        # "<index-name>-semantic-config" stays valid through every swap
+        _semantic_name = getattr(_args, "semantic_index_name", None) or _index_name
         _semantic_config = SemanticConfiguration(
-            name=f"{_index_name}-semantic-config",
+            name=f"{_semantic_name}-semantic-config",
             prioritized_fields=SemanticPrioritizedFields(
                 content_fields=[SemanticField(field_name="chunk")]
             ),
@@ -153,19 +206,25 @@ class AISearchIndex:
         # Create the semantic search with the configuration
         _semantic_search = SemanticSearch(configurations=[_semantic_config])
 
-        # Create the search index
-        _index = SearchIndex(
+        return SearchIndex(
             name=_index_name,
             fields=_fields,
             vector_search=_vector_search,
             semantic_search=_semantic_search,
         )
+
+    def create_index(self):
+        _index = self.index_definition()
+
+        # Create the search index
+        _factory = get_factory(self.args.search_endpoint)
+        _index_client = _factory.index_client(credential="cli")
         try:
             _result = _index_client.create_index(_index)
             logging.info("Index %s created", _result.name)
         except Exception as e:
             logging.info(f"Unable to created or update index using managed identity, trying with search key")
-            _index_client = SearchIndexClient(endpoint=_search_endpoint,credential= AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY")))
+            _index_client = _factory.index_client(credential="key")
             _result = _index_client.create_or_update_index(_index)
             logging.info("Index %s created", _result.name)
 
@@ -231,7 +290,97 @@ def main():
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "--vector-type",
+        choices=list(VECTOR_TYPES),
+        help="Storage type of the vector field",
+        required=False,
+        default="float32",
+    )
+    parser.add_argument(
+        "--vector-compression",
+        choices=VECTOR_COMPRESSIONS,
+        help="Quantize vectors with int8 (scalar) or 1-bit (binary) compression",
+        required=False,
+        default="none",
+    )
+    parser.add_argument(
+        "--truncation-dimension",
+        type=int,
+        help="Truncate compressed vectors to this many dimensions (text-embedding-3 models)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--oversampling",
+        type=float,
+        help="Default oversampling factor of compressed vector queries",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--disable-rescoring",
+        action="store_true",
+        help="Do not rescore compressed results with the original vectors",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--rescore-storage-method",
+        choices=RESCORE_STORAGE_METHODS,
+        help="Keep or discard the full-precision originals of compressed vectors",
+        required=False,
+        default="preserveOriginals",
+    )
+    parser.add_argument(
+        "--discard-stored-vectors",
+        action="store_true",
+        help="Do not keep a retrievable copy of the vectors",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        help="HNSW bi-directional links per node, more improves recall at the cost of memory",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--hnsw-ef-construction",
+        type=int,
+        help="HNSW candidate list size while indexing, more improves the graph at the cost of build time",
+        required=False,
+        default=400,
+    )
+    parser.add_argument(
+        "--hnsw-ef-search",
+        type=int,
+        help="HNSW candidate list size while querying, more improves recall at the cost of latency",
+        required=False,
+        default=500,
+    )
+    parser.add_argument(
+        "--hnsw-metric",
+        choices=HNSW_METRICS,
+        help="Vector similarity metric, use the one the embedding model was trained with",
+        required=False,
+        default="cosine",
+    )
     _args = parser.parse_args()
+    if not HNSW_M_RANGE[0] <= _args.hnsw_m <= HNSW_M_RANGE[1]:
+        parser.error(f"--hnsw-m must be between {HNSW_M_RANGE[0]} and {HNSW_M_RANGE[1]}")
+    for _name in ("hnsw_ef_construction", "hnsw_ef_search"):
+        if not HNSW_EF_RANGE[0] <= getattr(_args, _name) <= HNSW_EF_RANGE[1]:
+            parser.error(f"--{_name.replace('_', '-')} must be between {HNSW_EF_RANGE[0]} and {HNSW_EF_RANGE[1]}")
+    if _args.vector_compression == "none" and (
+        _args.truncation_dimension or _args.oversampling or _args.disable_rescoring
+    ):
+        parser.error("--truncation-dimension, --oversampling and --disable-rescoring need --vector-compression")
+    if _args.truncation_dimension and not 0 < _args.truncation_dimension < _args.azure_openai_model_dimensions:
+        parser.error("--truncation-dimension must be below --azure-openai-model-dimensions")
+    if _args.rescore_storage_method == "discardOriginals" and not _args.disable_rescoring and _args.vector_compression == "scalar":
+        parser.error("discardOriginals rescoring is only supported with binary compression")
 
     if _args.verbose:
         logging.basicConfig(level=logging.DEBUG)
@@ -251,6 +400,16 @@ def main():
     )
     logging.debug("Add page numbers %s", _args.add_page_numbers)
     logging.debug("Use document layout %s", _args.use_document_layout)
+    logging.debug("Vector type %s", _args.vector_type)
+    logging.debug("Vector compression %s", _args.vector_compression)
+    logging.debug("Truncation dimension %s", _args.truncation_dimension)
+    logging.debug(
+        "HNSW m %s, efConstruction %s, efSearch %s, metric %s",
+        _args.hnsw_m,
+        _args.hnsw_ef_construction,
+        _args.hnsw_ef_search,
+        _args.hnsw_metric,
+    )
 
     _ai_search_index = AISearchIndex(_args)
     _ai_search_index.create_index()
@@ -1,19 +1,19 @@
 import logging
 import argparse
-import os
+import sys
 
 
+from azure.core.exceptions import ResourceNotFoundError
 from azure.search.documents.indexes.models import (
     SearchIndexer,
     IndexingParameters,
     IndexingParametersConfiguration,
     BlobIndexerImageAction,
+    SearchIndexerCache,
+    IndexingSchedule,
 )
 
-from azure.identity import AzureCliCredential
-
-from azure.search.documents.indexes import SearchIndexerClient
-from azure.core.credentials import AzureKeyCredential
+from clients import get_factory
 
 
 class AISearchIndexer:
@@ -21,10 +21,8 @@ class AISearchIndexer:
     def __init__(self, args):
         self.args = args
 
-    def create_indexer(self):
+    def indexer_definition(self) -> SearchIndexer:
         _args = self.args
-        # _credential = AzureCliCredential()
-        _search_endpoint = _args.search_endpoint
         _index_name = _args.index_name
         _use_ocr = _args.use_ocr
         _use_document_layout = _args.use_document_layout
@@ -45,27 +43,71 @@ class AISearchIndexer:
                     allow_skillset_to_read_file_data=True,
                     query_timeout=None))
         
-
-        _indexer = SearchIndexer(
+        # Enrichment cache lets the service reuse skill outputs (including
+        # embeddings) for unchanged documents instead of re-running the skillset
+        _indexer_cache = None
+        if _args.cache_storage_connection_string:
+            _indexer_cache = SearchIndexerCache(
+                storage_connection_string=_args.cache_storage_connection_string,
+                enable_reprocessing=True,
+            )
+
+        return SearchIndexer(
             name=_indexer_name,
             description="Indexer to index documents and generate embeddings",
             skillset_name=_skillset_name,
             target_index_name=_index_name,
             data_source_name=_data_source_name,
             parameters=_indexer_parameters,
-            schedule={
-                "interval": _args.interval,
-                "startTime": _args.start_time,
-            },
+            cache=_indexer_cache,
+            schedule=IndexingSchedule(
+                interval=_args.interval,
+                start_time=_args.start_time,
+            ),
         )
 
-        _indexer_client = SearchIndexerClient(endpoint=_search_endpoint,credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY")))
+    def create_indexer(self):
+        _args = self.args
+        # _credential = AzureCliCredential()
+        _search_endpoint = _args.search_endpoint
+        _indexer = self.indexer_definition()
+        _indexer_name = _indexer.name
+
+        _indexer_client = get_factory(_search_endpoint).indexer_client()
+        _monitor = None
+        if _args.monitor:
+            from indexer_monitor import IndexerMonitor
+
+            _monitor = IndexerMonitor(
+                _indexer_client,
+                _indexer_name,
+                poll_interval=_args.poll_interval,
+                max_poll_interval=_args.max_poll_interval,
+                timeout=_args.monitor_timeout,
+                max_failed_items=_args.max_failed_items,
+                metrics_file=_args.metrics_file,
+            )
+        try:
+            _indexer_client.get_indexer(_indexer_name)
+            _created = False
+        except ResourceNotFoundError:
+            _created = True
+        # Only an existing indexer has a run to tell apart from the one started here
+        _previous_run = _monitor.run_id(_monitor.status()) if _monitor is not None and not _created else None
         _indexer_result = _indexer_client.create_or_update_indexer(_indexer)
-        _indexer_client.run_indexer(_indexer_name)
-        logging.info(
-            " %s is created and running. If queries return no results, please wait a bit and try again.",
-            _indexer_result.name,
-        )
+        if _created:
+            # The service starts a new indexer on creation, a second run would conflict with it
+            logging.info("%s started on creation", _indexer_name)
+        else:
+            _indexer_client.run_indexer(_indexer_name)
+        if _monitor is None:
+            logging.info(
+                " %s is created and running. If queries return no results, please wait a bit and try again.",
+                _indexer_result.name,
+            )
+            return 0
+        logging.info("%s is created and running, waiting for the run to finish", _indexer_result.name)
+        return _monitor.wait(_previous_run)
 
 
 def main():
@@ -108,6 +150,55 @@ def main():
         required=False,
         default="2024-10-01T00:00:00Z",
     )
+    parser.add_argument(
+        "--cache-storage-connection-string",
+        type=str,
+        help="Storage connection string for the indexer enrichment cache",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--monitor",
+        action="store_true",
+        help="Wait for the run, logging progress, and exit non-zero when it fails",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="Seconds between status polls while the run progresses",
+        required=False,
+        default=5.0,
+    )
+    parser.add_argument(
+        "--max-poll-interval",
+        type=float,
+        help="Longest backed-off wait between status polls",
+        required=False,
+        default=60.0,
+    )
+    parser.add_argument(
+        "--monitor-timeout",
+        type=float,
+        help="Seconds to wait for the run to finish, 0 for no limit",
+        required=False,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-failed-items",
+        type=int,
+        help="Failed items tolerated before the run counts as failed",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Append the monitor events to this JSON lines file",
+        required=False,
+        default=None,
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -127,9 +218,12 @@ def main():
     logging.debug("Use OCR : %s", args.use_ocr)
     logging.debug("Use document layout : %s", args.use_document_layout)
     logging.debug("Interval :%s", args.interval)
+    logging.debug("Enrichment cache : %s", bool(args.cache_storage_connection_string))
+
+    logging.debug("Monitor : %s", args.monitor)
 
     _ai_search_indexer = AISearchIndexer(args)
-    _ai_search_indexer.create_indexer()
+    sys.exit(_ai_search_indexer.create_indexer())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,346 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError, ServiceRequestError
+
+
+_logger = logging.getLogger(__name__)
+
+# Exit codes of the monitor, shared with indexer.py --monitor
+EXIT_SUCCESS = 0
+EXIT_FAILED = 1
+EXIT_TIMEOUT = 2
+
+# Execution statuses that end a run
+FINISHED_STATUSES = ("success", "transientFailure", "reset")
+
+
+def _timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class RecordedIndexerClient:
+    """Replays recorded ``search.status`` responses in place of a ``SearchIndexerClient``.
+
+    Recordings map indexer names to lists of REST status bodies. The first
+    body is served until :meth:`run_indexer` is called, then every poll steps
+    to the next one and the last one repeats. A ``{"error": 503}`` entry fails
+    that poll with the given status code.
+
+    Args:
+        recordings (dict): ``{indexer name: [status body, ...]}``
+    """
+
+    def __init__(self, recordings: dict):
+        self.recordings = recordings
+        self._positions = {}
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, "r", encoding="utf-8") as _file:
+            return cls(json.load(_file))
+
+    def _recording(self, name: str) -> list:
+        if not self.recordings.get(name):
+            raise ResourceNotFoundError(f"No recorded status for indexer {name}")
+        return self.recordings[name]
+
+    def run_indexer(self, name: str, **kwargs):
+        self._recording(name)
+        self._positions[name] = 1
+
+    def get_indexer_status(self, name: str, **kwargs):
+        from azure.search.documents.indexes.models import SearchIndexerStatus
+
+        _recording = self._recording(name)
+        _position = self._positions.get(name, 0)
+        if _position:
+            self._positions[name] = min(_position + 1, len(_recording) - 1)
+        _body = _recording[min(_position, len(_recording) - 1)]
+        if "error" in _body:
+            _error = HttpResponseError(message=f"Recorded {_body['error']} response")
+            _error.status_code = _body["error"]
+            raise _error
+        return SearchIndexerStatus.deserialize(_body)
+
+
+class IndexerMonitor:
+    """Follows an indexer run through ``get_indexer_status`` until it finishes.
+
+    The status is polled every ``poll_interval`` seconds, backing off by
+    ``backoff`` up to ``max_poll_interval`` while the item counts stand
+    still and starting over once they move. Failed polls are retried the
+    same way. Every change is emitted as a JSON event to the log and, when
+    set, appended to ``metrics_file``: ``progress`` when the counts move,
+    ``warning`` and ``error`` once per item-level issue, ``run`` with the
+    duration and throughput when the run ends.
+
+    Args:
+        indexer_client (SearchIndexerClient): client of the search service
+        indexer_name (str): indexer to follow
+        poll_interval (float): seconds between polls while the run progresses
+        max_poll_interval (float): ceiling of the backed-off interval
+        backoff (float): interval multiplier while nothing changes
+        timeout (float): seconds to wait for the run to finish, 0 for no limit
+        max_failed_items (int): failed items tolerated before the run counts as failed
+        metrics_file (str): JSON lines file receiving every event
+    """
+
+    def __init__(
+        self,
+        indexer_client,
+        indexer_name: str,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 60.0,
+        backoff: float = 1.5,
+        timeout: float = 0.0,
+        max_failed_items: int = 0,
+        metrics_file: str = None,
+    ):
+        self.indexer_client = indexer_client
+        self.indexer_name = indexer_name
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_failed_items = max_failed_items
+        self.metrics_file = metrics_file
+        self.polls = 0
+        self.poll_errors = 0
+
+    def emit(self, event: str, **fields):
+        _event = {"event": event, "indexer": self.indexer_name, "time": time.time(), **fields}
+        _logger.info(json.dumps(_event, default=str))
+        if self.metrics_file:
+            with open(self.metrics_file, "a", encoding="utf-8") as _file:
+                _file.write(json.dumps(_event, default=str) + "\n")
+        return _event
+
+    def status(self):
+        self.polls += 1
+        return self.indexer_client.get_indexer_status(self.indexer_name)
+
+    def run_id(self, status):
+        """Start time of the latest run, ``None`` before the first one."""
+        _last_result = status.last_result
+        return _timestamp(_last_result.start_time) if _last_result is not None else None
+
+    def summarize(self, status) -> dict:
+        """Counts, duration, throughput and item-level issues of the latest run."""
+        _result = status.last_result
+        _started = _timestamp(_result.start_time)
+        _ended = _timestamp(_result.end_time)
+        _seconds = None
+        if _started is not None:
+            _seconds = ((_ended or datetime.now(timezone.utc)) - _started).total_seconds()
+        _items = _result.item_count or 0
+        _failed = _result.failed_item_count or 0
+        return {
+            "indexer_status": status.status,
+            "status": _result.status,
+            "error_message": _result.error_message,
+            "start_time": _started.isoformat() if _started else None,
+            "end_time": _ended.isoformat() if _ended else None,
+            "duration_seconds": round(_seconds, 3) if _seconds is not None else None,
+            "items_processed": _items,
+            "items_failed": _failed,
+            "docs_per_second": round((_items - _failed) / _seconds, 2) if _seconds else None,
+            "warnings": len(_result.warnings or []),
+            "errors": len(_result.errors or []),
+        }
+
+    def failed(self, summary: dict) -> bool:
+        return (
+            summary["status"] != "success"
+            or summary["indexer_status"] == "error"
+            or summary["items_failed"] > self.max_failed_items
+        )
+
+    def wait(self, previous_run=None) -> int:
+        """Poll until a run other than ``previous_run`` finishes, returns the exit code.
+
+        Args:
+            previous_run: :meth:`run_id` of the status read before starting the
+                run, so a stale result of the run before is not reported
+        """
+        _deadline = time.monotonic() + self.timeout if self.timeout else None
+        _interval = self.poll_interval
+        _seen_issues = set()
+        _progress = None
+        _last_poll = None
+        while True:
+            try:
+                _status = self.status()
+            except ResourceNotFoundError:
+                raise
+            except (HttpResponseError, ServiceRequestError) as e:
+                # Retry throttling, server errors and connection failures, not bad requests
+                _status_code = getattr(e, "status_code", None)
+                if _status_code is not None and _status_code < 500 and _status_code != 429:
+                    raise
+                self.poll_errors += 1
+                _logger.warning("Status poll of %s failed, retrying in %.1fs: %s", self.indexer_name, _interval, e)
+                _status = None
+            _now = time.monotonic()
+            if _status is not None and _status.last_result is not None and self.run_id(_status) != previous_run:
+                _result = _status.last_result
+                for _warning in _result.warnings or []:
+                    _issue = ("warning", _warning.key, _warning.message)
+                    if _issue not in _seen_issues:
+                        _seen_issues.add(_issue)
+                        self.emit(
+                            "warning",
+                            key=_warning.key,
+                            name=_warning.name,
+                            message=_warning.message,
+                            details=_warning.details,
+                        )
+                for _error in _result.errors or []:
+                    _issue = ("error", _error.key, _error.error_message)
+                    if _issue not in _seen_issues:
+                        _seen_issues.add(_issue)
+                        self.emit(
+                            "error",
+                            key=_error.key,
+                            name=_error.name,
+                            message=_error.error_message,
+                            status_code=_error.status_code,
+                            details=_error.details,
+                        )
+                _counts = (_result.item_count or 0, _result.failed_item_count or 0)
+                if _result.status in FINISHED_STATUSES:
+                    _summary = self.summarize(_status)
+                    _summary["polls"] = self.polls
+                    _summary["poll_errors"] = self.poll_errors
+                    self.emit("run", **_summary)
+                    return EXIT_FAILED if self.failed(_summary) else EXIT_SUCCESS
+                if _counts != _progress:
+                    _rate = None
+                    if _progress is not None and _now > _last_poll:
+                        _rate = round((_counts[0] - _progress[0]) / (_now - _last_poll), 2)
+                    self.emit(
+                        "progress",
+                        status=_result.status,
+                        items_processed=_counts[0],
+                        items_failed=_counts[1],
+                        docs_per_second=_rate,
+                    )
+                    _progress = _counts
+                    _last_poll = _now
+                    _interval = self.poll_interval
+                else:
+                    _interval = min(_interval * self.backoff, self.max_poll_interval)
+            else:
+                _interval = min(_interval * self.backoff, self.max_poll_interval)
+            if _deadline is not None and _now + _interval > _deadline:
+                self.emit("timeout", seconds=self.timeout, polls=self.polls, last_progress=_progress)
+                return EXIT_TIMEOUT
+            time.sleep(_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--recorded-responses",
+        type=str,
+        help="Replay recorded status responses from this JSON file instead of calling the service",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Index name, the indexer is <index-name>-indexer",
+        required=True,
+    )
+    parser.add_argument(
+        "--run",
+        action="store_true",
+        help="Start a run and follow it, otherwise the latest run is reported",
+        default=False,
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        help="Seconds between status polls while the run progresses",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--max-poll-interval",
+        type=float,
+        help="Longest backed-off wait between polls",
+        default=60.0,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Seconds to wait for the run to finish, 0 for no limit",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-failed-items",
+        type=int,
+        help="Failed items tolerated before the run counts as failed",
+        default=0,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Append every monitor event to this JSON lines file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("azure").setLevel(logging.WARNING)
+    if not _args.search_endpoint and not _args.recorded_responses:
+        parser.error("either --search-endpoint or --recorded-responses is required")
+
+    if _args.recorded_responses:
+        _indexer_client = RecordedIndexerClient.from_file(_args.recorded_responses)
+    else:
+        from clients import get_factory
+
+        _indexer_client = get_factory(_args.search_endpoint).indexer_client()
+    _indexer_name = f"{_args.index_name}-indexer"
+    _monitor = IndexerMonitor(
+        _indexer_client,
+        _indexer_name,
+        poll_interval=_args.poll_interval,
+        max_poll_interval=_args.max_poll_interval,
+        timeout=_args.timeout,
+        max_failed_items=_args.max_failed_items,
+        metrics_file=_args.metrics_file,
+    )
+    _previous_run = None
+    if _args.run:
+        _previous_run = _monitor.run_id(_monitor.status())
+        _monitor.indexer_client.run_indexer(_indexer_name)
+        logging.info("Started %s", _indexer_name)
+    sys.exit(_monitor.wait(_previous_run))
+
+
+if __name__ == "__main__":
+    main()
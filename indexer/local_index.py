@@ -0,0 +1,581 @@
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from hnsw import HnswGraph
+from odata import filter_fields, parse_filter
+
+
+_logger = logging.getLogger(__name__)
+
+# Fields declared filterable by AISearchIndex.create_index
+FILTERABLE_FIELDS = (
+    "parent_id",
+    "title",
+    "blob_path",
+    "source_address",
+    "chunk_id",
+    "page_number",
+    "header_1",
+    "header_2",
+    "header_3",
+)
+VECTOR_DTYPES = ("float32", "float16")
+ALGORITHMS = ("exhaustive", "hnsw")
+
+# BM25 parameters used by Azure AI Search
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant used for hybrid queries
+RRF_K = 60
+
+_TERM_PATTERN = re.compile(r"\w+")
+
+IndexingResult = namedtuple("IndexingResult", ["key", "succeeded", "error_message", "status_code"])
+
+
+def terms(text: str) -> list:
+    return _TERM_PATTERN.findall((text or "").lower())
+
+
+def cosine_score(similarity: float) -> float:
+    """Azure AI Search ``@search.score`` of a cosine similarity: 1 / (1 + cosine distance)."""
+    return 1.0 / (2.0 - similarity)
+
+
+class KeywordIndex:
+    """In-memory BM25 inverted index over ``title`` and ``chunk``."""
+
+    def __init__(self, documents):
+        self.postings = {}
+        self.lengths = {}
+        for _key, _document in documents:
+            _terms = terms(f"{_document.get('title') or ''} {_document.get('chunk') or ''}")
+            self.lengths[_key] = len(_terms)
+            for _term, _count in Counter(_terms).items():
+                self.postings.setdefault(_term, []).append((_key, _count))
+        self.average_length = (sum(self.lengths.values()) / len(self.lengths)) if self.lengths else 1.0
+
+    def rank(self, text: str, allowed=None):
+        """(score, key) pairs matching any term of ``text``, best first."""
+        _count = len(self.lengths)
+        _scores = {}
+        for _term in set(terms(text)):
+            _matches = self.postings.get(_term, ())
+            if not _matches:
+                continue
+            _idf = math.log(1 + (_count - len(_matches) + 0.5) / (len(_matches) + 0.5))
+            for _key, _frequency in _matches:
+                if allowed is not None and _key not in allowed:
+                    continue
+                _scores[_key] = _scores.get(_key, 0.0) + _idf * _frequency * (BM25_K1 + 1) / (
+                    _frequency + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[_key] / (self.average_length or 1.0))
+                )
+        return sorted(((_score, _key) for _key, _score in _scores.items()), reverse=True)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K, weights: list = None):
+    """Fuse several (score, key) rankings into one, best first.
+
+    Args:
+        rankings (list): (score, key) rankings, best first
+        k (int): rank offset, larger values flatten the contribution of top ranks
+        weights (list): optional per-ranking weights, 1 each by default
+    """
+    _fused = {}
+    for _ranking, _weight in zip(rankings, weights or [1.0] * len(rankings)):
+        for _rank, (_score, _key) in enumerate(_ranking, start=1):
+            _fused[_key] = _fused.get(_key, 0.0) + _weight / (k + _rank)
+    return sorted(((_score, _key) for _key, _score in _fused.items()), reverse=True)
+
+
+def facet_counts(documents: list, facets: list) -> dict:
+    """``@search.facets`` of value facets like ``title,count:10``, most frequent first."""
+    _response = {}
+    for _facet in facets:
+        _field, *_options = [_part.strip() for _part in _facet.split(",")]
+        _limit = 10
+        for _option in _options:
+            _name, _, _value = _option.partition(":")
+            if _name == "count":
+                _limit = int(_value)
+        _counts = Counter(_document.get(_field) for _document in documents if _document.get(_field) is not None)
+        _response[_field] = [
+            {"value": _value, "count": _count} for _value, _count in _counts.most_common(_limit)
+        ]
+    return _response
+
+
+class LocalIndex:
+    """On-disk vector index with the chunk schema of :class:`index.AISearchIndex`.
+
+    Vectors live in a memory-mapped ``float32`` or ``float16`` matrix, one row
+    per chunk. The other fields are in SQLite, keyed by ``chunk_id``.
+    Upserts rewrite a chunk's row in place, and deletes leave a free row that
+    the next insert reuses. Documents without the vector are kept in memory,
+    for filters and results.
+
+    Args:
+        path (str): index directory
+        dimensions (int): vector dimensions, required when creating the index
+        dtype (str): ``float32`` or ``float16`` vector storage
+        block_size (int): rows scored per matrix multiply in exact search
+    """
+
+    def __init__(self, path: str, dimensions: int = None, dtype: str = "float32", block_size: int = 65536):
+        self.path = path
+        self.block_size = block_size
+        self._lock = threading.RLock()
+        self._graph = None
+        self._graph_rows = []
+        self._row_nodes = {}
+        self._keyword_index = None
+        self._filter_rows = {}
+        self.version = 0
+        os.makedirs(path, exist_ok=True)
+        _meta_path = os.path.join(path, "index.json")
+        if os.path.exists(_meta_path):
+            with open(_meta_path, "r", encoding="utf-8") as _file:
+                _meta = json.load(_file)
+            self.dimensions = _meta["dimensions"]
+            self.dtype = _meta["dtype"]
+            self.capacity = _meta["capacity"]
+        else:
+            if not dimensions:
+                raise ValueError(f"{path} is not a local index, pass dimensions to create one")
+            if dtype not in VECTOR_DTYPES:
+                raise ValueError(f"Unknown vector dtype {dtype}, expected one of {VECTOR_DTYPES}")
+            self.dimensions = dimensions
+            self.dtype = dtype
+            self.capacity = 0
+        self._database = sqlite3.connect(os.path.join(path, "documents.db"), check_same_thread=False)
+        self._database.execute(
+            "CREATE TABLE IF NOT EXISTS documents (chunk_id TEXT PRIMARY KEY, row INTEGER UNIQUE, document TEXT)"
+        )
+        self.documents = {}
+        self.rows = {}
+        for _chunk_id, _row, _document in self._database.execute("SELECT chunk_id, row, document FROM documents"):
+            self.documents[_chunk_id] = json.loads(_document)
+            self.rows[_chunk_id] = _row
+        self.keys = {_row: _chunk_id for _chunk_id, _row in self.rows.items()}
+        self._free_rows = sorted(set(range(self.capacity)) - set(self.keys), reverse=True)
+        self.vectors = self._map(self.capacity)
+        self._write_meta()
+
+    def _map(self, capacity: int):
+        _vectors_path = os.path.join(self.path, "vectors.bin")
+        if not capacity:
+            return np.zeros((0, self.dimensions), dtype=self.dtype)
+        _bytes = capacity * self.dimensions * np.dtype(self.dtype).itemsize
+        with open(_vectors_path, "ab") as _file:
+            if _file.tell() < _bytes:
+                _file.truncate(_bytes)
+        return np.memmap(_vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dimensions))
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "index.json"), "w", encoding="utf-8") as _file:
+            json.dump({"dimensions": self.dimensions, "dtype": self.dtype, "capacity": self.capacity}, _file)
+
+    def _grow(self, needed: int):
+        _capacity = max(self.capacity * 2, self.capacity + needed, 1024)
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        self.vectors = self._map(_capacity)
+        self._free_rows = sorted(set(self._free_rows) | set(range(self.capacity, _capacity)), reverse=True)
+        self.capacity = _capacity
+        self._write_meta()
+
+    def _changed(self):
+        self.version += 1
+        self._keyword_index = None
+        self._filter_rows.clear()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def upsert(self, documents: list, merge: bool = False):
+        """Insert or replace documents (``merge`` keeps fields missing from the update)."""
+        _results = []
+        with self._lock:
+            _new = sum(1 for _document in documents if _document["chunk_id"] not in self.rows)
+            if _new > len(self._free_rows):
+                self._grow(_new - len(self._free_rows))
+            for _document in documents:
+                _document = dict(_document)
+                _key = _document["chunk_id"]
+                _vector = _document.pop("vector", None)
+                if merge and _key in self.documents:
+                    _document = {**self.documents[_key], **_document}
+                _row = self.rows.get(_key)
+                if _row is None:
+                    if _vector is None:
+                        _results.append(IndexingResult(_key, False, "Document has no vector", 400))
+                        continue
+                    _row = self._free_rows.pop()
+                    self.rows[_key] = _row
+                    self.keys[_row] = _key
+                if _vector is not None:
+                    _vector = np.asarray(_vector, dtype=np.float32)
+                    self.vectors[_row] = _vector / max(float(np.linalg.norm(_vector)), 1e-12)
+                    if self._graph is not None:
+                        self._graph_add(_row)
+                self.documents[_key] = _document
+                self._database.execute(
+                    "INSERT OR REPLACE INTO documents (chunk_id, row, document) VALUES (?, ?, ?)",
+                    (_key, _row, json.dumps(_document)),
+                )
+                _results.append(IndexingResult(_key, True, None, 201))
+            self._database.commit()
+            if isinstance(self.vectors, np.memmap):
+                self.vectors.flush()
+            self._changed()
+        return _results
+
+    def delete(self, keys: list):
+        _results = []
+        with self._lock:
+            for _key in keys:
+                _row = self.rows.pop(_key, None)
+                if _row is not None:
+                    del self.keys[_row]
+                    del self.documents[_key]
+                    self._free_rows.append(_row)
+                    self._database.execute("DELETE FROM documents WHERE chunk_id = ?", (_key,))
+                    if self._graph is not None:
+                        self._graph.remove(self._row_nodes.pop(_row))
+                _results.append(IndexingResult(_key, True, None, 200))
+            self._database.commit()
+            self._changed()
+        return _results
+
+    def filter_rows(self, expression: str):
+        """Sorted array of the rows whose document matches an OData filter."""
+        for _field in sorted(filter_fields(expression)):
+            if _field not in FILTERABLE_FIELDS:
+                raise ValueError(f"Field {_field} is not filterable")
+        with self._lock:
+            _rows = self._filter_rows.get(expression)
+            if _rows is None:
+                _predicate = parse_filter(expression)
+                _rows = np.array(
+                    sorted(self.rows[_key] for _key, _document in self.documents.items() if _predicate(_document)),
+                    dtype=np.int64,
+                )
+                self._filter_rows[expression] = _rows
+            return _rows
+
+    def exact_search(self, queries, k: int, rows=None):
+        """Exact cosine top ``k`` for a batch of query vectors.
+
+        Scores ``block_size`` rows per matrix multiply, so the memory-mapped
+        matrix is streamed rather than loaded at once.
+
+        Returns:
+            list: per query, (cosine similarity, chunk_id) pairs, best first
+        """
+        _queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        _queries = _queries / np.maximum(np.linalg.norm(_queries, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            _live = np.array(sorted(self.keys), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+            _keys = dict(self.keys)
+        _best = [(np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)) for _ in range(len(_queries))]
+        for _start in range(0, len(_live), self.block_size):
+            _block_rows = _live[_start : _start + self.block_size]
+            _similarities = np.asarray(self.vectors[_block_rows], dtype=np.float32) @ _queries.T
+            for _position in range(len(_queries)):
+                _scores = np.concatenate([_best[_position][0], _similarities[:, _position]])
+                _candidates = np.concatenate([_best[_position][1], _block_rows])
+                if len(_scores) > k:
+                    _top = np.argpartition(-_scores, k - 1)[:k]
+                    _scores, _candidates = _scores[_top], _candidates[_top]
+                _best[_position] = (_scores, _candidates)
+        _results = []
+        for _scores, _candidates in _best:
+            _order = np.argsort(-_scores)
+            _results.append([(float(_scores[_index]), _keys[int(_candidates[_index])]) for _index in _order])
+        return _results
+
+    def _graph_add(self, row: int):
+        if row in self._row_nodes:
+            # The node of the previous vector stays as a routing point only
+            self._graph.remove(self._row_nodes[row])
+        self._row_nodes[row] = self._graph.add(self.vectors[row])
+        self._graph_rows.append(row)
+
+    def graph(self, m: int = 4, ef_construction: int = 400, ef_search: int = 500):
+        """HNSW graph over the live rows, built on first use and updated by later writes."""
+        with self._lock:
+            if self._graph is None:
+                self._graph = HnswGraph(self.dimensions, m=m, ef_construction=ef_construction, ef_search=ef_search)
+                self._graph_rows = []
+                self._row_nodes = {}
+                for _row in sorted(self.keys):
+                    self._graph_add(_row)
+                logging.info("Built HNSW graph over %d vectors", len(self.keys))
+            return self._graph
+
+    def approximate_search(self, query, k: int, ef: int = None, rows=None):
+        """HNSW top ``k`` as (cosine similarity, chunk_id) pairs, best first."""
+        _graph = self.graph()
+        with self._lock:
+            _graph_rows = list(self._graph_rows)
+            _keys = dict(self.keys)
+            _allowed = None
+            if rows is not None:
+                _allowed = {self._row_nodes[int(_row)] for _row in rows}
+        return [
+            (_similarity, _keys[_graph_rows[_node]])
+            for _similarity, _node in _graph.search(query, k, ef=ef, allowed=_allowed)
+        ]
+
+    def keyword_index(self) -> KeywordIndex:
+        with self._lock:
+            if self._keyword_index is None:
+                self._keyword_index = KeywordIndex(self.documents.items())
+            return self._keyword_index
+
+    def compact(self):
+        """Rewrite the vector file without free rows."""
+        with self._lock:
+            _order = sorted(self.keys)
+            _vectors = np.array(self.vectors[_order]) if _order else np.zeros((0, self.dimensions), dtype=self.dtype)
+            _capacity = len(_order)
+            self.vectors = np.zeros((0, self.dimensions), dtype=self.dtype)
+            os.remove(os.path.join(self.path, "vectors.bin"))
+            self.capacity = _capacity
+            self.vectors = self._map(_capacity)
+            if _capacity:
+                self.vectors[:] = _vectors
+                self.vectors.flush()
+            for _new_row, _old_row in enumerate(_order):
+                _key = self.keys[_old_row]
+                self.rows[_key] = _new_row
+            self.keys = {_row: _key for _key, _row in self.rows.items()}
+            self._database.execute("UPDATE documents SET row = -row - 1")
+            self._database.executemany(
+                "UPDATE documents SET row = ? WHERE chunk_id = ?",
+                [(_row, _key) for _key, _row in self.rows.items()],
+            )
+            self._database.commit()
+            self._free_rows = []
+            self._graph = None
+            self._graph_rows = []
+            self._row_nodes = {}
+            self._write_meta()
+            self._changed()
+
+    def stats(self):
+        return {
+            "documents": len(self.documents),
+            "capacity": self.capacity,
+            "dimensions": self.dimensions,
+            "dtype": self.dtype,
+            "vector_bytes": self.capacity * self.dimensions * np.dtype(self.dtype).itemsize,
+            "graph_nodes": self._graph.count if self._graph is not None else 0,
+        }
+
+    def close(self):
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        self._database.close()
+
+
+class LocalSearchResults:
+    """Iterator of search results with ``get_count`` like ``SearchItemPaged``."""
+
+    def __init__(self, results: list, count: int, facets: dict = None):
+        self._results = results
+        self._count = count
+        self._facets = facets
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def get_count(self):
+        return self._count
+
+    def get_facets(self):
+        return self._facets
+
+
+class LocalSearchClient:
+    """``SearchClient`` look-alike over a :class:`LocalIndex`.
+
+    Supports keyword (BM25), vector and hybrid (RRF) queries, ``filter`` on
+    filterable fields in pre- or post-filter mode, ``top``/``skip``/``select``,
+    counts, value facets and the document write methods used by the push indexer. Semantic ranking
+    has no local equivalent and is skipped.
+
+    Args:
+        path (str): index directory
+        embed: callable turning text into a vector, needed for ``VectorizableTextQuery``
+        algorithm (str): ``exhaustive`` or ``hnsw`` for non-exhaustive vector queries
+        dimensions (int): vector dimensions, when the index does not exist yet
+        dtype (str): vector storage type, when the index does not exist yet
+    """
+
+    def __init__(self, path: str, embed=None, algorithm: str = "exhaustive", dimensions: int = None, dtype: str = "float32"):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm}, expected one of {ALGORITHMS}")
+        self.index = LocalIndex(path, dimensions=dimensions, dtype=dtype)
+        self.embed = embed
+        self.algorithm = algorithm
+
+    def _vector(self, vector_query):
+        _vector = getattr(vector_query, "vector", None)
+        if _vector is None:
+            if self.embed is None:
+                raise ValueError("Text vector queries need an embed function on the local backend")
+            _vector = self.embed(vector_query.text)
+        return _vector
+
+    def _vector_ranking(self, vector_query, rows, post_filter_rows):
+        _k = vector_query.k_nearest_neighbors or 50
+        _vector = self._vector(vector_query)
+        if self.algorithm == "hnsw" and not vector_query.exhaustive:
+            _ranking = self.index.approximate_search(_vector, _k, rows=rows)
+        else:
+            _ranking = self.index.exact_search(_vector, _k, rows=rows)[0]
+        if post_filter_rows is not None:
+            _allowed = {self.index.keys[int(_row)] for _row in post_filter_rows}
+            _ranking = [_item for _item in _ranking if _item[1] in _allowed]
+        return [(cosine_score(_similarity), _key) for _similarity, _key in _ranking]
+
+    def search(
+        self,
+        search_text: str = None,
+        *,
+        vector_queries: list = None,
+        top: int = None,
+        skip: int = None,
+        filter: str = None,
+        select=None,
+        include_total_count: bool = False,
+        facets: list = None,
+        vector_filter_mode=None,
+        query_type=None,
+        **kwargs,
+    ):
+        _rows = self.index.filter_rows(filter) if filter else None
+        _post_filter = str(getattr(vector_filter_mode, "value", vector_filter_mode)).lower() == "postfilter"
+        _rankings = []
+        if search_text and search_text != "*":
+            _allowed = None if _rows is None else {self.index.keys[int(_row)] for _row in _rows}
+            _rankings.append(self.index.keyword_index().rank(search_text, _allowed))
+        for _vector_query in vector_queries or []:
+            _rankings.append(
+                self._vector_ranking(
+                    _vector_query,
+                    None if _post_filter else _rows,
+                    _rows if _post_filter else None,
+                )
+            )
+        if str(getattr(query_type, "value", query_type)).lower() == "semantic":
+            _logger.debug("Semantic ranking is not available on the local backend, returning fused results")
+
+        if not _rankings:
+            _keys = sorted(self.index.documents) if _rows is None else [self.index.keys[int(_row)] for _row in _rows]
+            _ranking = [(1.0, _key) for _key in _keys]
+        elif len(_rankings) == 1:
+            _ranking = _rankings[0]
+        else:
+            _ranking = reciprocal_rank_fusion(_rankings)
+
+        if isinstance(select, str):
+            select = [_field.strip() for _field in select.split(",")]
+        _skip = skip or 0
+        _top = 50 if top is None else top
+        _results = []
+        for _score, _key in _ranking[_skip : _skip + _top]:
+            _document = self.index.documents[_key]
+            _result = {
+                _name: _value for _name, _value in _document.items() if not select or _name in select
+            }
+            _result["@search.score"] = _score
+            _result["@search.reranker_score"] = None
+            _result["@search.highlights"] = None
+            _result["@search.captions"] = None
+            _results.append(_result)
+        _facets = None
+        if facets:
+            _facets = facet_counts([self.index.documents[_key] for _, _key in _ranking], facets)
+        return LocalSearchResults(_results, len(_ranking) if include_total_count else None, _facets)
+
+    def get_document_count(self) -> int:
+        return len(self.index)
+
+    def index_documents(self, batch, **kwargs):
+        _results = []
+        for _action in batch.actions:
+            _document = dict(_action.additional_properties)
+            if _action.action_type == "delete":
+                _results.extend(self.index.delete([_document["chunk_id"]]))
+            else:
+                _results.extend(
+                    self.index.upsert([_document], merge=_action.action_type in ("merge", "mergeOrUpload"))
+                )
+        return _results
+
+    def upload_documents(self, documents: list, **kwargs):
+        return self.index.upsert(documents)
+
+    def merge_or_upload_documents(self, documents: list, **kwargs):
+        return self.index.upsert(documents, merge=True)
+
+    def delete_documents(self, documents: list, **kwargs):
+        return self.index.delete([_document["chunk_id"] for _document in documents])
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        help="Local index directory",
+        required=True,
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Rewrite the vector file without free rows",
+        default=False,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _index = LocalIndex(_args.path)
+    if _args.compact:
+        _index.compact()
+    print(json.dumps(_index.stats()))
+    _index.close()
+
+
+if __name__ == "__main__":
+    main()
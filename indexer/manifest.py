@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from azure.core.exceptions import ResourceNotFoundError
+
+
+_logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+
+def content_hash(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def chunk_hash(text: str, page_number=None, headers: dict = None) -> str:
+    """Hash of everything that ends up in a chunk document except its vector."""
+    _payload = json.dumps(
+        [text, page_number, sorted((headers or {}).items())], ensure_ascii=False
+    )
+    return hashlib.sha256(_payload.encode("utf-8")).hexdigest()
+
+
+def settings_hash(settings: dict) -> str:
+    """Hash of the ingestion settings that shape chunks and vectors, such as chunking and embedding model."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class FingerprintManifest:
+    """Blob path -> content fingerprint -> chunk ids, persisted between ingestion runs.
+
+    Stored as JSON in a local file, or in a sidecar blob when a container client
+    is given. Push ingestion skips sources whose fingerprint is unchanged and only
+    uploads or deletes the chunk ids that differ from the previous run.
+
+    Args:
+        path (str): local file path, or blob name when ``container_client`` is set
+        container_client: optional ``ContainerClient`` holding the sidecar blob
+    """
+
+    def __init__(self, path: str, container_client=None):
+        self.path = path
+        self.container_client = container_client
+        self.sources = {}
+        self.settings = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a manifest from ``--manifest-path`` and ``--manifest-container`` options."""
+        if not getattr(args, "manifest_path", None):
+            return None
+        _container_client = None
+        if getattr(args, "manifest_container", None):
+            from azure.storage.blob import BlobServiceClient
+
+            _container_client = BlobServiceClient(
+                account_url=args.storage_account_url,
+                credential=os.getenv("AZURE_STORAGE_KEY"),
+            ).get_container_client(args.manifest_container)
+        return cls(args.manifest_path, _container_client)
+
+    def load(self):
+        _raw = None
+        if self.container_client is not None:
+            try:
+                _raw = self.container_client.download_blob(self.path).readall()
+            except ResourceNotFoundError:
+                _raw = None
+        elif os.path.exists(self.path):
+            with open(self.path, "rb") as _file:
+                _raw = _file.read()
+        _manifest = json.loads(_raw) if _raw else {}
+        self.sources = _manifest.get("sources", {})
+        self.settings = _manifest.get("settings")
+        logging.info("Loaded manifest %s with %d sources", self.path, len(self.sources))
+        return self
+
+    def save(self):
+        with self._lock:
+            _raw = json.dumps(
+                {"version": MANIFEST_VERSION, "settings": self.settings, "sources": self.sources}, sort_keys=True
+            ).encode("utf-8")
+        if self.container_client is not None:
+            self.container_client.upload_blob(self.path, _raw, overwrite=True)
+        else:
+            _directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(_directory, exist_ok=True)
+            _temporary = f"{self.path}.tmp"
+            with open(_temporary, "wb") as _file:
+                _file.write(_raw)
+            os.replace(_temporary, self.path)
+        logging.info("Saved manifest %s with %d sources", self.path, len(self.sources))
+
+    def delete(self):
+        if self.container_client is not None:
+            try:
+                self.container_client.delete_blob(self.path)
+            except ResourceNotFoundError:
+                pass
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.sources = {}
+        self.settings = None
+        logging.info("Deleted manifest %s", self.path)
+
+    def apply_settings(self, settings: str) -> bool:
+        """Record the :func:`settings_hash` of this run, returns whether it differs from the last one.
+
+        On a change every source is re-processed and every chunk re-uploaded,
+        since unchanged content no longer means unchanged chunks or vectors.
+        Chunk ids are kept so chunks the new settings no longer produce are
+        still deleted. Manifests written before settings were recorded count
+        as changed.
+        """
+        with self._lock:
+            _changed = self.settings != settings and bool(self.sources)
+            if _changed:
+                for _entry in self.sources.values():
+                    _entry["fingerprint"] = None
+                    _entry["chunks"] = {_chunk_id: None for _chunk_id in _entry.get("chunks", {})}
+            self.settings = settings
+            return _changed
+
+    def is_unchanged(self, source: str, fingerprint: str) -> bool:
+        _entry = self.sources.get(source)
+        return bool(fingerprint) and _entry is not None and _entry.get("fingerprint") == fingerprint
+
+    def chunks(self, source: str) -> dict:
+        """Previously indexed {chunk_id: chunk_hash} of a source."""
+        return dict(self.sources.get(source, {}).get("chunks", {}))
+
+    def update(self, source: str, fingerprint: str, chunks: dict):
+        with self._lock:
+            self.sources[source] = {"fingerprint": fingerprint, "chunks": chunks}
+
+    def invalidate(self, source: str):
+        """Forget a source's fingerprint so the next run re-processes it."""
+        with self._lock:
+            if source in self.sources:
+                self.sources[source]["fingerprint"] = None
+
+    def retry(self, source: str, chunk_ids):
+        """Record chunk ids whose upload or delete failed without a hash, so the next run retries them.
+
+        The source's fingerprint is forgotten as well. A failed upload is then
+        re-uploaded since its hash no longer matches, and a failed delete is
+        deleted again since the source no longer produces it.
+        """
+        with self._lock:
+            _entry = self.sources.setdefault(source, {"fingerprint": None, "chunks": {}})
+            _entry["fingerprint"] = None
+            _entry.setdefault("chunks", {}).update(dict.fromkeys(chunk_ids))
+
+    def remove(self, source: str) -> list:
+        """Drop a source and return the chunk ids it owned."""
+        with self._lock:
+            return list(self.sources.pop(source, {}).get("chunks", {}))
+
+    def sources_not_in(self, seen) -> list:
+        return [_source for _source in self.sources if _source not in seen]
+
+    def chunk_count(self) -> int:
+        return sum(len(_entry.get("chunks", {})) for _entry in self.sources.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--manifest-path",
+        type=str,
+        help="Manifest file, or blob name with --manifest-container",
+        required=True,
+    )
+    parser.add_argument(
+        "--manifest-container",
+        type=str,
+        help="Storage container holding the manifest as a sidecar blob",
+        default=None,
+    )
+    parser.add_argument(
+        "--storage-account-url",
+        type=str,
+        help="Azure storage account url",
+        default=None,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _manifest = FingerprintManifest.from_args(_args).load()
+    print(
+        json.dumps(
+            {
+                "sources": len(_manifest.sources),
+                "chunks": _manifest.chunk_count(),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
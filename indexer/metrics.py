@@ -0,0 +1,76 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of ``values`` (``q`` in 0..100), 0 when empty."""
+    if not values:
+        return 0.0
+    _sorted = sorted(values)
+    _rank = max(1, math.ceil(q / 100 * len(_sorted)))
+    return _sorted[min(_rank, len(_sorted)) - 1]
+
+
+class LatencyRecorder:
+    """Per-stage latency samples with p50/p95/p99 summaries.
+
+    Only the last ``max_samples`` samples of each stage are kept, so a
+    long-running service reports recent latency in bounded memory.
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.max_samples)
+                self._counts[stage] = 0
+                self._errors[stage] = 0
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+            if error:
+                self._errors[stage] += 1
+
+    @contextmanager
+    def time(self, stage: str):
+        """Record the duration of the ``with`` block, flagging it as an error if it raises."""
+        _started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(stage, time.perf_counter() - _started, error=True)
+            raise
+        self.record(stage, time.perf_counter() - _started)
+
+    def summary(self):
+        """{stage: {count, errors, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}."""
+        with self._lock:
+            _stages = {_stage: list(_samples) for _stage, _samples in self._samples.items()}
+            _counts = dict(self._counts)
+            _errors = dict(self._errors)
+        _summary = {}
+        for _stage, _samples in _stages.items():
+            _summary[_stage] = {
+                "count": _counts[_stage],
+                "errors": _errors[_stage],
+                "mean_ms": round(sum(_samples) / len(_samples) * 1000, 2) if _samples else 0.0,
+                "p50_ms": round(percentile(_samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(_samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(_samples, 99) * 1000, 2),
+                "max_ms": round(max(_samples) * 1000, 2) if _samples else 0.0,
+            }
+        return _summary
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
@@ -0,0 +1,179 @@
+import functools
+import re
+
+
+_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?)|(?P<name>[A-Za-z_][\w./]*)|(?P<symbol>[(),]))"
+)
+
+_COMPARISONS = {
+    "eq": lambda _left, _right: _left == _right,
+    "ne": lambda _left, _right: _left != _right,
+    "gt": lambda _left, _right: _left is not None and _right is not None and _left > _right,
+    "ge": lambda _left, _right: _left is not None and _right is not None and _left >= _right,
+    "lt": lambda _left, _right: _left is not None and _right is not None and _left < _right,
+    "le": lambda _left, _right: _left is not None and _right is not None and _left <= _right,
+}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class FilterSyntaxError(ValueError):
+    """The filter is not in the supported OData subset."""
+
+
+def _tokenize(expression: str):
+    _tokens = []
+    _position = 0
+    _expression = expression.rstrip()
+    while _position < len(_expression):
+        _match = _TOKEN_PATTERN.match(_expression, _position)
+        if not _match or _match.end() == _position:
+            raise FilterSyntaxError(f"Unexpected input at {_position}: {_expression[_position:]!r}")
+        _position = _match.end()
+        _kind = _match.lastgroup
+        _value = _match.group(_kind)
+        if _kind == "string":
+            _value = _value[1:-1].replace("''", "'")
+        elif _kind == "number":
+            _value = float(_value) if "." in _value else int(_value)
+        _tokens.append((_kind, _value))
+    return _tokens
+
+
+class _Parser:
+    """Recursive descent over ``or`` > ``and`` > ``not`` > comparison / ``search.in`` / parentheses."""
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+        # Field names the expression compares, as written
+        self.fields = set()
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self):
+        _token = self._peek()
+        self.position += 1
+        return _token
+
+    def _expect(self, value):
+        _kind, _value = self._next()
+        if _value != value:
+            raise FilterSyntaxError(f"Expected {value!r}, got {_value!r}")
+
+    def _keyword(self, word: str) -> bool:
+        _kind, _value = self._peek()
+        if _kind == "name" and _value.lower() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        _predicate = self._or()
+        if self.position != len(self.tokens):
+            raise FilterSyntaxError(f"Unexpected token {self._peek()[1]!r}")
+        return _predicate
+
+    def _or(self):
+        _terms = [self._and()]
+        while self._keyword("or"):
+            _terms.append(self._and())
+        if len(_terms) == 1:
+            return _terms[0]
+        return lambda _document: any(_term(_document) for _term in _terms)
+
+    def _and(self):
+        _terms = [self._not()]
+        while self._keyword("and"):
+            _terms.append(self._not())
+        if len(_terms) == 1:
+            return _terms[0]
+        return lambda _document: all(_term(_document) for _term in _terms)
+
+    def _not(self):
+        if self._keyword("not"):
+            _term = self._not()
+            return lambda _document: not _term(_document)
+        return self._primary()
+
+    def _literal(self):
+        _kind, _value = self._next()
+        if _kind in ("string", "number"):
+            return _value
+        if _kind == "name" and _value.lower() in _LITERALS:
+            return _LITERALS[_value.lower()]
+        raise FilterSyntaxError(f"Expected a literal, got {_value!r}")
+
+    def _primary(self):
+        _kind, _value = self._peek()
+        if _value == "(":
+            self._next()
+            _term = self._or()
+            self._expect(")")
+            return _term
+        if _kind != "name":
+            raise FilterSyntaxError(f"Expected a field name, got {_value!r}")
+        self._next()
+        if _value.lower() == "search.in":
+            return self._search_in()
+        self.fields.add(_value)
+        _field = _value.replace("/", ".")
+        _operator_kind, _operator = self._next()
+        _compare = _COMPARISONS.get((_operator or "").lower()) if _operator_kind == "name" else None
+        if _compare is None:
+            raise FilterSyntaxError(f"Expected a comparison operator after {_field}, got {_operator!r}")
+        _literal = self._literal()
+        return lambda _document: _compare(_document.get(_field), _literal)
+
+    def _search_in(self):
+        self._expect("(")
+        _kind, _field = self._next()
+        if _kind != "name":
+            raise FilterSyntaxError("search.in expects a field name")
+        self.fields.add(_field)
+        self._expect(",")
+        _kind, _values = self._next()
+        if _kind != "string":
+            raise FilterSyntaxError("search.in expects a string of values")
+        _delimiters = " ,"
+        if self._peek()[1] == ",":
+            self._next()
+            _kind, _delimiters = self._next()
+            if _kind != "string":
+                raise FilterSyntaxError("search.in expects a string of delimiters")
+        self._expect(")")
+        _allowed = {
+            _item for _item in re.split("|".join(re.escape(_char) for _char in _delimiters), _values) if _item
+        }
+        return lambda _document: _document.get(_field) in _allowed
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_filter(expression: str):
+    """Compile an OData ``$filter`` into a predicate over a document dict.
+
+    Supports ``eq``/``ne``/``gt``/``ge``/``lt``/``le`` against string, number,
+    boolean and null literals, ``and``/``or``/``not``, parentheses and
+    ``search.in(field, 'a,b', ',')``. Compiled predicates are cached.
+
+    Raises:
+        FilterSyntaxError: the expression is outside that subset
+    """
+    if not expression or not expression.strip():
+        return lambda _document: True
+    return _Parser(_tokenize(expression)).parse()
+
+
+@functools.lru_cache(maxsize=1024)
+def filter_fields(expression: str) -> frozenset:
+    """Field names an OData ``$filter`` compares, string literals are not mistaken for fields.
+
+    Raises:
+        FilterSyntaxError: the expression is outside the :func:`parse_filter` subset
+    """
+    if not expression or not expression.strip():
+        return frozenset()
+    _parser = _Parser(_tokenize(expression))
+    _parser.parse()
+    return frozenset(_parser.fields)
@@ -0,0 +1,213 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chunker import extract_pages
+from manifest import content_hash
+
+
+_logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def extract_page_list(name: str, data: bytes):
+    """Process-pool entry point: fully extract one document's pages."""
+    return list(extract_pages(name, data))
+
+
+class Stage:
+    """A pool of worker threads moving items between two bounded queues.
+
+    ``func(item, emit)`` is called for every input item and may call ``emit`` any
+    number of times. A full output queue blocks the workers, which is what gives
+    the pipeline backpressure and bounds its memory.
+    """
+
+    def __init__(self, name: str, func, workers: int, inbox: queue.Queue, outbox: queue.Queue):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._alive = workers
+        self._threads = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        for _number in range(self.workers):
+            _thread = threading.Thread(
+                target=self._work, name=f"{self.name}-{_number}", daemon=True
+            )
+            _thread.start()
+            self._threads.append(_thread)
+        return self
+
+    def emit(self, item):
+        self.outbox.put(item)
+        with self._lock:
+            self.items_out += 1
+
+    def _work(self):
+        while True:
+            _item = self.inbox.get()
+            if _item is _DONE:
+                # Let sibling workers see the end of input too
+                self.inbox.put(_DONE)
+                break
+            with self._lock:
+                self.items_in += 1
+            _started = time.perf_counter()
+            try:
+                self.func(_item, self.emit)
+            except Exception:
+                _logger.exception("Stage %s failed on an item", self.name)
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.busy_seconds += time.perf_counter() - _started
+        with self._lock:
+            self._alive -= 1
+            _last = self._alive == 0
+        if _last:
+            self.finished = time.perf_counter()
+            self.outbox.put(_DONE)
+
+    def sample(self):
+        self.max_queue_depth = max(self.max_queue_depth, self.inbox.qsize())
+
+    def stats(self):
+        _elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "errors": self.errors,
+            "items_per_second": round(self.items_in / _elapsed, 2) if _elapsed else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "queue_depth": self.inbox.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class IngestionPipeline:
+    """Concurrent front end for :class:`push_indexer.AISearchPushIndexer`.
+
+    Stages: list -> download (thread pool) -> extract (process pool sized to
+    cores) -> chunk + embed (thread pool) -> batch upload (the push indexer's
+    concurrent uploader). Every hand-off is a bounded queue, so at most
+    ``queue_size`` documents wait between two stages regardless of corpus size.
+    """
+
+    def __init__(
+        self,
+        push_indexer,
+        download_workers: int = 8,
+        extract_workers: int = None,
+        embed_workers: int = 4,
+        queue_size: int = 8,
+        report_interval: float = 10.0,
+    ):
+        self.push_indexer = push_indexer
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.embed_workers = embed_workers
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.stages = []
+        self._seen = set()
+        self._stop_reporting = threading.Event()
+
+    def _download(self, item, emit):
+        _name, _source_address, _fingerprint, _load = item
+        _data = _load()
+        _fingerprint = _fingerprint or content_hash(_data)
+        if not self.push_indexer.should_skip(_name, _fingerprint):
+            emit((_name, _source_address, _fingerprint, _data))
+
+    def _embed(self, item, emit):
+        _name, _source_address, _fingerprint, _pages = item
+        logging.info("Processing %s", _name)
+        for _action in self.push_indexer.build_actions(_name, _source_address, _pages, _fingerprint):
+            emit(_action)
+        with self.push_indexer._stats_lock:
+            self.push_indexer.sources_processed += 1
+
+    def _list(self, outbox: queue.Queue):
+        try:
+            for _source in self.push_indexer.list_sources():
+                self._seen.add(_source[0])
+                if not self.push_indexer.should_skip(_source[0], _source[2]):
+                    outbox.put(_source)
+        finally:
+            outbox.put(_DONE)
+
+    def _report(self):
+        while not self._stop_reporting.wait(min(self.report_interval, 0.5)):
+            for _stage in self.stages:
+                _stage.sample()
+            if time.perf_counter() - self._last_report >= self.report_interval:
+                self._last_report = time.perf_counter()
+                logging.info(
+                    "Pipeline queues %s",
+                    {_stage.name: _stage.inbox.qsize() for _stage in self.stages},
+                )
+
+    def actions(self):
+        """Run the stages and yield their (action, document) output in completion order."""
+        _sources = queue.Queue(self.queue_size)
+        _downloaded = queue.Queue(self.queue_size)
+        _extracted = queue.Queue(self.queue_size)
+        _actions = queue.Queue(self.queue_size * 64)
+
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as _pool:
+
+            def _extract(item, emit):
+                _name, _source_address, _fingerprint, _data = item
+                _pages = _pool.submit(extract_page_list, _name, _data).result()
+                emit((_name, _source_address, _fingerprint, _pages))
+
+            self.stages = [
+                Stage("download", self._download, self.download_workers, _sources, _downloaded),
+                Stage("extract", _extract, self.extract_workers, _downloaded, _extracted),
+                Stage("embed", self._embed, self.embed_workers, _extracted, _actions),
+            ]
+            _lister = threading.Thread(target=self._list, args=(_sources,), daemon=True)
+            _lister.start()
+            for _stage in self.stages:
+                _stage.start()
+            self._last_report = time.perf_counter()
+            _reporter = threading.Thread(target=self._report, daemon=True)
+            _reporter.start()
+
+            try:
+                while True:
+                    _item = _actions.get()
+                    if _item is _DONE:
+                        break
+                    yield _item
+            finally:
+                self._stop_reporting.set()
+                _reporter.join()
+
+        _lister.join()
+        yield from self.push_indexer.deleted_source_actions(self._seen)
+
+    def run(self):
+        _result = self.push_indexer.run(self.actions())
+        _result["stages"] = [_stage.stats() for _stage in self.stages]
+        for _stage in _result["stages"]:
+            logging.info("Stage %s", _stage)
+        return _result
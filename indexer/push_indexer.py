@@ -0,0 +1,646 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from azure.search.documents import IndexDocumentsBatch
+from azure.storage.blob import BlobServiceClient
+
+from async_embedder import EmbeddingEngine
+from clients import get_factory
+from chunker import (
+    Chunker,
+    CHUNKING_MODES,
+    DEFAULT_MAXIMUM_PAGE_LENGTH,
+    DEFAULT_PAGE_OVERLAP_LENGTH,
+    extract_pages,
+)
+from embedding_cache import EmbeddingCache
+from manifest import FingerprintManifest, chunk_hash, content_hash, settings_hash
+from pipeline import IngestionPipeline
+from query_cache import invalidate_chunks, notify_invalidations
+
+
+_logger = logging.getLogger(__name__)
+
+# Azure AI Search accepts at most 1000 actions and 16 MB per indexing request.
+MAX_BATCH_DOCUMENTS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def encode_key(value: str) -> str:
+    """Encode a blob path into a valid search document key."""
+    return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+class AISearchPushIndexer:
+    """Push-mode ingestion: read blobs, chunk and embed locally, upload in batches.
+
+    Produces the same chunk documents the skillset index projections write, so the
+    index created by ``index.py`` can be populated by either path.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.documents_uploaded = 0
+        self.documents_failed = 0
+        self.documents_deleted = 0
+        self.sources_processed = 0
+        self.sources_skipped = 0
+        self.chunks_unchanged = 0
+        self.changed_chunk_ids = set()
+        # Source of every chunk id deleted this run, so a failed delete is kept in the manifest
+        self.deleted_from = {}
+        self._stats_lock = threading.Lock()
+        self.manifest = FingerprintManifest.from_args(args)
+        self._search_client = None
+        # Batches upload from several threads, a second LocalIndex over the same files would lose rows
+        self._search_client_lock = threading.Lock()
+        self._embedding_engine = None
+        self.chunker = Chunker(
+            args.chunking_mode,
+            args.maximum_page_length,
+            args.page_overlap_length,
+        )
+        self.embedding_cache = (
+            EmbeddingCache(args.embedding_cache_path, args.embedding_cache_max_bytes)
+            if args.embedding_cache_path
+            else None
+        )
+
+    @property
+    def search_client(self):
+        with self._search_client_lock:
+            if self._search_client is None and self.args.local_index_path:
+                from local_index import LocalSearchClient
+
+                self._search_client = LocalSearchClient(
+                    self.args.local_index_path,
+                    dimensions=self.args.azure_openai_model_dimensions,
+                    dtype=self.args.local_index_dtype,
+                )
+            elif self._search_client is None:
+                self._search_client = get_factory(
+                    self.args.search_endpoint, pool_maxsize=max(self.args.concurrent_batches, 4) * 2
+                ).search_client(self.args.index_name)
+            return self._search_client
+
+    @property
+    def embedding_engine(self):
+        if self._embedding_engine is None:
+            _args = self.args
+            self._embedding_engine = EmbeddingEngine(
+                endpoint=_args.azure_openai_endpoint,
+                deployment=_args.azure_openai_embedding_deployment,
+                dimensions=_args.azure_openai_model_dimensions,
+                api_version=_args.azure_openai_api_version,
+                max_items_per_request=_args.embedding_batch_size,
+                max_concurrency=_args.embedding_concurrency,
+                tokens_per_minute=_args.embedding_tokens_per_minute,
+            )
+        return self._embedding_engine
+
+    def list_sources(self):
+        """Yield (name, source_address, fingerprint, loader) for every document to ingest.
+
+        The fingerprint is the blob's Content-MD5 when the service has one, so
+        unchanged blobs can be skipped without downloading them; otherwise it is
+        ``None`` and computed from the downloaded bytes.
+        """
+        _args = self.args
+        if _args.source_dir:
+            for _root, _dirs, _files in os.walk(_args.source_dir):
+                for _file in sorted(_files):
+                    _path = os.path.join(_root, _file)
+                    _name = os.path.relpath(_path, _args.source_dir).replace(os.sep, "/")
+                    yield _name, os.path.abspath(_path), None, (lambda p=_path: open(p, "rb").read())
+            return
+
+        _blob_service_client = BlobServiceClient(
+            account_url=_args.storage_account_url,
+            credential=os.getenv("AZURE_STORAGE_KEY"),
+        )
+        _container_client = _blob_service_client.get_container_client(
+            container=_args.container_name
+        )
+        for _blob in _container_client.list_blobs():
+            _blob_client = _container_client.get_blob_client(_blob.name)
+            _content_md5 = _blob.content_settings.content_md5 if _blob.content_settings else None
+            _fingerprint = f"md5:{bytes(_content_md5).hex()}" if _content_md5 else None
+            yield _blob.name, _blob_client.url, _fingerprint, (
+                lambda c=_blob_client: c.download_blob().readall()
+            )
+
+    def embed(self, texts: list):
+        _args = self.args
+        if self.embedding_cache is None:
+            return self._embed_uncached(texts)
+        return self.embedding_cache.get_or_embed(
+            texts,
+            _args.azure_openai_model_name or _args.azure_openai_embedding_deployment,
+            _args.azure_openai_model_dimensions,
+            self._embed_uncached,
+        )
+
+    def _embed_uncached(self, texts: list):
+        return self.embedding_engine.embed(texts)
+
+    def build_actions(self, name: str, source_address: str, pages, fingerprint: str):
+        """Chunk and embed one source document's (page_number, text) pairs into (action, document) pairs.
+
+        Chunk ids are derived from the chunk content, so chunks already recorded
+        in the manifest are neither re-embedded nor re-uploaded, and chunks that
+        disappeared from the source are deleted. Chunks are embedded in windows
+        of ``embedding_window`` so large PDFs stream through.
+        """
+        _args = self.args
+        _parent_id = encode_key(source_address)
+        _previous = self.manifest.chunks(name) if self.manifest else {}
+        _current = {}
+        _window = []
+        for _chunk in self.chunker.chunk_pages(pages):
+            _hash = chunk_hash(_chunk.text, _chunk.page_number, _chunk.headers)
+            _chunk_id = f"{_parent_id}_{_hash[:32]}"
+            _duplicate = 1
+            while _chunk_id in _current:
+                _chunk_id = f"{_parent_id}_{_hash[:32]}_{_duplicate}"
+                _duplicate += 1
+            _current[_chunk_id] = _hash
+            if _previous.get(_chunk_id) == _hash:
+                with self._stats_lock:
+                    self.chunks_unchanged += 1
+                continue
+            _window.append((_chunk_id, _chunk))
+            if len(_window) >= _args.embedding_window:
+                yield from self._window_actions(_window, _parent_id, name, source_address)
+                _window = []
+        if _window:
+            yield from self._window_actions(_window, _parent_id, name, source_address)
+
+        for _chunk_id in _previous.keys() - _current.keys():
+            with self._stats_lock:
+                self.deleted_from[_chunk_id] = name
+            yield "delete", {"chunk_id": _chunk_id}
+        if self.manifest:
+            self.manifest.update(name, fingerprint, _current)
+
+    def _window_actions(self, chunks: list, parent_id: str, name: str, source_address: str):
+        _args = self.args
+        _vectors = self.embed([_chunk.text for _, _chunk in chunks])
+        for (_chunk_id, _chunk), _vector in zip(chunks, _vectors):
+            _document = {
+                "parent_id": parent_id,
+                "chunk_id": _chunk_id,
+                "chunk": _chunk.text,
+                "vector": _vector,
+                "title": os.path.basename(name),
+                "blob_path": name,
+                "source_address": source_address,
+            }
+            if _args.add_page_numbers:
+                _document["page_number"] = str(_chunk.page_number)
+            if _args.chunking_mode == "markdown":
+                for _level in (1, 2, 3):
+                    _document[f"header_{_level}"] = _chunk.headers.get(f"header_{_level}")
+            yield _args.upload_action, _document
+
+    def batches(self, actions):
+        """Group (action, document) pairs into batches bounded by count and serialized size."""
+        _args = self.args
+        _batch = []
+        _batch_bytes = 0
+        for _action in actions:
+            _size = len(json.dumps(_action[1]))
+            if _batch and (
+                len(_batch) >= _args.batch_size
+                or _batch_bytes + _size > _args.max_batch_bytes
+            ):
+                yield _batch
+                _batch = []
+                _batch_bytes = 0
+            _batch.append(_action)
+            _batch_bytes += _size
+        if _batch:
+            yield _batch
+
+    def upload_batch(self, batch: list):
+        _index_batch = IndexDocumentsBatch()
+        for _action, _document in batch:
+            if _action == "delete":
+                _index_batch.add_delete_actions([_document])
+            elif _action == "merge_or_upload":
+                _index_batch.add_merge_or_upload_actions([_document])
+            else:
+                _index_batch.add_upload_actions([_document])
+        _results = self.search_client.index_documents(_index_batch)
+        # Cached search results that returned any of these chunks are now stale
+        invalidate_chunks(_document["chunk_id"] for _action, _document in batch)
+        with self._stats_lock:
+            self.changed_chunk_ids.update(_document["chunk_id"] for _action, _document in batch)
+        _failed = [_result for _result in _results if not _result.succeeded]
+        for _result in _failed:
+            _logger.error("Failed to index %s: %s", _result.key, _result.error_message)
+        _deleted = sum(1 for _action, _ in batch if _action == "delete")
+        return len(_results) - len(_failed), len(_failed), _deleted, [_result.key for _result in _failed]
+
+    def should_skip(self, name: str, fingerprint: str) -> bool:
+        if self.manifest and self.manifest.is_unchanged(name, fingerprint):
+            with self._stats_lock:
+                self.sources_skipped += 1
+            return True
+        return False
+
+    def deleted_source_actions(self, seen: set):
+        """Delete actions for manifest sources that are no longer listed."""
+        if not self.manifest:
+            return
+        for _source in self.manifest.sources_not_in(seen):
+            logging.info("Removing chunks of deleted source %s", _source)
+            for _chunk_id in self.manifest.remove(_source):
+                with self._stats_lock:
+                    self.deleted_from[_chunk_id] = _source
+                yield "delete", {"chunk_id": _chunk_id}
+
+    def iter_actions(self):
+        _seen = set()
+        for _name, _source_address, _fingerprint, _load in self.list_sources():
+            _seen.add(_name)
+            if self.should_skip(_name, _fingerprint):
+                continue
+            _data = _load()
+            _fingerprint = _fingerprint or content_hash(_data)
+            if self.should_skip(_name, _fingerprint):
+                continue
+            logging.info("Processing %s", _name)
+            yield from self.build_actions(_name, _source_address, extract_pages(_name, _data), _fingerprint)
+            with self._stats_lock:
+                self.sources_processed += 1
+        yield from self.deleted_source_actions(_seen)
+
+    def settings(self) -> dict:
+        """Settings that shape the chunk documents, a change invalidates the whole manifest."""
+        _args = self.args
+        return {
+            "chunking_mode": _args.chunking_mode,
+            "maximum_page_length": _args.maximum_page_length,
+            "page_overlap_length": _args.page_overlap_length,
+            "add_page_numbers": _args.add_page_numbers,
+            "embedding_deployment": _args.azure_openai_embedding_deployment,
+            "dimensions": _args.azure_openai_model_dimensions,
+        }
+
+    def _check_manifest(self):
+        """Drop a manifest that describes chunks an empty index no longer has."""
+        if self.manifest.sources and self.search_client.get_document_count() == 0:
+            logging.warning(
+                "Manifest %s lists %d chunks but the index is empty, re-ingesting everything",
+                self.manifest.path,
+                self.manifest.chunk_count(),
+            )
+            self.manifest.sources = {}
+
+    def _invalidate_failed(self, failed_keys: set):
+        """Keep failed chunk ids in the manifest without a hash so the next run retries them."""
+        _retries = {}
+        for _key in failed_keys:
+            if _key in self.deleted_from:
+                _retries.setdefault(self.deleted_from[_key], set()).add(_key)
+        for _source, _entry in list(self.manifest.sources.items()):
+            _failed = failed_keys.intersection(_entry.get("chunks", {}))
+            if _failed:
+                _retries.setdefault(_source, set()).update(_failed)
+        for _source, _chunk_ids in _retries.items():
+            self.manifest.retry(_source, _chunk_ids)
+
+    def run(self, actions=None):
+        """Upload actions (by default from :meth:`iter_actions`) and return run statistics."""
+        _args = self.args
+        _started = time.perf_counter()
+        _pending = set()
+        _failed_keys = set()
+        if self.manifest:
+            self.manifest.load()
+            self._check_manifest()
+            if self.manifest.apply_settings(settings_hash(self.settings())):
+                logging.warning(
+                    "Chunking or embedding settings changed since manifest %s was written, re-ingesting everything",
+                    self.manifest.path,
+                )
+
+        def _collect(done):
+            for _future in done:
+                _succeeded, _failed, _deleted, _keys = _future.result()
+                self.documents_uploaded += _succeeded - _deleted
+                self.documents_deleted += _deleted
+                self.documents_failed += _failed
+                _failed_keys.update(_keys)
+
+        with ThreadPoolExecutor(max_workers=_args.concurrent_batches) as _executor:
+            for _batch in self.batches(self.iter_actions() if actions is None else actions):
+                # Keep at most ``concurrent_batches`` uploads in flight
+                if len(_pending) >= _args.concurrent_batches:
+                    _done, _pending = wait(_pending, return_when=FIRST_COMPLETED)
+                    _collect(_done)
+                _pending.add(_executor.submit(self.upload_batch, _batch))
+            _collect(wait(_pending)[0])
+
+        if self.manifest:
+            # Sources with failed chunks are re-processed on the next run
+            self._invalidate_failed(_failed_keys)
+            self.manifest.save()
+        if _args.invalidate_url and self.changed_chunk_ids:
+            _invalidated = notify_invalidations(_args.invalidate_url, self.changed_chunk_ids)
+            logging.info(
+                "Sent %d changed chunk ids for invalidation, %d cached entries dropped",
+                len(self.changed_chunk_ids),
+                _invalidated,
+            )
+
+        _elapsed = time.perf_counter() - _started
+        _docs_per_second = self.documents_uploaded / _elapsed if _elapsed else 0.0
+        logging.info(
+            "Uploaded %d and deleted %d chunk documents from %d sources (%d unchanged) in %.2fs (%.1f docs/sec, %d failed)",
+            self.documents_uploaded,
+            self.documents_deleted,
+            self.sources_processed,
+            self.sources_skipped,
+            _elapsed,
+            _docs_per_second,
+            self.documents_failed,
+        )
+        if self._embedding_engine is not None:
+            logging.info("Embedding client %s", self._embedding_engine.stats())
+            self._embedding_engine.close()
+            self._embedding_engine = None
+        if self.embedding_cache is not None:
+            logging.info("Embedding cache %s", self.embedding_cache.stats())
+        return {
+            "sources": self.sources_processed,
+            "sources_unchanged": self.sources_skipped,
+            "documents": self.documents_uploaded,
+            "deleted": self.documents_deleted,
+            "chunks_unchanged": self.chunks_unchanged,
+            "failed": self.documents_failed,
+            "seconds": round(_elapsed, 3),
+            "docs_per_second": round(_docs_per_second, 2),
+        }
+
+
+def ingest(args):
+    """Run push ingestion, through the staged pipeline with ``--pipeline``, and return its stats."""
+    _push_indexer = AISearchPushIndexer(args)
+    if args.pipeline:
+        return IngestionPipeline(
+            _push_indexer,
+            download_workers=args.download_workers,
+            extract_workers=args.extract_workers,
+            embed_workers=args.embed_workers,
+            queue_size=args.queue_size,
+        ).run()
+    return _push_indexer.run()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        required=True,
+    )
+    parser.add_argument(
+        "--storage-account-url",
+        type=str,
+        help="Azure storage account url",
+    )
+    parser.add_argument(
+        "--container-name",
+        type=str,
+        help="Azure storage container name",
+    )
+    parser.add_argument(
+        "--local-index-path",
+        type=str,
+        help="Write to a local index directory instead of the Azure AI Search index",
+        default=None,
+    )
+    parser.add_argument(
+        "--local-index-dtype",
+        choices=("float32", "float16"),
+        help="Vector storage type of a new local index",
+        default="float32",
+    )
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        help="Read documents from a local directory instead of blob storage",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint",
+        required=True,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        required=True,
+    )
+    parser.add_argument(
+        "--azure-openai-model-name",
+        type=str,
+        help="Azure OpenAI model name, used in embedding cache keys (defaults to the deployment)",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI model dimensions",
+        default=1536,
+    )
+    parser.add_argument(
+        "--azure-openai-api-version",
+        type=str,
+        help="Azure OpenAI API version",
+        default="2024-06-01",
+    )
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        help="Number of chunks per embedding request",
+        default=16,
+    )
+    parser.add_argument(
+        "--embedding-concurrency",
+        type=int,
+        help="Embedding requests in flight",
+        default=4,
+    )
+    parser.add_argument(
+        "--embedding-tokens-per-minute",
+        type=int,
+        help="Embedding tokens-per-minute quota to stay under (0 disables)",
+        default=0,
+    )
+    parser.add_argument(
+        "--embedding-cache-path",
+        type=str,
+        help="Local embedding cache file, unchanged chunks are never re-embedded",
+        default=None,
+    )
+    parser.add_argument(
+        "--embedding-cache-max-bytes",
+        type=int,
+        help="Size budget of the embedding cache before LRU eviction",
+        default=1024 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--maximum-page-length",
+        type=int,
+        help="Maximum chunk length in characters (tokens with --chunking-mode tokens)",
+        default=DEFAULT_MAXIMUM_PAGE_LENGTH,
+    )
+    parser.add_argument(
+        "--page-overlap-length",
+        type=int,
+        help="Overlap between consecutive chunks in characters (tokens with --chunking-mode tokens)",
+        default=DEFAULT_PAGE_OVERLAP_LENGTH,
+    )
+    parser.add_argument(
+        "--chunking-mode",
+        choices=CHUNKING_MODES,
+        help="Chunking mode, markdown also fills header_1..header_3 (index needs --use-document-layout)",
+        default="pages",
+    )
+    parser.add_argument(
+        "--embedding-window",
+        type=int,
+        help="Chunks embedded together before their documents are handed to the uploader",
+        default=256,
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Maximum documents per upload batch",
+        default=100,
+    )
+    parser.add_argument(
+        "--max-batch-bytes",
+        type=int,
+        help="Maximum serialized size of an upload batch",
+        default=MAX_BATCH_BYTES,
+    )
+    parser.add_argument(
+        "--concurrent-batches",
+        type=int,
+        help="Number of upload batches in flight",
+        default=4,
+    )
+    parser.add_argument(
+        "--upload-action",
+        choices=["upload", "merge_or_upload"],
+        help="Indexing action used for chunk documents",
+        default="merge_or_upload",
+    )
+    parser.add_argument(
+        "--manifest-path",
+        type=str,
+        help="Fingerprint manifest enabling incremental re-indexing (blob name with --manifest-container)",
+        default=None,
+    )
+    parser.add_argument(
+        "--manifest-container",
+        type=str,
+        help="Store the manifest as a sidecar blob in this container",
+        default=None,
+    )
+    parser.add_argument(
+        "--invalidate-url",
+        nargs="+",
+        help="Cache invalidation endpoints (rag_service.py /invalidate) notified of changed chunk ids",
+        default=None,
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run download, PDF extraction and chunk/embed as concurrent bounded-queue stages",
+        default=False,
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        help="Download threads in pipeline mode",
+        default=8,
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        help="Text extraction processes in pipeline mode (defaults to the number of cores)",
+        default=None,
+    )
+    parser.add_argument(
+        "--embed-workers",
+        type=int,
+        help="Chunk and embed threads in pipeline mode",
+        default=4,
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        help="Documents buffered between pipeline stages",
+        default=8,
+    )
+    parser.add_argument(
+        "--add-page-numbers",
+        action="store_true",
+        help="Add page numbers to the chunk documents",
+        default=False,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    return parser
+
+
+def main():
+    parser = build_parser()
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    if not _args.search_endpoint and not _args.local_index_path:
+        parser.error("either --search-endpoint or --local-index-path is required")
+    if not _args.source_dir and not (_args.storage_account_url and _args.container_name):
+        parser.error("either --source-dir or --storage-account-url and --container-name are required")
+    if not 0 < _args.batch_size <= MAX_BATCH_DOCUMENTS:
+        parser.error(f"--batch-size must be between 1 and {MAX_BATCH_DOCUMENTS}")
+
+    logging.debug("Search endpoint %s", _args.search_endpoint)
+    logging.debug("Index name %s", _args.index_name)
+    logging.debug("Source dir %s", _args.source_dir)
+    logging.debug("Batch size %s", _args.batch_size)
+    logging.debug("Concurrent batches %s", _args.concurrent_batches)
+
+    print(json.dumps(ingest(_args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from local_index import LocalIndex
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+# Mirror the index.py options: narrow float types and int8 (scalar) / 1-bit (binary) quantization
+VECTOR_OPTIONS = ("float32", "float16", "int8", "binary")
+DEFAULT_OPTIONS = ("float32", "float16", "int8", "binary", "int8@512", "binary@512")
+
+_POPCOUNT = np.array([bin(_byte).count("1") for _byte in range(256)], dtype=np.uint8)
+
+
+def parse_option(option: str):
+    """``"int8@512"`` -> ``("int8", 512)``, ``"float16"`` -> ``("float16", None)``."""
+    _kind, _, _truncation = option.partition("@")
+    if _kind not in VECTOR_OPTIONS:
+        raise ValueError(f"Unknown vector option {_kind}, expected one of {VECTOR_OPTIONS}")
+    return _kind, int(_truncation) if _truncation else None
+
+
+def hold_out(count: int, size: int, random) -> tuple:
+    """(held-out, kept) positions of ``size`` query vectors sampled from ``count``, at most half of them.
+
+    Held-out vectors serve as queries and are left out of the corpus, so a
+    chunk never finds itself.
+    """
+    _held_out = random.choice(count, size=min(size, count // 2), replace=False)
+    return _held_out, np.setdiff1d(np.arange(count), _held_out)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    _vectors = np.asarray(vectors, dtype=np.float32)
+    return _vectors / np.maximum(np.linalg.norm(_vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class QuantizedVectors:
+    """Corpus vectors stored the way one index option stores them, scored against float queries.
+
+    ``int8`` uses per-dimension min/max scalar quantization, ``binary`` keeps
+    the sign bit of every dimension and ranks by Hamming distance. With a
+    truncation the leading dimensions are kept and re-normalized, which only
+    preserves ranking for Matryoshka models such as text-embedding-3.
+
+    Args:
+        vectors (np.ndarray): full-precision corpus vectors, one row per chunk
+        kind (str): one of ``VECTOR_OPTIONS``
+        truncation (int): dimensions to keep, ``None`` for all
+    """
+
+    def __init__(self, vectors: np.ndarray, kind: str, truncation: int = None):
+        self.kind = kind
+        self.truncation = truncation
+        _vectors = _normalize(vectors[:, :truncation] if truncation else vectors)
+        self.dimensions = _vectors.shape[1]
+        self.minimum = None
+        self.scale = None
+        if kind == "float32":
+            self.codes = _vectors
+        elif kind == "float16":
+            self.codes = _vectors.astype(np.float16)
+        elif kind == "int8":
+            self.minimum = _vectors.min(axis=0)
+            _range = _vectors.max(axis=0) - self.minimum
+            self.scale = np.where(_range > 0, _range / 255, 1.0).astype(np.float32)
+            self.codes = (np.round((_vectors - self.minimum) / self.scale) - 128).astype(np.int8)
+        elif kind == "binary":
+            self.codes = np.packbits(_vectors > 0, axis=1)
+        else:
+            raise ValueError(f"Unknown vector option {kind}, expected one of {VECTOR_OPTIONS}")
+
+    @property
+    def nbytes(self) -> int:
+        _nbytes = self.codes.nbytes
+        if self.scale is not None:
+            _nbytes += self.scale.nbytes + self.minimum.nbytes
+        return _nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Similarity of every corpus vector to ``query``, higher is closer."""
+        _query = _normalize(query[: self.truncation] if self.truncation else query)
+        if self.kind == "binary":
+            _bits = np.packbits(_query > 0)
+            return -_POPCOUNT[np.bitwise_xor(self.codes, _bits)].sum(axis=1, dtype=np.int32)
+        if self.kind == "int8":
+            return (self.codes.astype(np.float32) + 128) @ (_query * self.scale) + float(self.minimum @ _query)
+        return self.codes.astype(np.float32, copy=False) @ _query
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        """Row ids of the ``k`` best corpus vectors, best first."""
+        _scores = self.scores(query)
+        _k = min(k, len(_scores))
+        _top = np.argpartition(-_scores, _k - 1)[:_k]
+        return _top[np.argsort(-_scores[_top], kind="stable")]
+
+
+def recall(found, expected) -> float:
+    return len(set(found.tolist()) & set(expected.tolist())) / max(len(expected), 1)
+
+
+class QuantizationBenchmark:
+    """Compares vector storage options on a local index built by ``push_indexer.py --local-index-path``.
+
+    For each option it reports the vector index size, recall@k of the
+    compressed search and of the search rescored with the originals
+    (``k * oversampling`` candidates), both against exact float32 search,
+    and per-query latency. Latencies are NumPy brute force on one host,
+    useful for comparing options rather than predicting service latency.
+    """
+
+    def __init__(self, args):
+        self.args = args
+
+    def load(self):
+        """Corpus and query vectors as normalized float32 matrices."""
+        _args = self.args
+        _index = LocalIndex(_args.local_index_path)
+        try:
+            _rows = np.array(sorted(_index.keys), dtype=np.int64)
+            _vectors = np.asarray(_index.vectors[_rows], dtype=np.float32)
+        finally:
+            _index.close()
+        _random = np.random.default_rng(_args.seed)
+        if _args.azure_openai_endpoint:
+            from async_embedder import EmbeddingEngine
+            from benchmark import file_queries, synthetic_queries
+
+            _texts = file_queries(_args.queries_file) if _args.queries_file else []
+            if _args.source_dir:
+                _texts += synthetic_queries(_args.source_dir, _args.sample_queries, seed=_args.seed)
+            if not _texts:
+                raise ValueError("Embedding queries needs --queries-file or --source-dir")
+            _engine = EmbeddingEngine(
+                endpoint=_args.azure_openai_endpoint,
+                deployment=_args.azure_openai_embedding_deployment,
+                dimensions=_vectors.shape[1],
+            )
+            try:
+                _queries = np.asarray(_engine.embed(_texts), dtype=np.float32)
+            finally:
+                _engine.close()
+        else:
+            _held_out, _kept = hold_out(len(_vectors), _args.sample_queries, _random)
+            _queries = _vectors[_held_out]
+            _vectors = _vectors[_kept]
+        return _normalize(_vectors), _normalize(_queries)
+
+    def run(self):
+        _args = self.args
+        _vectors, _queries = self.load()
+        _k = _args.k
+        _exact = QuantizedVectors(_vectors, "float32")
+        _expected = [_exact.search(_query, _k) for _query in _queries]
+        _full_bytes = _exact.nbytes
+        _results = {
+            "documents": len(_vectors),
+            "queries": len(_queries),
+            "dimensions": _vectors.shape[1],
+            "k": _k,
+            "oversampling": _args.oversampling,
+            "options": {},
+        }
+        for _option in _args.options:
+            _kind, _truncation = parse_option(_option)
+            if _truncation and _truncation >= _vectors.shape[1]:
+                _logger.warning("Skipping %s, truncation is not below %s dimensions", _option, _vectors.shape[1])
+                continue
+            _quantized = QuantizedVectors(_vectors, _kind, _truncation)
+            _compressed = _kind in ("int8", "binary") or bool(_truncation)
+            _candidates = int(np.ceil(_k * _args.oversampling)) if _compressed else _k
+            _recorder = LatencyRecorder()
+            _recall = []
+            _rescored_recall = []
+            for _query, _expected_rows in zip(_queries, _expected):
+                _started = time.perf_counter()
+                _rows = _quantized.search(_query, _candidates)
+                _recorder.record("search", time.perf_counter() - _started)
+                _recall.append(recall(_rows[:_k], _expected_rows))
+                if _compressed:
+                    _started = time.perf_counter()
+                    _rescored = _rows[np.argsort(-(_vectors[_rows] @ _query), kind="stable")[:_k]]
+                    _recorder.record("rescore", time.perf_counter() - _started)
+                    _rescored_recall.append(recall(_rescored, _expected_rows))
+            _summary = _recorder.summary()
+            _results["options"][_option] = {
+                "vector_index_bytes": _quantized.nbytes,
+                # Rescoring keeps the float32 originals next to the compressed vectors
+                "storage_bytes": _quantized.nbytes + (_full_bytes if _compressed else 0),
+                "compression_ratio": round(_full_bytes / _quantized.nbytes, 2),
+                f"recall@{_k}": round(float(np.mean(_recall)), 4),
+                f"rescored_recall@{_k}": round(float(np.mean(_rescored_recall)), 4) if _compressed else None,
+                "latency": _summary,
+            }
+            logging.info(
+                "%s: %.1f KiB, recall@%s %.3f, p50 %.2f ms",
+                _option,
+                _quantized.nbytes / 1024,
+                _k,
+                np.mean(_rescored_recall or _recall),
+                _summary["search"]["p50_ms"],
+            )
+        return _results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--local-index-path",
+        type=str,
+        help="Local index built by push_indexer.py --local-index-path",
+        required=True,
+    )
+    parser.add_argument(
+        "--options",
+        nargs="+",
+        help="Vector options to compare: float32, float16, int8, binary, with an optional @dimensions truncation",
+        default=list(DEFAULT_OPTIONS),
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        help="Neighbors per query",
+        default=10,
+    )
+    parser.add_argument(
+        "--oversampling",
+        type=float,
+        help="Candidates per neighbor fetched from compressed vectors before rescoring",
+        default=4.0,
+    )
+    parser.add_argument(
+        "--sample-queries",
+        type=int,
+        help="Number of queries, held-out chunks unless --azure-openai-endpoint is given",
+        default=100,
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Embed real queries instead of sampling chunks",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--source-dir",
+        type=str,
+        help="Documents to sample synthetic queries from",
+        default=None,
+    )
+    parser.add_argument(
+        "--queries-file",
+        type=str,
+        help="Queries, one per line or JSON lines with a query field",
+        default=None,
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Query sampling seed",
+        default=0,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    for _option in _args.options:
+        try:
+            parse_option(_option)
+        except ValueError as e:
+            parser.error(str(e))
+
+    _results = QuantizationBenchmark(_args).run()
+    print(json.dumps(_results, indent=2))
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_results, _file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
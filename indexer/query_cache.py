@@ -0,0 +1,273 @@
+import json
+import logging
+import threading
+import time
+import urllib.request
+import weakref
+from collections import OrderedDict
+
+from embedding_cache import EmbeddingCache, cache_key, normalize_text
+
+
+_logger = logging.getLogger(__name__)
+
+# Result caches living in this process, invalidated by ingestion upserts
+_result_caches = weakref.WeakSet()
+
+
+def register_result_cache(cache):
+    """Have :func:`invalidate_chunks` reach ``cache``, which must implement ``invalidate(chunk_ids)``."""
+    _result_caches.add(cache)
+
+
+def invalidate_chunks(chunk_ids):
+    """Invalidate cached results containing any of ``chunk_ids`` in every result cache."""
+    _chunk_ids = set(chunk_ids)
+    if not _chunk_ids:
+        return 0
+    return sum(_cache.invalidate(_chunk_ids) for _cache in list(_result_caches))
+
+
+def notify_invalidations(urls, chunk_ids, batch_size: int = 5000, timeout: float = 10.0) -> int:
+    """POST changed ``chunk_ids`` to the ``/invalidate`` endpoint of services caching in other processes.
+
+    Failures are logged, not raised: entries of an unreachable service still
+    expire with their TTL. Returns the number of entries invalidated.
+    """
+    _chunk_ids = sorted(set(chunk_ids))
+    _invalidated = 0
+    for _url in urls or ():
+        for _start in range(0, len(_chunk_ids), batch_size):
+            _request = urllib.request.Request(
+                _url,
+                data=json.dumps({"chunk_ids": _chunk_ids[_start : _start + batch_size]}).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(_request, timeout=timeout) as _response:
+                    _invalidated += json.loads(_response.read() or b"{}").get("invalidated", 0)
+            except (OSError, ValueError) as e:
+                _logger.warning("Could not invalidate cached results at %s: %s", _url, e)
+                break
+    return _invalidated
+
+
+class QueryEmbeddingCache:
+    """Two-level cache of query embeddings: an in-process LRU over an optional disk store.
+
+    Queries are keyed by model, dimensions and case-folded normalized text, so
+    "What is PerksPlus?" and "what is  perksplus?" share one embedding.
+
+    Args:
+        model_name (str): embedding model name
+        dimensions (int): embedding dimensions
+        max_entries (int): in-process LRU size
+        disk_path (str): optional :class:`EmbeddingCache` file for the second level
+    """
+
+    def __init__(self, model_name: str, dimensions: int = None, max_entries: int = 4096, disk_path: str = None):
+        self.model_name = model_name
+        self.dimensions = dimensions or 0
+        self.max_entries = max_entries
+        self.disk = EmbeddingCache(disk_path) if disk_path else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._miss_seconds = 0.0
+
+    def _key(self, text: str) -> str:
+        return cache_key(self.model_name, self.dimensions, normalize_text(text).casefold())
+
+    def _remember(self, key: str, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, key: str):
+        with self._lock:
+            _vector = self._memory.get(key)
+            if _vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return _vector
+        if self.disk is not None:
+            _vector = self.disk.get_many([key]).get(key)
+            if _vector is not None:
+                self.disk_hits += 1
+                self._remember(key, _vector)
+                return _vector
+        return None
+
+    def _store(self, key: str, vector, seconds: float):
+        self._miss_seconds += seconds
+        self.misses += 1
+        self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.put_many({key: vector})
+
+    def get_or_embed(self, text: str, embed):
+        """Return the embedding of ``text``, calling ``embed(text)`` only on a miss."""
+        _key = self._key(text)
+        _vector = self._lookup(_key)
+        if _vector is not None:
+            return _vector
+        _started = time.perf_counter()
+        _vector = embed(text)
+        self._store(_key, _vector, time.perf_counter() - _started)
+        return _vector
+
+    async def get_or_embed_async(self, text: str, embed):
+        """:meth:`get_or_embed` for a coroutine function ``embed``."""
+        _key = self._key(text)
+        _vector = self._lookup(_key)
+        if _vector is not None:
+            return _vector
+        _started = time.perf_counter()
+        _vector = await embed(text)
+        self._store(_key, _vector, time.perf_counter() - _started)
+        return _vector
+
+    def stats(self):
+        _hits = self.memory_hits + self.disk_hits
+        _lookups = _hits + self.misses
+        _average_miss = self._miss_seconds / self.misses if self.misses else 0.0
+        return {
+            "entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(_hits / _lookups, 4) if _lookups else 0.0,
+            "avg_embed_ms": round(_average_miss * 1000, 2),
+            "saved_ms": round(_hits * _average_miss * 1000, 2),
+        }
+
+
+class SearchResultCache:
+    """Short-TTL cache of search results keyed by every parameter that shapes them.
+
+    Each entry remembers the ``chunk_id`` values it returned, so an ingestion
+    upsert of any of those chunks (see :func:`invalidate_chunks`) drops it.
+    A chunk id no entry returned may be a new chunk that now ranks into any
+    cached result, so it clears the whole cache.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_chunk = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self._miss_seconds = 0.0
+        register_result_cache(self)
+
+    @staticmethod
+    def make_key(query, filter=None, top=None, k=None, query_type=None, semantic_configuration_name=None, **extra):
+        return json.dumps(
+            [
+                normalize_text(query or "").casefold(),
+                filter,
+                top,
+                k,
+                str(query_type) if query_type else None,
+                semantic_configuration_name,
+                sorted((_name, str(_value)) for _name, _value in extra.items()),
+            ]
+        )
+
+    def _drop(self, key: str):
+        _expires, _results, _chunk_ids = self._entries.pop(key)
+        for _chunk_id in _chunk_ids:
+            _keys = self._by_chunk.get(_chunk_id)
+            if _keys is not None:
+                _keys.discard(key)
+                if not _keys:
+                    del self._by_chunk[_chunk_id]
+
+    def get(self, key: str):
+        with self._lock:
+            _entry = self._entries.get(key)
+            if _entry is None:
+                self.misses += 1
+                return None
+            if _entry[0] < time.monotonic():
+                self._drop(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return _entry[1]
+
+    def put(self, key: str, results: list):
+        _chunk_ids = {_result.get("chunk_id") for _result in results if _result.get("chunk_id")}
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, results, _chunk_ids)
+            for _chunk_id in _chunk_ids:
+                self._by_chunk.setdefault(_chunk_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def get_or_search(self, key: str, search):
+        """Return cached results for ``key`` or run ``search()`` and cache a list of its results."""
+        _results = self.get(key)
+        if _results is not None:
+            return _results
+        _started = time.perf_counter()
+        _results = [dict(_result) for _result in search()]
+        self._miss_seconds += time.perf_counter() - _started
+        self.put(key, _results)
+        return _results
+
+    async def get_or_search_async(self, key: str, search):
+        """:meth:`get_or_search` for a coroutine function ``search``."""
+        _results = self.get(key)
+        if _results is not None:
+            return _results
+        _started = time.perf_counter()
+        _results = [dict(_result) for _result in await search()]
+        self._miss_seconds += time.perf_counter() - _started
+        self.put(key, _results)
+        return _results
+
+    def invalidate(self, chunk_ids) -> int:
+        with self._lock:
+            _keys = set()
+            for _chunk_id in chunk_ids:
+                if _chunk_id not in self._by_chunk:
+                    _keys = set(self._entries)
+                    break
+                _keys.update(self._by_chunk[_chunk_id])
+            for _key in _keys:
+                self._drop(_key)
+            self.invalidated += len(_keys)
+        return len(_keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunk.clear()
+
+    def stats(self):
+        _lookups = self.hits + self.misses
+        _average_miss = self._miss_seconds / self.misses if self.misses else 0.0
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / _lookups, 4) if _lookups else 0.0,
+            "avg_search_ms": round(_average_miss * 1000, 2),
+            "saved_ms": round(self.hits * _average_miss * 1000, 2),
+        }
@@ -0,0 +1,200 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+PLAN_MODES = ("auto", "exhaustive", "ann")
+# Facetable fields of the index schema, chunk_id is unique per document and useless as a facet
+FACET_FIELDS = ("parent_id", "title", "blob_path", "source_address")
+
+QueryPlan = namedtuple("QueryPlan", ["exhaustive", "reason", "candidates", "documents", "selectivity"])
+
+_OUTSIDE_QUOTES = r"(?=(?:[^']*'[^']*')*[^']*$)"
+_AND_PATTERN = re.compile(rf"\s+and\s+{_OUTSIDE_QUOTES}", re.IGNORECASE)
+_OR_PATTERN = re.compile(rf"\s+or\s+{_OUTSIDE_QUOTES}", re.IGNORECASE)
+_EQ_PATTERN = re.compile(r"^\s*(\w+)\s+eq\s+'((?:[^']|'')*)'\s*$", re.IGNORECASE)
+_SEARCH_IN_PATTERN = re.compile(
+    r"^\s*search\.in\(\s*(\w+)\s*,\s*'((?:[^']|'')*)'\s*(?:,\s*'([^']*)'\s*)?\)\s*$", re.IGNORECASE
+)
+
+
+class QueryPlanner:
+    """Chooses exhaustive KNN or HNSW (ANN) for each vector query from index statistics.
+
+    A query is planned exhaustive when the documents passing its filter are at
+    most ``exhaustive_threshold``, or at most ``selectivity_threshold`` of the
+    index. Small sets scan quickly, and a filtered HNSW walk over a tiny subset
+    can miss neighbors. Everything else uses ANN. Filters made of ``eq`` and
+    ``search.in`` on facetable fields are estimated from cached facet counts
+    (``and`` takes the smallest term, ``or`` sums them). Other filters cost one
+    count query, which is also cached.
+
+    Args:
+        search_client: ``SearchClient`` or ``LocalSearchClient``
+        mode (str): ``auto``, or ``exhaustive`` / ``ann`` to force every plan
+        exhaustive_threshold (int): candidate count at or below which to scan
+        selectivity_threshold (float): filtered fraction of the index at or below which to scan
+        facet_fields (tuple): facetable fields used for estimates
+        max_facet_values (int): facet buckets requested per field
+        stats_ttl (float): seconds before counts and facets are refreshed
+        plan_log (str): optional JSON lines file receiving every plan and its latency
+    """
+
+    def __init__(
+        self,
+        search_client,
+        mode: str = "auto",
+        exhaustive_threshold: int = 5000,
+        selectivity_threshold: float = 0.01,
+        facet_fields: tuple = FACET_FIELDS,
+        max_facet_values: int = 1000,
+        stats_ttl: float = 300.0,
+        plan_log: str = None,
+    ):
+        if mode not in PLAN_MODES:
+            raise ValueError(f"Unknown plan mode {mode}, expected one of {PLAN_MODES}")
+        self.search_client = search_client
+        self.mode = mode
+        self.exhaustive_threshold = exhaustive_threshold
+        self.selectivity_threshold = selectivity_threshold
+        self.facet_fields = facet_fields
+        self.max_facet_values = max_facet_values
+        self.stats_ttl = stats_ttl
+        self.plan_log = plan_log
+        self.recorder = LatencyRecorder()
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        _now = time.monotonic()
+        with self._lock:
+            _entry = self._cache.get(key)
+            if _entry is not None and _now - _entry[0] < self.stats_ttl:
+                return _entry[1]
+        _value = compute()
+        with self._lock:
+            self._cache[key] = (_now, _value)
+        return _value
+
+    def document_count(self) -> int:
+        return self._cached(("documents",), self.search_client.get_document_count)
+
+    def facets(self) -> dict:
+        """{field: {value: count}} over the whole index."""
+
+        def _facets():
+            _results = self.search_client.search(
+                search_text="*",
+                facets=[f"{_field},count:{self.max_facet_values}" for _field in self.facet_fields],
+                top=0,
+            )
+            _facets = _results.get_facets() or {}
+            return {
+                _field: {_bucket["value"]: _bucket["count"] for _bucket in _facets.get(_field, [])}
+                for _field in self.facet_fields
+            }
+
+        return self._cached(("facets",), _facets)
+
+    def count(self, filter: str) -> int:
+        """Exact number of documents passing ``filter``."""
+        return self._cached(
+            ("count", filter),
+            lambda: self.search_client.search(
+                search_text="*", filter=filter, top=0, include_total_count=True
+            ).get_count(),
+        )
+
+    def _facet_estimate(self, filter: str):
+        """Candidate count of ``filter`` from facet counts, ``None`` when facets cannot answer it."""
+        _facets = self.facets()
+        _or_terms = _OR_PATTERN.split(filter)
+        if len(_or_terms) > 1:
+            _counts = [self._facet_estimate(_term) for _term in _or_terms]
+            return None if None in _counts else sum(_counts)
+        _and_terms = _AND_PATTERN.split(filter)
+        if len(_and_terms) > 1:
+            _counts = [self._facet_estimate(_term) for _term in _and_terms]
+            _known = [_count for _count in _counts if _count is not None]
+            # The smallest term bounds the intersection; unknown terms only shrink it further
+            return min(_known) if _known else None
+        _match = _EQ_PATTERN.match(filter)
+        if _match:
+            _field, _values = _match.group(1), [_match.group(2).replace("''", "'")]
+        else:
+            _match = _SEARCH_IN_PATTERN.match(filter)
+            if not _match:
+                return None
+            _delimiters = _match.group(3) or " ,"
+            _split = "|".join(re.escape(_char) for _char in _delimiters)
+            _field, _values = _match.group(1), [_value for _value in re.split(_split, _match.group(2)) if _value]
+        _buckets = _facets.get(_field)
+        if _buckets is None:
+            return None
+        if len(_buckets) >= self.max_facet_values and any(_value not in _buckets for _value in _values):
+            # Truncated facet list, a missing value may just be past the limit
+            return None
+        return sum(_buckets.get(_value, 0) for _value in _values)
+
+    def estimate(self, filter: str = None):
+        """(candidates, source) for ``filter``, where source is ``index``, ``facets`` or ``count``."""
+        if not filter or not filter.strip():
+            return self.document_count(), "index"
+        if "(" not in filter.replace("search.in(", ""):
+            _estimate = self._facet_estimate(filter)
+            if _estimate is not None:
+                return _estimate, "facets"
+        return self.count(filter), "count"
+
+    def plan(self, filter: str = None, mode: str = None) -> QueryPlan:
+        """Plan one vector query, ``mode`` overrides the planner's mode for this query."""
+        _mode = mode or self.mode
+        if _mode not in PLAN_MODES:
+            raise ValueError(f"Unknown plan mode {_mode}, expected one of {PLAN_MODES}")
+        _documents = self.document_count()
+        if _mode != "auto":
+            return QueryPlan(_mode == "exhaustive", "forced", None, _documents, None)
+        _candidates, _source = self.estimate(filter)
+        _selectivity = _candidates / _documents if _documents else 0.0
+        if _candidates <= self.exhaustive_threshold:
+            return QueryPlan(True, f"small candidate set ({_source})", _candidates, _documents, _selectivity)
+        if _selectivity <= self.selectivity_threshold:
+            return QueryPlan(True, f"selective filter ({_source})", _candidates, _documents, _selectivity)
+        return QueryPlan(False, f"large candidate set ({_source})", _candidates, _documents, _selectivity)
+
+    def record(self, plan: QueryPlan, seconds: float, query: str = None, filter: str = None):
+        """Log a planned query's latency, for tuning the thresholds."""
+        _algorithm = "exhaustive" if plan.exhaustive else "ann"
+        self.recorder.record(_algorithm, seconds)
+        _logger.info(
+            "Plan %s (%s): %s of %s candidates, %.1f ms",
+            _algorithm,
+            plan.reason,
+            plan.candidates,
+            plan.documents,
+            seconds * 1000,
+        )
+        if self.plan_log:
+            _entry = {
+                "time": time.time(),
+                "query": query,
+                "filter": filter,
+                "algorithm": _algorithm,
+                "reason": plan.reason,
+                "candidates": plan.candidates,
+                "documents": plan.documents,
+                "selectivity": plan.selectivity,
+                "latency_ms": round(seconds * 1000, 3),
+            }
+            with self._lock, open(self.plan_log, "a", encoding="utf-8") as _file:
+                _file.write(json.dumps(_entry) + "\n")
+
+    def stats(self):
+        return self.recorder.summary()
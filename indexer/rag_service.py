@@ -0,0 +1,777 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiohttp import web
+from openai import AsyncAzureOpenAI
+from azure.search.documents.models import VectorizedQuery
+
+from async_embedder import AsyncEmbeddingClient, TokenCounter
+from clients import get_factory
+from context_builder import ContextBuilder
+from embedding_cache import normalize_text
+from filters import FILTER_MODES, choose_filter_mode, filter_from_dict, post_filter_k
+from metrics import LatencyRecorder
+from query_cache import QueryEmbeddingCache, SearchResultCache, invalidate_chunks
+from query_planner import PLAN_MODES, QueryPlanner
+from semantic_cache import COMPLETION_TOKEN_PRICE, PROMPT_TOKEN_PRICE, SemanticAnswerCache
+from streaming import CitationExtractor, StreamRecorder, StreamStats
+
+
+_logger = logging.getLogger(__name__)
+
+SYSTEM_MESSAGE = """
+Assistant helps company employees questions about the employee handbook. Be brief in your answers.
+Answer ONLY with the facts listed in the list of sources below.
+If there isn't enough information below, say you don't know. Do not generate answers that don't use the sources below.
+Each source has a name followed by colon and the actual information, include the source name for each fact you use.
+Use square brackets to reference the source, for example [info1.txt].
+"""
+
+
+class StageTimeout(Exception):
+    """A pipeline stage exceeded its timeout."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timed out after {timeout}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class RequestCoalescer:
+    """Run one computation per key and share its result with identical in-flight requests.
+
+    The shared task is shielded, so a caller that disconnects does not cancel
+    the work other callers are waiting on.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        _task = self._inflight.get(key)
+        if _task is None:
+            _task = asyncio.ensure_future(factory())
+            self._inflight[key] = _task
+            _task.add_done_callback(lambda _done, _key=key: self._inflight.pop(_key, None))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(_task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+def build_sources(documents: list) -> str:
+    return "\n\n".join(f"[{_document['title']}]: {_document['chunk']}\n" for _document in documents)
+
+
+def build_messages(question: str, documents: list, sources: str = None) -> list:
+    """Chat messages for ``question``; ``sources`` overrides the plain join of ``documents``."""
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {
+            "role": "user",
+            "content": question + "\nSources: " + (sources if sources is not None else build_sources(documents)),
+        },
+    ]
+
+
+class RagService:
+    """Async retrieval-augmented generation over Azure AI Search and Azure OpenAI.
+
+    Each request runs embed -> hybrid semantic search -> chat completion.
+    An optional ``filters`` object (see :func:`filters.filter_from_dict`)
+    scopes the search to documents, pages or sections.
+    Streamed answers emit ``citation`` events as soon as a ``[title]`` marker
+    completes, and record time-to-first-token, tokens per second and total
+    latency for every request.
+    Answers are cached by query-embedding similarity, so paraphrases of a
+    recent question skip search and generation, repeated questions reuse
+    cached embeddings and search results; ``POST /invalidate`` with changed ``chunk_ids``
+    drops the answers and results built from them.
+    Stages have their own timeouts and latency samples. Identical questions
+    already in flight share one retrieval (and one answer when not streaming).
+    At most ``max_concurrency`` requests run at once; the rest wait up to
+    ``queue_timeout`` seconds and are then rejected with 503.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.semantic_configuration_name = (
+            args.semantic_configuration_name or f"{args.index_name}-semantic-config"
+        )
+        self.metrics = LatencyRecorder()
+        self.coalescer = RequestCoalescer()
+        self.factory = get_factory(args.search_endpoint, pool_maxsize=args.max_concurrency)
+        self.planner = QueryPlanner(
+            self.factory.search_client(args.index_name),
+            mode=args.plan,
+            exhaustive_threshold=args.exhaustive_threshold,
+            selectivity_threshold=args.selectivity_threshold,
+        )
+        self.context_builder = None if args.raw_context else ContextBuilder(max_tokens=args.context_max_tokens)
+        self.token_counter = TokenCounter("o200k_base")
+        self.streams = StreamRecorder(stream_log=args.stream_log)
+        self.answer_cache = SemanticAnswerCache(
+            threshold=args.answer_cache_threshold,
+            ttl_seconds=args.answer_cache_ttl,
+            max_entries=args.answer_cache_size,
+            prompt_token_price=args.prompt_token_price,
+            completion_token_price=args.completion_token_price,
+        )
+        self.result_cache = (
+            SearchResultCache(ttl_seconds=args.result_cache_ttl) if args.result_cache_ttl > 0 else None
+        )
+        self.query_cache = (
+            QueryEmbeddingCache(
+                args.azure_openai_embedding_deployment,
+                args.azure_openai_model_dimensions,
+                max_entries=args.query_cache_size,
+                disk_path=args.query_cache_path,
+            )
+            if args.query_cache_size > 0
+            else None
+        )
+        self.rejected = 0
+        self._semaphore = None
+        self._embedder = None
+        self._chat_client = None
+
+    async def start(self, app=None):
+        _args = self.args
+        self._semaphore = asyncio.Semaphore(_args.max_concurrency)
+        self._embedder = AsyncEmbeddingClient(
+            endpoint=_args.azure_openai_endpoint,
+            deployment=_args.azure_openai_embedding_deployment,
+            dimensions=_args.azure_openai_model_dimensions,
+            api_version=_args.azure_openai_api_version,
+            max_concurrency=_args.max_concurrency,
+        )
+        self._chat_client = AsyncAzureOpenAI(
+            api_version=_args.azure_openai_api_version,
+            azure_endpoint=_args.azure_openai_endpoint,
+            api_key=os.getenv("AZURE_OPENAI_KEY"),
+            max_retries=1,
+        )
+
+    async def stop(self, app=None):
+        await self._embedder.close()
+        await self._chat_client.close()
+        await self.factory.aclose()
+
+    async def _stage(self, stage: str, coroutine, timeout: float):
+        with self.metrics.time(stage):
+            try:
+                return await asyncio.wait_for(coroutine, timeout)
+            except asyncio.TimeoutError:
+                raise StageTimeout(stage, timeout) from None
+
+    async def _search(self, question: str, vector: list, top: int, filter: str = None):
+        _client = self.factory.async_search_client(self.args.index_name)
+        # Every plan runs in a thread: once its statistics expire it queries the index synchronously
+        _plan = await asyncio.to_thread(self.planner.plan, filter)
+        _k = self.args.k_nearest_neighbors
+        _filter_mode = None
+        if filter:
+            _filter_mode = choose_filter_mode(_plan.selectivity, self.args.vector_filter_mode)
+            if _filter_mode == "postFilter":
+                _k = post_filter_k(_k, _plan.selectivity)
+        _started = time.perf_counter()
+        _results = await _client.search(
+            search_text=question,
+            top=top,
+            vector_queries=[
+                VectorizedQuery(
+                    vector=vector,
+                    k_nearest_neighbors=_k,
+                    fields="vector",
+                    exhaustive=_plan.exhaustive,
+                )
+            ],
+            filter=filter,
+            vector_filter_mode=_filter_mode,
+            query_type="semantic",
+            semantic_configuration_name=self.semantic_configuration_name,
+            select=["chunk_id", "parent_id", "title", "chunk"],
+        )
+        _documents = [
+            {
+                "chunk_id": _result["chunk_id"],
+                "parent_id": _result.get("parent_id"),
+                "title": _result["title"],
+                "chunk": _result["chunk"],
+                "score": _result["@search.score"],
+                "reranker_score": _result.get("@search.reranker_score"),
+            }
+            async for _result in _results
+        ]
+        self.planner.record(_plan, time.perf_counter() - _started, question, filter)
+        return _documents
+
+    async def embed(self, question: str) -> list:
+        """Embed ``question``, reusing the embedding of a question with the same normalized text."""
+
+        def _embed(_question: str):
+            return self._stage("embed", self._embedder.embed_query(_question), self.args.embed_timeout)
+
+        if self.query_cache is None:
+            return await _embed(question)
+        return await self.query_cache.get_or_embed_async(question, _embed)
+
+    async def retrieve(self, question: str, top: int, filter: str = None, vector: list = None):
+        """Embed (unless ``vector`` is given) and search, shared between identical in-flight questions."""
+        _args = self.args
+
+        async def _search():
+            _vector = vector if vector is not None else await self.embed(question)
+            return await self._stage("search", self._search(question, _vector, top, filter), _args.search_timeout)
+
+        _normalized = normalize_text(question).casefold()
+
+        async def _retrieve():
+            if self.result_cache is None:
+                return await _search()
+            return await self.result_cache.get_or_search_async(
+                SearchResultCache.make_key(_normalized, filter, top), _search
+            )
+
+        return await self.coalescer.run(("retrieve", _normalized, top, filter), _retrieve)
+
+    def messages(self, question: str, documents: list) -> list:
+        """Chat messages with the sources merged, deduplicated and packed into the token budget."""
+        if self.context_builder is None:
+            return build_messages(question, documents)
+        with self.metrics.time("context"):
+            _context = self.context_builder.build(documents)
+        return build_messages(question, documents, _context.text)
+
+    async def _complete(self, messages: list):
+        """(answer, usage) of a chat completion."""
+        _response = await self._chat_client.chat.completions.create(
+            model=self.args.azure_openai_chat_deployment,
+            temperature=self.args.temperature,
+            messages=messages,
+        )
+        return _response.choices[0].message.content, _response.usage
+
+    def cached_answer(self, vector: list, top: int, filter: str = None):
+        """A cached answer to a question similar to the one embedded as ``vector``, or ``None``."""
+        _hit = self.answer_cache.get(vector, (top, filter))
+        if _hit is None:
+            return None
+        _answer, _similarity = _hit
+        return {**_answer, "cached": True, "similarity": _similarity}
+
+    def cache_answer(
+        self,
+        vector: list,
+        answer: dict,
+        top: int,
+        filter: str,
+        seconds: float,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ):
+        """Cache ``answer``; ``seconds`` and the tokens are what a later hit saves.
+
+        Answers without sources are not cached: with no chunk ids to
+        invalidate them, a later ingestion could never replace them.
+        """
+        _chunk_ids = [_source.get("chunk_id") for _source in answer["sources"] if _source.get("chunk_id")]
+        if not answer.get("answer") or not _chunk_ids:
+            return
+        self.answer_cache.put(
+            vector,
+            answer,
+            _chunk_ids,
+            (top, filter),
+            seconds,
+            self.answer_cache.cost(prompt_tokens, completion_tokens),
+        )
+
+    async def answer(self, question: str, top: int, filter: str = None):
+        async def _answer():
+            _vector = await self.embed(question)
+            _cached = self.cached_answer(_vector, top, filter)
+            if _cached is not None:
+                return _cached
+            _started = time.perf_counter()
+            _documents = await self.retrieve(question, top, filter, _vector)
+            _answer, _usage = await self._stage(
+                "generate", self._complete(self.messages(question, _documents)), self.args.generate_timeout
+            )
+            _extractor = CitationExtractor(_documents)
+            _extractor.feed(_answer)
+            _result = {"answer": _answer, "sources": _documents, "citations": _extractor.citations}
+            self.cache_answer(
+                _vector,
+                _result,
+                top,
+                filter,
+                time.perf_counter() - _started,
+                _usage.prompt_tokens if _usage else 0,
+                _usage.completion_tokens if _usage else 0,
+            )
+            return {**_result, "cached": False}
+
+        return await self.coalescer.run(("answer", normalize_text(question).casefold(), top, filter), _answer)
+
+    async def stream_answer(self, question: str, documents: list, stats: StreamStats = None):
+        """Yield answer text deltas; ``generate`` covers the whole stream, ``first_token`` the wait for the first delta.
+
+        ``stats`` receives the generation start and every delta.
+        """
+        _started = time.perf_counter()
+        _first = True
+        _error = False
+        try:
+            async with asyncio.timeout(self.args.generate_timeout):
+                _messages = self.messages(question, documents)
+                if stats is not None:
+                    stats.start_generation(
+                        sum(self.token_counter.count(_message["content"]) for _message in _messages)
+                    )
+                _stream = await self._chat_client.chat.completions.create(
+                    model=self.args.azure_openai_chat_deployment,
+                    temperature=self.args.temperature,
+                    messages=_messages,
+                    stream=True,
+                )
+                async for _chunk in _stream:
+                    if not _chunk.choices or not _chunk.choices[0].delta.content:
+                        continue
+                    if _first:
+                        self.metrics.record("first_token", time.perf_counter() - _started)
+                        _first = False
+                    if stats is not None:
+                        stats.add(_chunk.choices[0].delta.content)
+                    yield _chunk.choices[0].delta.content
+        except TimeoutError:
+            _error = True
+            raise StageTimeout("generate", self.args.generate_timeout) from None
+        except BaseException:
+            _error = True
+            raise
+        finally:
+            self.metrics.record("generate", time.perf_counter() - _started, error=_error)
+
+    async def _admit(self):
+        """Wait for a concurrency slot, recording the wait as the ``queue`` stage."""
+        _started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.args.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            self.metrics.record("queue", time.perf_counter() - _started, error=True)
+            return False
+        self.metrics.record("queue", time.perf_counter() - _started)
+        return True
+
+    async def handle_ask(self, request: web.Request):
+        try:
+            _body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": "Request body must be JSON"}, status=400)
+        _question = (_body.get("question") or "").strip()
+        if not _question:
+            return web.json_response({"error": "question is required"}, status=400)
+        try:
+            _top = int(_body.get("top") or self.args.top)
+        except (ValueError, TypeError):
+            _top = 0
+        if _top <= 0:
+            return web.json_response({"error": "top must be a positive integer"}, status=400)
+        _stream = bool(_body.get("stream"))
+        try:
+            _filter = filter_from_dict(_body.get("filters"))
+        except (ValueError, TypeError, AttributeError) as e:
+            return web.json_response({"error": f"Invalid filters: {e}"}, status=400)
+
+        if not await self._admit():
+            return web.json_response({"error": "Too many concurrent requests"}, status=503)
+        _started = time.perf_counter()
+        _error = True
+        try:
+            if _stream:
+                _response, _error = await self._handle_stream(request, _question, _top, _filter, _started)
+            else:
+                _result = await self.answer(_question, _top, _filter)
+                _response = web.json_response(_result)
+                _error = False
+            return _response
+        except StageTimeout as e:
+            _logger.warning("%s", e)
+            return web.json_response({"error": str(e), "stage": e.stage}, status=504)
+        except Exception as e:
+            _logger.exception("Request failed")
+            return web.json_response({"error": str(e)}, status=502)
+        finally:
+            self._semaphore.release()
+            self.metrics.record("total", time.perf_counter() - _started, error=_error)
+
+    async def _handle_stream(
+        self, request: web.Request, question: str, top: int, filter: str = None, started: float = None
+    ):
+        """Answer as server-sent events, returns the response and whether the request failed.
+
+        Errors before the headers are sent raise, so :meth:`handle_ask` can
+        answer with a status code. Later ones are reported in-band as an
+        ``error`` event, since the status line is already on the wire.
+        """
+        _stats = StreamStats(self.token_counter, started)
+        _cached = None
+        _error = True
+        _response = None
+        try:
+            _vector = await self.embed(question)
+            _cached = self.cached_answer(_vector, top, filter)
+            _searched = time.perf_counter()
+            _documents = _cached["sources"] if _cached else await self.retrieve(question, top, filter, _vector)
+            _stats.mark_retrieved()
+            _response = web.StreamResponse(
+                headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+            )
+            await _response.prepare(request)
+
+            async def _event(payload: dict):
+                await _response.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            await _event({"type": "sources", "sources": _documents})
+            if _cached:
+                # Replay the cached answer as one token so clients need no special case
+                _stats.add(_cached["answer"])
+                await _event({"type": "token", "content": _cached["answer"]})
+                for _citation in _cached["citations"]:
+                    await _event({"type": "citation", **_citation})
+                _error = False
+                await _event(
+                    {
+                        "type": "done",
+                        "citations": _cached["citations"],
+                        "cached": True,
+                        "similarity": _cached["similarity"],
+                    }
+                )
+                await _response.write_eof()
+                return _response, False
+            _extractor = CitationExtractor(_documents)
+            async for _delta in self.stream_answer(question, _documents, _stats):
+                await _event({"type": "token", "content": _delta})
+                for _citation in _extractor.feed(_delta):
+                    await _event({"type": "citation", **_citation})
+            _error = False
+            _stats.finish(error=False)
+            self.streams.record(_stats.summary(), question)
+            _summary = _stats.summary()
+            self.cache_answer(
+                _vector,
+                {"answer": _stats.text, "sources": _documents, "citations": _extractor.citations},
+                top,
+                filter,
+                _stats.finished - _searched,
+                _summary["prompt_tokens"],
+                _summary["completion_tokens"],
+            )
+            await _event({"type": "done", "citations": _extractor.citations, "cached": False, "metrics": _summary})
+            await _response.write_eof()
+            return _response, False
+        except Exception as e:
+            if _response is None or not _response.prepared:
+                raise
+            # Headers are already sent, report the failure in-band
+            if isinstance(e, StageTimeout):
+                _logger.warning("%s", e)
+                _payload = {"type": "error", "error": str(e), "stage": e.stage}
+            else:
+                _logger.exception("Stream failed")
+                _payload = {"type": "error", "error": str(e)}
+            try:
+                await _response.write(f"data: {json.dumps(_payload)}\n\n".encode("utf-8"))
+                await _response.write_eof()
+            except ConnectionError:
+                _logger.warning("Client went away before the error event")
+            return _response, True
+        finally:
+            if _stats.finished is None:
+                _stats.finish(error=_error)
+                if not _cached:
+                    self.streams.record(_stats.summary(), question)
+
+    async def handle_metrics(self, request: web.Request):
+        return web.json_response(
+            {
+                "stages": self.metrics.summary(),
+                "coalescing": self.coalescer.stats(),
+                "rejected": self.rejected,
+                "embedding": self._embedder.stats(),
+                "plans": self.planner.stats(),
+                "context": self.context_builder.stats() if self.context_builder is not None else None,
+                "streams": self.streams.summary(),
+                "answer_cache": self.answer_cache.stats(),
+                "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+                "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            }
+        )
+
+    async def handle_invalidate(self, request: web.Request):
+        """Drop cached answers and search results built from any of the posted ``chunk_ids``."""
+        try:
+            _body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": "Request body must be JSON"}, status=400)
+        _chunk_ids = _body.get("chunk_ids")
+        if not isinstance(_chunk_ids, list):
+            return web.json_response({"error": "chunk_ids must be a list"}, status=400)
+        return web.json_response({"invalidated": invalidate_chunks(_chunk_ids)})
+
+    async def handle_health(self, request: web.Request):
+        return web.json_response({"status": "ok"})
+
+    def app(self) -> web.Application:
+        _app = web.Application()
+        _app.add_routes(
+            [
+                web.post("/ask", self.handle_ask),
+                web.post("/invalidate", self.handle_invalidate),
+                web.get("/metrics", self.handle_metrics),
+                web.get("/health", self.handle_health),
+            ]
+        )
+        _app.on_startup.append(self.start)
+        _app.on_cleanup.append(self.stop)
+        return _app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Host to bind",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to bind",
+        default=8080,
+    )
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        required=True,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        required=True,
+    )
+    parser.add_argument(
+        "--semantic-configuration-name",
+        type=str,
+        help="Semantic configuration (defaults to <index-name>-semantic-config)",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint",
+        required=True,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI embedding dimensions",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-chat-deployment",
+        type=str,
+        help="Azure OpenAI chat deployment",
+        default="gpt-4o-mini",
+    )
+    parser.add_argument(
+        "--azure-openai-api-version",
+        type=str,
+        help="Azure OpenAI API version",
+        default="2024-06-01",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Number of sources passed to the model",
+        default=5,
+    )
+    parser.add_argument(
+        "--k-nearest-neighbors",
+        type=int,
+        help="Vector query k",
+        default=50,
+    )
+    parser.add_argument(
+        "--plan",
+        choices=PLAN_MODES,
+        help="Let the planner choose exhaustive KNN or ANN, or force one",
+        default="auto",
+    )
+    parser.add_argument(
+        "--exhaustive-threshold",
+        type=int,
+        help="Scan exhaustively when at most this many documents are candidates",
+        default=5000,
+    )
+    parser.add_argument(
+        "--selectivity-threshold",
+        type=float,
+        help="Scan exhaustively when at most this fraction of the index is a candidate",
+        default=0.01,
+    )
+    parser.add_argument(
+        "--vector-filter-mode",
+        choices=FILTER_MODES,
+        help="Filter before or after the vector search, auto picks from the filter's selectivity",
+        default="auto",
+    )
+    parser.add_argument(
+        "--context-max-tokens",
+        type=int,
+        help="Token budget of the sources in the prompt, 0 for no limit",
+        default=3000,
+    )
+    parser.add_argument(
+        "--raw-context",
+        action="store_true",
+        help="Join every retrieved chunk into the prompt as-is, without merging or packing",
+        default=False,
+    )
+    parser.add_argument(
+        "--stream-log",
+        type=str,
+        help="Append the timings of every streamed answer to this JSON lines file",
+        default=None,
+    )
+    parser.add_argument(
+        "--answer-cache-size",
+        type=int,
+        help="Answers kept by the semantic answer cache, 0 (the default) disables it",
+        default=0,
+    )
+    parser.add_argument(
+        "--answer-cache-threshold",
+        type=float,
+        help=(
+            "Query-embedding cosine similarity at which a cached answer is reused. Questions differing in one "
+            "name, e.g. two plan names, can score above 0.95 with ada-002, so check a threshold against your "
+            "own questions before enabling the cache"
+        ),
+        default=0.95,
+    )
+    parser.add_argument(
+        "--answer-cache-ttl",
+        type=float,
+        help="Seconds a cached answer is reused",
+        default=3600.0,
+    )
+    parser.add_argument(
+        "--result-cache-ttl",
+        type=float,
+        help="Seconds to cache search results, dropped early by POST /invalidate (0 disables)",
+        default=60.0,
+    )
+    parser.add_argument(
+        "--query-cache-size",
+        type=int,
+        help="Question embeddings kept in memory, keyed by normalized text (0 disables)",
+        default=4096,
+    )
+    parser.add_argument(
+        "--query-cache-path",
+        type=str,
+        help="On-disk store for question embeddings, shared between runs",
+        default=None,
+    )
+    parser.add_argument(
+        "--prompt-token-price",
+        type=float,
+        help="USD per million prompt tokens, for the cost saved by the answer cache",
+        default=PROMPT_TOKEN_PRICE,
+    )
+    parser.add_argument(
+        "--completion-token-price",
+        type=float,
+        help="USD per million completion tokens",
+        default=COMPLETION_TOKEN_PRICE,
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        help="Chat completion temperature",
+        default=0.7,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        help="Requests processed at once",
+        default=32,
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        help="Seconds a request may wait for a slot before it is rejected with 503",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--embed-timeout",
+        type=float,
+        help="Embedding stage timeout in seconds",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--search-timeout",
+        type=float,
+        help="Search stage timeout in seconds",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--generate-timeout",
+        type=float,
+        help="Generation stage timeout in seconds",
+        default=60.0,
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    web.run_app(RagService(_args).app(), host=_args.host, port=_args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from clients import CREDENTIAL_KINDS, get_factory
+from deploy import DeploymentOrchestrator, config_args, load_config
+
+
+_logger = logging.getLogger(__name__)
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Facet terms requested when counting the source documents of an index
+MAX_PARENTS = 100000
+
+
+def version_name(index_name: str, version: int) -> str:
+    return f"{index_name}-v{version}"
+
+
+def parse_version(index_name: str, name: str):
+    """Version number of ``name`` when it is a version of ``index_name``, otherwise ``None``."""
+    _match = re.fullmatch(rf"{re.escape(index_name)}-v(\d+)", name)
+    return int(_match.group(1)) if _match else None
+
+
+class BlueGreenRebuild:
+    """Rebuilds an index next to the live one and switches the alias once it passes the gates.
+
+    Every rebuild creates ``<index-name>-v<N>`` with its own data source,
+    skillset and indexer, waits for the indexer's first run and compares the
+    new index with the live one: the number of source documents may not drop
+    by more than ``max_count_drop`` and recall@k over the sample queries may
+    neither fall below ``min_recall`` nor more than ``max_recall_drop`` under
+    the live index. Only then the alias moves to the new version in a single
+    request, and versions beyond the ``keep_versions`` most recent previous
+    ones are deleted. Queries through the alias never see a missing or
+    half-filled index.
+
+    Before the first rebuild the alias does not exist yet; the unversioned
+    ``<index-name>`` index, if any, is then the baseline of the gates. Once
+    the alias points elsewhere it counts as the oldest previous version, so
+    it and its data source, skillset and indexer are deleted when more than
+    ``keep_versions`` newer versions follow it.
+
+    Args:
+        args (argparse.Namespace): resource arguments, see :func:`deploy.config_args`
+        alias (str): alias the query path reads
+        credential (str): credential kind of the search clients
+        keep_versions (int): previous versions kept for a rollback
+        max_count_drop (float): tolerated relative drop of the source document count
+        min_recall (float): lowest mean recall@k of the new version
+        max_recall_drop (float): tolerated recall@k drop under the live index
+        k (int): results scored per sample query
+        monitor_options (dict): keyword arguments of :class:`indexer_monitor.IndexerMonitor`
+    """
+
+    def __init__(
+        self,
+        args,
+        alias: str,
+        credential: str = "key",
+        keep_versions: int = 1,
+        max_count_drop: float = 0.02,
+        min_recall: float = 0.5,
+        max_recall_drop: float = 0.1,
+        k: int = 10,
+        monitor_options: dict = None,
+    ):
+        self.args = args
+        self.alias = alias
+        self.credential = credential
+        self.keep_versions = keep_versions
+        self.max_count_drop = max_count_drop
+        self.min_recall = min_recall
+        self.max_recall_drop = max_recall_drop
+        self.k = k
+        self.monitor_options = monitor_options or {}
+        self.factory = get_factory(args.search_endpoint, credential)
+        self.index_client = self.factory.index_client()
+
+    def versions(self) -> list:
+        """Names of the existing versions, oldest first."""
+        _versions = []
+        for _name in self.index_client.list_index_names():
+            _version = parse_version(self.args.index_name, _name)
+            if _version is not None:
+                _versions.append((_version, _name))
+        return [_name for _, _name in sorted(_versions)]
+
+    def live(self):
+        """Index the alias points at, the unversioned index before the first rebuild, or ``None``."""
+        try:
+            return self.index_client.get_alias(self.alias).indexes[0]
+        except ResourceNotFoundError:
+            pass
+        try:
+            return self.index_client.get_index(self.args.index_name).name
+        except ResourceNotFoundError:
+            return None
+
+    def build(self, name: str) -> int:
+        """Deploy the resources of version ``name`` and wait for its indexer, returns the monitor exit code."""
+        from indexer_monitor import IndexerMonitor
+
+        _args = copy.copy(self.args)
+        _args.index_name = name
+        _args.semantic_index_name = self.args.index_name
+        _orchestrator = DeploymentOrchestrator(_args, self.credential)
+        _results = _orchestrator.run()
+        _failed = [_step for _step, _result in _results.items() if _result["action"] in ("failed", "skipped")]
+        if _failed:
+            raise RuntimeError(f"Deploying {name} failed at {', '.join(_failed)}")
+        # A new indexer starts its first run when it is created, so only wait for it
+        _monitor = IndexerMonitor(_orchestrator.indexer_client, _results["indexer"]["name"], **self.monitor_options)
+        return _monitor.wait()
+
+    def document_count(self, search_client, attempts: int = 5, delay: float = 2.0) -> int:
+        """Document count once two reads agree, the count lags behind the indexer for a few seconds."""
+        _count = search_client.get_document_count()
+        for _ in range(attempts - 1):
+            time.sleep(delay)
+            _previous, _count = _count, search_client.get_document_count()
+            if _count == _previous:
+                break
+        return _count
+
+    def parent_count(self, search_client) -> int:
+        """Source documents in an index, independent of how they are chunked."""
+        _results = search_client.search(search_text="*", facets=[f"parent_id,count:{MAX_PARENTS}"], top=0)
+        return len((_results.get_facets() or {}).get("parent_id") or [])
+
+    def recall(self, search_client, labels: list) -> float:
+        from relevance_bench import score_ranking
+
+        _recalls = []
+        for _label in labels:
+            _results = list(
+                search_client.search(search_text=_label["query"], top=self.k, select=["chunk_id", "title", "chunk"])
+            )
+            _recalls.append(score_ranking(_label["needles"], _results, self.k)["recall"])
+        return sum(_recalls) / len(_recalls) if _recalls else 0.0
+
+    def measure(self, name: str, labels: list) -> dict:
+        _search_client = self.factory.search_client(name)
+        return {
+            "index": name,
+            "documents": self.document_count(_search_client),
+            "parents": self.parent_count(_search_client),
+            "recall": round(self.recall(_search_client, labels), 4),
+        }
+
+    def gate(self, candidate: dict, live: dict) -> dict:
+        """Checks of ``candidate`` against the ``live`` measurements, ``live`` is ``None`` without one."""
+        _checks = {
+            "documents": candidate["documents"] > 0,
+            "min_recall": candidate["recall"] >= self.min_recall,
+        }
+        if live is not None:
+            _checks["parents"] = candidate["parents"] >= live["parents"] * (1 - self.max_count_drop)
+            _checks["recall"] = candidate["recall"] >= live["recall"] - self.max_recall_drop
+        return _checks
+
+    def swap(self, name: str):
+        from azure.search.documents.indexes.models import SearchAlias
+
+        self.index_client.create_or_update_alias(SearchAlias(name=self.alias, indexes=[name]))
+        logging.info("Alias %s now points at %s", self.alias, name)
+
+    def delete(self, name: str):
+        from reset_index import ManageSearch
+
+        ManageSearch(args=argparse.Namespace(search_service_endpoint=self.args.search_endpoint)).delete_index(name)
+
+    def collect(self, live: str) -> list:
+        """Delete previous versions beyond the ``keep_versions`` most recent, the unversioned index first."""
+        _previous = [_name for _name in self.versions() if _name != live]
+        if live != self.args.index_name and self.args.index_name in self.index_client.list_index_names():
+            _previous.insert(0, self.args.index_name)
+        _previous = _previous[: max(len(_previous) - self.keep_versions, 0)]
+        for _name in _previous:
+            self.delete(_name)
+        return _previous
+
+    def run(self, labels: list = None, sample_queries: int = 20, seed: int = 0, keep_failed: bool = False):
+        """Build, gate, swap and collect; returns the report and the exit code.
+
+        Args:
+            labels (list): labeled sample queries, see :func:`relevance_bench.parse_label`;
+                generated from the live index (or the new one without it) when ``None``
+            sample_queries (int): number of queries to generate
+            seed (int): seed of the generated queries
+            keep_failed (bool): keep a version that failed its build or gates for inspection
+        """
+        from relevance_bench import generate_labels, parse_label
+
+        _started = time.perf_counter()
+        _live = self.live()
+        _versions = self.versions()
+        _version = max((parse_version(self.args.index_name, _name) for _name in _versions), default=0) + 1
+        _name = version_name(self.args.index_name, _version)
+        _report = {"alias": self.alias, "live": _live, "candidate": _name, "swapped": False}
+        logging.info("Building %s next to %s", _name, _live or "no live index")
+
+        try:
+            _exit_code = self.build(_name)
+            if _exit_code:
+                _report["error"] = f"Indexer run of {_name} failed with exit code {_exit_code}"
+        except RuntimeError as e:
+            _report["error"] = str(e)
+            _exit_code = 1
+        if not _exit_code:
+            if labels is None:
+                labels = [
+                    parse_label(_item)
+                    for _item in generate_labels(self.factory.search_client(_live or _name), sample_queries, seed)
+                ]
+            _report["sample_queries"] = len(labels)
+            _report["live_metrics"] = self.measure(_live, labels) if _live else None
+            _report["candidate_metrics"] = self.measure(_name, labels)
+            _report["checks"] = self.gate(_report["candidate_metrics"], _report["live_metrics"])
+            logging.info("Gates of %s: %s", _name, json.dumps(_report["checks"]))
+            if all(_report["checks"].values()):
+                self.swap(_name)
+                _report["swapped"] = True
+                _report["deleted"] = self.collect(_name)
+            else:
+                _report["error"] = f"{_name} failed its gates, the alias still points at {_live}"
+                _exit_code = 1
+
+        if not _report["swapped"]:
+            logging.error(_report["error"])
+            if not keep_failed:
+                try:
+                    self.delete(_name)
+                except ResourceNotFoundError as e:
+                    _logger.warning("Cleaning up %s stopped at a missing resource: %s", _name, e)
+        _report["seconds"] = round(time.perf_counter() - _started, 3)
+        return _report, _exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        type=str,
+        help="Deployment config with a variables section",
+        default=os.path.join(_REPO_ROOT, "deployments", "config.yaml"),
+    )
+    parser.add_argument(
+        "--alias",
+        type=str,
+        help="Alias the query path reads, defaults to the config's IndexAlias or <IndexName>-live",
+        default=None,
+    )
+    parser.add_argument(
+        "--credential",
+        choices=CREDENTIAL_KINDS,
+        help="Credential of the search clients",
+        default="key",
+    )
+    parser.add_argument(
+        "--labels",
+        type=str,
+        help="Labeled sample queries as JSON lines, see relevance_bench.py; generated from the live index if unset",
+        default=None,
+    )
+    parser.add_argument(
+        "--sample-queries",
+        type=int,
+        help="Number of sample queries to generate without --labels",
+        default=20,
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed of the generated sample queries",
+        default=0,
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        help="Results scored per sample query",
+        default=10,
+    )
+    parser.add_argument(
+        "--min-recall",
+        type=float,
+        help="Lowest mean recall@k of the new version",
+        default=0.5,
+    )
+    parser.add_argument(
+        "--max-recall-drop",
+        type=float,
+        help="Tolerated recall@k drop of the new version under the live one",
+        default=0.1,
+    )
+    parser.add_argument(
+        "--max-count-drop",
+        type=float,
+        help="Tolerated relative drop of the source document count",
+        default=0.02,
+    )
+    parser.add_argument(
+        "--keep-versions",
+        type=int,
+        help="Previous versions kept for a rollback, including the unversioned index, older ones are deleted",
+        default=1,
+    )
+    parser.add_argument(
+        "--keep-failed",
+        action="store_true",
+        help="Keep a version that failed its indexer run or gates",
+        default=False,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Seconds to wait for the indexer run of the new version, 0 for no limit",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-failed-items",
+        type=int,
+        help="Failed items tolerated in the indexer run of the new version",
+        default=0,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the rebuild report as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("azure").setLevel(logging.WARNING)
+
+    _variables = load_config(_args.config)
+    try:
+        _resource_args = config_args(_variables)
+    except KeyError as e:
+        parser.error(f"{_args.config} is missing variable {e.args[0]}")
+    if _resource_args.use_ocr and _resource_args.use_document_layout:
+        parser.error("use_ocr and use_document_layout can't be enabled at the same time")
+    _alias = _args.alias or _variables.get("IndexAlias") or f"{_resource_args.index_name}-live"
+    if _alias == _resource_args.index_name:
+        parser.error("the alias needs a name of its own, an alias and an index can't share one")
+
+    _labels = None
+    if _args.labels:
+        from relevance_bench import load_labels
+
+        _labels = load_labels(_args.labels)
+
+    _rebuild = BlueGreenRebuild(
+        _resource_args,
+        _alias,
+        credential=_args.credential,
+        keep_versions=_args.keep_versions,
+        max_count_drop=_args.max_count_drop,
+        min_recall=_args.min_recall,
+        max_recall_drop=_args.max_recall_drop,
+        k=_args.k,
+        monitor_options={"timeout": _args.timeout, "max_failed_items": _args.max_failed_items},
+    )
+    _report, _exit_code = _rebuild.run(_labels, _args.sample_queries, _args.seed, _args.keep_failed)
+    logging.info("Rebuild report: %s", json.dumps(_report))
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_report, _file, indent=2)
+    sys.exit(_exit_code)
+
+
+if __name__ == "__main__":
+    main()
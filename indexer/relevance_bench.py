@@ -0,0 +1,456 @@
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import time
+import tracemalloc
+
+from benchmark import QUERY_MODES
+from metrics import LatencyRecorder
+
+
+_logger = logging.getLogger(__name__)
+
+OBJECTIVES = ("ndcg", "recall", "mrr")
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", text or "").strip().casefold()
+
+
+def parse_label(item: dict) -> dict:
+    """``{query, needles}`` of one labeled query.
+
+    A label has a ``query`` and at least one of ``relevant`` (chunk ids, or
+    ``{chunk_id: grade}`` for graded relevance), ``relevant_text`` (strings a
+    relevant chunk contains, like the notebook's check) and ``relevant_titles``.
+    Every label is one needle; a result is relevant when it satisfies one.
+    """
+    _relevant = item.get("relevant") or {}
+    if isinstance(_relevant, list):
+        _relevant = {_chunk_id: 1 for _chunk_id in _relevant}
+    _needles = [("chunk_id", _chunk_id, float(_grade)) for _chunk_id, _grade in _relevant.items()]
+    _needles += [("text", _normalize(_text), 1.0) for _text in item.get("relevant_text") or ()]
+    _needles += [("title", _normalize(_title), 1.0) for _title in item.get("relevant_titles") or ()]
+    if not item.get("query") or not _needles:
+        raise ValueError(f"Label {item} needs a query and relevance labels")
+    return {"query": item["query"], "needles": _needles}
+
+
+def load_labels(path: str) -> list:
+    """Labeled queries from JSON lines, see :func:`parse_label`."""
+    with open(path, "r", encoding="utf-8") as _file:
+        return [parse_label(json.loads(_line)) for _line in _file if _line.strip()]
+
+
+def _satisfies(result: dict, needle: tuple) -> bool:
+    _kind, _value, _ = needle
+    if _kind == "chunk_id":
+        return result.get("chunk_id") == _value
+    if _kind == "text":
+        return _value in _normalize(result.get("chunk"))
+    return _normalize(result.get("title")) == _value
+
+
+def score_ranking(needles: list, results: list, k: int) -> dict:
+    """recall@k, reciprocal rank and nDCG@k of ``results`` against labeled needles.
+
+    A result gains the grades of the needles it is the first to satisfy, so
+    overlapping chunks repeating one answer are not rewarded twice.
+    """
+    _found = set()
+    _dcg = 0.0
+    _reciprocal_rank = 0.0
+    for _rank, _result in enumerate(results[:k], start=1):
+        _gain = 0.0
+        for _position, _needle in enumerate(needles):
+            if _position not in _found and _satisfies(_result, _needle):
+                _found.add(_position)
+                _gain += _needle[2]
+        if _gain:
+            _dcg += _gain / math.log2(_rank + 1)
+            if not _reciprocal_rank:
+                _reciprocal_rank = 1.0 / _rank
+    _ideal = sorted((_needle[2] for _needle in needles), reverse=True)[:k]
+    _idcg = sum(_grade / math.log2(_rank + 1) for _rank, _grade in enumerate(_ideal, start=1))
+    return {
+        "recall": len(_found) / len(needles),
+        "mrr": _reciprocal_rank,
+        "ndcg": min(_dcg / _idcg, 1.0) if _idcg else 0.0,
+    }
+
+
+def pareto_front(rows: list, objective: str, latency: str = "p95_ms") -> list:
+    """Mark rows no other row beats on both ``objective`` (higher) and ``latency`` (lower)."""
+    for _row in rows:
+        _row["pareto"] = not any(
+            _other[objective] >= _row[objective]
+            and _other[latency] <= _row[latency]
+            and (_other[objective] > _row[objective] or _other[latency] < _row[latency])
+            for _other in rows
+        )
+    return rows
+
+
+def generate_labels(search_client, count: int, seed: int = 0) -> list:
+    """Synthetic labels: random 6-10 word spans of indexed chunks, relevant to any chunk containing them."""
+    _chunks = [
+        _result
+        for _result in search_client.search(search_text="*", select=["chunk_id", "chunk"], top=1000)
+        if len(_WORD_PATTERN.findall(_result.get("chunk") or "")) >= 10
+    ]
+    if not _chunks:
+        return []
+    _random = random.Random(seed)
+    _labels = []
+    for _chunk in _random.sample(_chunks, min(count, len(_chunks))):
+        _words = _WORD_PATTERN.findall(_chunk["chunk"])
+        _length = _random.randint(6, 10)
+        _start = _random.randrange(len(_words) - _length + 1)
+        _span = " ".join(_words[_start : _start + _length])
+        _labels.append({"query": _span, "relevant_text": [_span]})
+    return _labels
+
+
+class RelevanceBenchmark:
+    """Retrieval quality and latency per query mode over a grid of settings.
+
+    Every (mode, ``k_nearest_neighbors``) pair runs the labeled queries once
+    at the deepest ``top``. Shallower ``top`` values and semantic reranker
+    score thresholds are scored on truncations of the same results, so the
+    grid costs one search per query and pair. Query embeddings are computed
+    once and timed separately from search.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.memory = None
+        self._engine = None
+        if args.local_index_path:
+            from local_index import LocalSearchClient
+
+            # Python-side index structures are traced, memory-mapped vectors come from the index stats
+            tracemalloc.start()
+            self.search_client = LocalSearchClient(args.local_index_path, algorithm=args.local_algorithm)
+            self.search_client.index.keyword_index()
+            if args.local_algorithm == "hnsw":
+                self.search_client.index.graph()
+            _traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            _stats = self.search_client.index.stats()
+            self.memory = {
+                "documents": _stats["documents"],
+                "vector_bytes": _stats["vector_bytes"],
+                "structures_bytes": _traced,
+                "total_bytes": _stats["vector_bytes"] + _traced,
+            }
+        else:
+            from clients import get_factory
+
+            self.search_client = get_factory(args.search_endpoint).search_client(args.index_name)
+
+    def embed(self, queries: list, recorder: LatencyRecorder) -> list:
+        if not set(self.args.modes) - {"keyword"}:
+            return [None] * len(queries)
+        from async_embedder import EmbeddingEngine
+
+        _args = self.args
+        self._engine = EmbeddingEngine(
+            endpoint=_args.azure_openai_endpoint,
+            deployment=_args.azure_openai_embedding_deployment,
+            dimensions=_args.azure_openai_model_dimensions,
+        )
+        _vectors = []
+        for _query in queries:
+            with recorder.time("embed"):
+                _vectors.append(self._engine.embed_query(_query))
+        return _vectors
+
+    def search(self, mode: str, query: str, vector: list, k: int, depth: int) -> list:
+        from azure.search.documents.models import VectorizedQuery
+
+        _kwargs = {"top": depth, "select": ["chunk_id", "title", "chunk"]}
+        if mode != "keyword":
+            _kwargs["vector_queries"] = [VectorizedQuery(vector=vector, k_nearest_neighbors=k, fields="vector")]
+        if mode == "semantic":
+            _kwargs["query_type"] = "semantic"
+            _kwargs["semantic_configuration_name"] = (
+                self.args.semantic_configuration_name or f"{self.args.index_name}-semantic-config"
+            )
+        return [
+            {
+                "chunk_id": _result["chunk_id"],
+                "title": _result.get("title"),
+                "chunk": _result.get("chunk"),
+                "reranker_score": _result.get("@search.reranker_score"),
+            }
+            for _result in self.search_client.search(search_text=None if mode == "vector" else query, **_kwargs)
+        ]
+
+    def run(self, labels: list) -> dict:
+        _args = self.args
+        _queries = [_label["query"] for _label in labels]
+        _embed_recorder = LatencyRecorder()
+        _vectors = self.embed(_queries, _embed_recorder)
+        _depth = max(_args.tops)
+        _rows = []
+        for _mode in _args.modes:
+            if _mode == "semantic" and _args.local_index_path:
+                _logger.warning("Skipping semantic mode, the local backend has no semantic ranker")
+                continue
+            for _k in [None] if _mode == "keyword" else _args.k_nearest_neighbors:
+                _recorder = LatencyRecorder()
+                _rankings = []
+                for _query, _vector in zip(_queries, _vectors):
+                    with _recorder.time("search"):
+                        _rankings.append(self.search(_mode, _query, _vector, _k, _depth))
+                _latency = _recorder.summary()["search"]
+                for _threshold in _args.reranker_thresholds if _mode == "semantic" else [None]:
+                    for _top in _args.tops:
+                        _scores = [
+                            score_ranking(
+                                _label["needles"],
+                                [
+                                    _result
+                                    for _result in _ranking
+                                    if not _threshold or (_result["reranker_score"] or 0.0) >= _threshold
+                                ],
+                                _top,
+                            )
+                            for _label, _ranking in zip(labels, _rankings)
+                        ]
+                        _rows.append(
+                            {
+                                "mode": _mode,
+                                "k_nearest_neighbors": _k,
+                                "top": _top,
+                                "reranker_threshold": _threshold,
+                                **{
+                                    _name: round(sum(_score[_name] for _score in _scores) / len(_scores), 4)
+                                    for _name in OBJECTIVES
+                                },
+                                "p50_ms": _latency["p50_ms"],
+                                "p95_ms": _latency["p95_ms"],
+                            }
+                        )
+                logging.info("%s k=%s: p50 %.1f ms, p95 %.1f ms", _mode, _k, _latency["p50_ms"], _latency["p95_ms"])
+        pareto_front(_rows, _args.objective)
+        return {
+            "queries": len(labels),
+            "objective": _args.objective,
+            "backend": "local" if _args.local_index_path else "service",
+            "index_memory": self.memory,
+            "embed_latency": _embed_recorder.summary().get("embed"),
+            "configurations": _rows,
+        }
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.close()
+        if hasattr(self.search_client, "close"):
+            self.search_client.close()
+
+
+_TABLE_COLUMNS = (
+    ("mode", "mode"),
+    ("k_nearest_neighbors", "k"),
+    ("top", "top"),
+    ("reranker_threshold", "rerank>="),
+    ("recall", "recall"),
+    ("mrr", "mrr"),
+    ("ndcg", "ndcg"),
+    ("p50_ms", "p50_ms"),
+    ("p95_ms", "p95_ms"),
+)
+
+
+def format_table(rows: list, objective: str, columns: tuple = _TABLE_COLUMNS) -> str:
+    """Plain-text table of the configurations, fastest first, Pareto-optimal ones starred.
+
+    Args:
+        rows (list): configurations with ``p95_ms``, ``pareto`` and the ``objective``
+        objective (str): metric breaking latency ties
+        columns (tuple): (key, title) pairs, missing or ``None`` values print as ``-``
+    """
+    _lines = [["pareto"] + [_title for _, _title in columns]]
+    for _row in sorted(rows, key=lambda _row: (_row["p95_ms"], -_row[objective])):
+        _cells = ["-" if _row.get(_column) is None else str(_row[_column]) for _column, _ in columns]
+        _lines.append(["*" if _row["pareto"] else ""] + _cells)
+    _widths = [max(len(_line[_index]) for _line in _lines) for _index in range(len(_lines[0]))]
+    return "\n".join(
+        "  ".join(_cell.ljust(_width) for _cell, _width in zip(_line, _widths)).rstrip() for _line in _lines
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--labels",
+        type=str,
+        help="Labeled queries as JSON lines: query with relevant, relevant_text or relevant_titles",
+        default=None,
+    )
+    parser.add_argument(
+        "--generate-labels",
+        type=int,
+        help="Sample this many synthetic labeled queries from the indexed chunks",
+        default=0,
+    )
+    parser.add_argument(
+        "--labels-output",
+        type=str,
+        help="Write the generated labels to this file for later runs",
+        default=None,
+    )
+    parser.add_argument(
+        "--search-endpoint",
+        type=str,
+        help="Azure AI Search endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--index-name",
+        type=str,
+        help="Azure AI Search index name",
+        default="ragsearch",
+    )
+    parser.add_argument(
+        "--semantic-configuration-name",
+        type=str,
+        help="Semantic configuration (defaults to <index-name>-semantic-config)",
+        default=None,
+    )
+    parser.add_argument(
+        "--local-index-path",
+        type=str,
+        help="Benchmark a local index built by push_indexer.py --local-index-path instead of the service",
+        default=None,
+    )
+    parser.add_argument(
+        "--local-algorithm",
+        choices=["exhaustive", "hnsw"],
+        help="Vector search algorithm of the local index",
+        default="exhaustive",
+    )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        type=str,
+        help="Azure OpenAI endpoint, needed by every mode but keyword",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        help="Azure OpenAI embedding dimensions",
+        default=None,
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=QUERY_MODES,
+        help="Query modes to compare",
+        default=list(QUERY_MODES),
+    )
+    parser.add_argument(
+        "--tops",
+        nargs="+",
+        type=int,
+        help="Result counts (top) to score at",
+        default=[3, 5, 10],
+    )
+    parser.add_argument(
+        "--k-nearest-neighbors",
+        nargs="+",
+        type=int,
+        help="Vector query k values",
+        default=[10, 50],
+    )
+    parser.add_argument(
+        "--reranker-thresholds",
+        nargs="+",
+        type=float,
+        help="Minimum semantic reranker scores (0-4) to keep a result, 0 keeps all",
+        default=[0.0, 1.0, 2.0],
+    )
+    parser.add_argument(
+        "--objective",
+        choices=OBJECTIVES,
+        help="Quality metric of the Pareto front",
+        default="ndcg",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Label sampling seed",
+        default=0,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the results as JSON to this file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "httpx2", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+    if not _args.search_endpoint and not _args.local_index_path:
+        parser.error("either --search-endpoint or --local-index-path is required")
+    if set(_args.modes) - {"keyword"} and not _args.azure_openai_endpoint:
+        parser.error("vector modes need --azure-openai-endpoint")
+    if not _args.labels and not _args.generate_labels:
+        parser.error("pass --labels or --generate-labels")
+
+    _benchmark = RelevanceBenchmark(_args)
+    try:
+        _labels = load_labels(_args.labels) if _args.labels else []
+        if _args.generate_labels:
+            _generated = generate_labels(_benchmark.search_client, _args.generate_labels, _args.seed)
+            if _args.labels_output:
+                with open(_args.labels_output, "w", encoding="utf-8") as _file:
+                    for _label in _generated:
+                        _file.write(json.dumps(_label) + "\n")
+                logging.info("Wrote %d generated labels to %s", len(_generated), _args.labels_output)
+            _labels += [parse_label(_label) for _label in _generated]
+        if not _labels:
+            parser.error("no labels to score, the labels file is empty or the index has no chunks to sample")
+        _started = time.perf_counter()
+        _results = _benchmark.run(_labels)
+        _results["seconds"] = round(time.perf_counter() - _started, 3)
+    finally:
+        _benchmark.close()
+
+    print(format_table(_results["configurations"], _args.objective))
+    if _results["index_memory"]:
+        logging.info("Local index memory %s", _results["index_memory"])
+    if _args.output:
+        with open(_args.output, "w", encoding="utf-8") as _file:
+            json.dump(_results, _file, indent=2)
+        logging.info("Results written to %s", _args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
 import os
+import sys
+import time
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes import SearchIndexerClient
 from azure.storage.blob import BlobServiceClient
 
+from clients import get_factory
+from filters import quote
+from manifest import FingerprintManifest
+
+
+_logger = logging.getLogger(__name__)
+
+# Keys read per filtered query, the service's top limit
+PURGE_PAGE_SIZE = 1000
+BLOB_ACTIONS = ("keep", "soft-delete", "delete")
 
 
 class ManageSearch:
@@ -19,17 +29,20 @@ class ManageSearch:
 
     def delete_index(
         self,
+        index_name: str = None,
     ):
+        """Delete the indexer, skillset, data source and index of ``index_name``.
+
+        Args:
+            index_name (str): index to delete, defaults to ``--index-name`` along with its manifest
+        """
 
         _args = self.args
         _search_endpoint = _args.search_service_endpoint
-        _credential = AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
-        _indexer_client = SearchIndexerClient(
-            _search_endpoint,
-            _credential,
-        )
+        _factory = get_factory(_search_endpoint)
+        _indexer_client = _factory.indexer_client()
 
-        _index_name = _args.index_name
+        _index_name = index_name or _args.index_name
         _indexer_name = f"{_index_name}-indexer"
         _skillset_name = f"{_index_name}-skillset"
         _data_source_name = f"{_index_name}-blob"
@@ -51,16 +64,141 @@ class ManageSearch:
             data_source_connection=_data_source_name,
         )
 
-        _index_client = SearchIndexClient(
-            endpoint=_search_endpoint,
-            credential=_credential,
-        )
+        _index_client = _factory.index_client()
         logging.info(f"Deleting Index: {_index_name}")
         print(f"Deleting Index: {_index_name}")
         _index_client.delete_index(
             index=_index_name,
         )
 
+        _manifest = FingerprintManifest.from_args(_args) if index_name is None else None
+        if _manifest is not None:
+            # A manifest kept for an empty index would skip every source on the next run
+            logging.info(f"Deleting manifest: {_manifest.path}")
+            print(f"Deleting manifest: {_manifest.path}")
+            _manifest.delete()
+
+    def purge_filter(self) -> str:
+        _args = self.args
+        if _args.parent_id:
+            return f"parent_id eq {quote(_args.parent_id)}"
+        if _args.title:
+            return f"title eq {quote(_args.title)}"
+        # Titles repeat across folders, the path names exactly the blob being removed
+        return f"blob_path eq {quote(_args.blob_name)}"
+
+    def matching_keys(self, search_client, filter: str):
+        """Pages of chunk ids matching ``filter``.
+
+        Pages follow the key order rather than a skip, so the deletes running
+        meanwhile can't shift results out of the next page.
+        """
+        _last = None
+        while True:
+            _page_filter = filter if _last is None else f"({filter}) and chunk_id gt {quote(_last)}"
+            _page = [
+                _result["chunk_id"]
+                for _result in search_client.search(
+                    search_text="*",
+                    filter=_page_filter,
+                    order_by=["chunk_id asc"],
+                    select=["chunk_id"],
+                    top=PURGE_PAGE_SIZE,
+                )
+            ]
+            if not _page:
+                return
+            yield _page
+            if len(_page) < PURGE_PAGE_SIZE:
+                return
+            _last = _page[-1]
+
+    def delete_batch(self, search_client, keys: list) -> list:
+        """Delete chunks by key, returns the keys that failed."""
+        _results = search_client.delete_documents(documents=[{"chunk_id": _key} for _key in keys])
+        _failed = [_result for _result in _results if not _result.succeeded]
+        for _result in _failed:
+            _logger.error("Failed to delete %s: %s", _result.key, _result.error_message)
+        return [_result.key for _result in _failed]
+
+    def purge_blob(self, blob_name: str):
+        """Delete the blob, or mark it with the data source's soft-delete column so the indexer drops it too."""
+        # datasource.py configures logging on import, so load it once logging is set up
+        from datasource import SOFT_DELETE_COLUMN, SOFT_DELETE_MARKER
+
+        _args = self.args
+        _blob_client = BlobServiceClient(
+            account_url=_args.storage_account_url,
+            credential=os.getenv("AZURE_STORAGE_KEY"),
+        ).get_blob_client(container=_args.container_name, blob=blob_name)
+        if _args.blob_action == "delete":
+            logging.info(f"Deleting Blob: {blob_name}")
+            print(f"Deleting Blob: {blob_name}")
+            _blob_client.delete_blob()
+        else:
+            logging.info(f"Soft-deleting Blob: {blob_name}")
+            print(f"Soft-deleting Blob: {blob_name}")
+            _metadata = dict(_blob_client.get_blob_properties().metadata or {})
+            _metadata[SOFT_DELETE_COLUMN] = SOFT_DELETE_MARKER
+            _blob_client.set_blob_metadata(_metadata)
+
+    def purge_document(self) -> dict:
+        """Delete the chunks of one source document instead of the whole index.
+
+        Chunks are found by ``--parent-id``, ``--title`` or the ``blob_path``
+        of ``--blob-name``, and deleted in concurrent batches of keys. The
+        blob is then kept, deleted or soft-deleted per ``--blob-action``.
+        """
+        _args = self.args
+        _started = time.perf_counter()
+        _search_client = get_factory(_args.search_service_endpoint).search_client(_args.index_name)
+        _filter = self.purge_filter()
+        logging.info(f"Purging chunks matching {_filter} from {_args.index_name}")
+        print(f"Purging chunks matching {_filter} from {_args.index_name}")
+
+        _found = []
+        _failed = []
+        with ThreadPoolExecutor(max_workers=_args.concurrent_batches) as _executor:
+            _futures = []
+            for _page in self.matching_keys(_search_client, _filter):
+                _found.extend(_page)
+                if _args.dry_run:
+                    continue
+                for _start in range(0, len(_page), _args.batch_size):
+                    _futures.append(
+                        _executor.submit(self.delete_batch, _search_client, _page[_start : _start + _args.batch_size])
+                    )
+            for _future in _futures:
+                _failed.extend(_future.result())
+
+        _summary = {
+            "filter": _filter,
+            "found": len(_found),
+            "deleted": 0 if _args.dry_run else len(_found) - len(_failed),
+            "failed": len(_failed),
+            "dry_run": _args.dry_run,
+        }
+        if not _found and not (_args.parent_id or _args.title):
+            _logger.warning(
+                "No chunks with blob_path %s; chunks written by the pull indexer have no blob_path, "
+                "purge them by --parent-id or --title, or soft-delete the blob",
+                _args.blob_name,
+            )
+        if not _args.dry_run:
+            if _args.invalidate_url and _found:
+                from query_cache import notify_invalidations
+
+                _summary["invalidated"] = notify_invalidations(_args.invalidate_url, _found)
+            _manifest = FingerprintManifest.from_args(_args) if _args.blob_name else None
+            if _manifest is not None and _manifest.load().remove(_args.blob_name):
+                _manifest.save()
+            if _args.blob_action != "keep" and not _failed:
+                self.purge_blob(_args.blob_name)
+        _summary["seconds"] = round(time.perf_counter() - _started, 3)
+        logging.info(f"Purge finished: {_summary}")
+        print(f"Purge finished: {_summary}")
+        return _summary
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Status Metrics")
@@ -88,6 +226,66 @@ if __name__ == "__main__":
         help="Name of the indexer",
         default=None,
     )
+    parser.add_argument(
+        "--manifest-path",
+        type=str,
+        help="Push ingestion fingerprint manifest to delete with the index",
+        default=None,
+    )
+    parser.add_argument(
+        "--manifest-container",
+        type=str,
+        help="Container holding the manifest as a sidecar blob",
+        default=None,
+    )
+    parser.add_argument(
+        "--parent-id",
+        type=str,
+        help="Purge the chunks of this parent document instead of deleting the index",
+        default=None,
+    )
+    parser.add_argument(
+        "--title",
+        type=str,
+        help="Purge the chunks with this title, e.g. PerksPlus.pdf, instead of deleting the index",
+        default=None,
+    )
+    parser.add_argument(
+        "--blob-name",
+        type=str,
+        help="Blob of the purged document in --container-name, its chunks are matched by blob_path",
+        default=None,
+    )
+    parser.add_argument(
+        "--blob-action",
+        choices=BLOB_ACTIONS,
+        help="What to do with the blob once its chunks are purged",
+        default="keep",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Keys per delete batch",
+        default=PURGE_PAGE_SIZE,
+    )
+    parser.add_argument(
+        "--concurrent-batches",
+        type=int,
+        help="Delete batches sent in parallel",
+        default=4,
+    )
+    parser.add_argument(
+        "--invalidate-url",
+        action="append",
+        help="/invalidate endpoint of a running rag_service to notify of the purged chunks, repeatable",
+        default=None,
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the chunks a purge would delete",
+        default=False,
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -96,6 +294,18 @@ if __name__ == "__main__":
     )
     _args = parser.parse_args()
 
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("azure").setLevel(logging.WARNING)
+    _purge = bool(_args.parent_id or _args.title or _args.blob_name)
+    if _args.blob_action != "keep" and not (
+        _args.blob_name and _args.storage_account_url and _args.container_name
+    ):
+        parser.error("--blob-action needs --blob-name, --storage-account-url and --container-name")
+    if not 0 < _args.batch_size <= PURGE_PAGE_SIZE:
+        parser.error(f"--batch-size must be between 1 and {PURGE_PAGE_SIZE}")
 
     _manage_search = ManageSearch(
         args=_args
@@ -105,4 +315,7 @@ if __name__ == "__main__":
         and _args.index_name
         and _args.index_name != "None"
     ):
+        if _purge:
+            _summary = _manage_search.purge_document()
+            sys.exit(1 if _summary["failed"] else 0)
         _manage_search.delete_index()
@@ -1,45 +1,139 @@
 import logging
 import argparse
-import os
-from azure.search.documents import SearchClient
-from azure.search.documents.models import VectorizableTextQuery
+import time
+from azure.search.documents.models import VectorizableTextQuery, VectorizedQuery
 
-from azure.identity import AzureCliCredential
-from azure.core.credentials import AzureKeyCredential
+from clients import get_factory
+from filters import add_filter_arguments, choose_filter_mode, filter_from_args, post_filter_k
+from query_cache import QueryEmbeddingCache, SearchResultCache
+from query_planner import PLAN_MODES, QueryPlanner
 
 
 class AISearchTest:
     def __init__(self, args):
         self.args = args
+        self.query_cache = None
+        self.result_cache = None
+        self.planner = None
+        if args.azure_openai_endpoint:
+            self.query_cache = QueryEmbeddingCache(
+                args.azure_openai_embedding_deployment,
+                args.azure_openai_model_dimensions,
+                disk_path=args.query_cache_path,
+            )
+        if args.result_cache_ttl > 0:
+            self.result_cache = SearchResultCache(ttl_seconds=args.result_cache_ttl)
+
+    def retrieve(self, search_client, query: str, embed=None, filter: str = None, filter_mode: str = "auto"):
+        """Run the vector query, going through the embedding and result caches.
+
+        The planner picks exhaustive KNN or ANN for the query; without one the
+        query uses ANN. Filters are applied before the vector search unless
+        the planner finds them unselective, then the neighbors are post-filtered
+        with ``k`` scaled up to compensate.
+        """
+        _top = 1
+        _k = 1
+        _plan = self.planner.plan(filter) if self.planner is not None else None
+        _exhaustive = _plan.exhaustive if _plan is not None else False
+        _filter_mode = None
+        if filter:
+            _selectivity = _plan.selectivity if _plan is not None else None
+            _filter_mode = choose_filter_mode(_selectivity, filter_mode)
+            if _filter_mode == "postFilter":
+                _k = post_filter_k(_k, _selectivity)
+
+        def _search():
+            if embed is not None:
+                # Embed client-side through the batched embedding client instead of
+                # relying on the index vectorizer
+                _vector_query = VectorizedQuery(
+                    vector=self.query_cache.get_or_embed(query, embed),
+                    k_nearest_neighbors=_k,
+                    fields="vector",
+                    exhaustive=_exhaustive,
+                )
+            else:
+                _vector_query = VectorizableTextQuery(
+                    text=query,
+                    k_nearest_neighbors=_k,
+                    fields="vector",
+                    exhaustive=_exhaustive,
+                )
+            _started = time.perf_counter()
+            _results = list(
+                search_client.search(
+                    search_text=None,
+                    vector_queries=[_vector_query],
+                    top=_top,
+                    filter=filter,
+                    vector_filter_mode=_filter_mode,
+                )
+            )
+            if _plan is not None:
+                self.planner.record(_plan, time.perf_counter() - _started, query, filter)
+            return _results
+
+        if self.result_cache is None:
+            return _search()
+        _key = SearchResultCache.make_key(
+            query,
+            filter=filter,
+            top=_top,
+            k=_k,
+            query_type="vector",
+            exhaustive=_exhaustive,
+            vector_filter_mode=_filter_mode,
+        )
+        return self.result_cache.get_or_search(_key, _search)
 
     def search(self):
         _args = self.args
-        # _credential = AzureCliCredential()
-        _credential=AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
-
         _search_endpoint = _args.search_endpoint
         _index_name = _args.index_name
         _add_page_numbers = _args.add_page_numbers
         _query = _args.query
 
+        _engine = None
+        if _args.azure_openai_endpoint:
+            from async_embedder import EmbeddingEngine
+
+            _engine = EmbeddingEngine(
+                endpoint=_args.azure_openai_endpoint,
+                deployment=_args.azure_openai_embedding_deployment,
+                dimensions=_args.azure_openai_model_dimensions,
+            )
+
         # Pure Vector Search
-        _search_client = SearchClient(
-            _search_endpoint,
-            _index_name,
-            credential=_credential,
-        )
-        _vector_query = VectorizableTextQuery(
-            text=_query,
-            k_nearest_neighbors=1,
-            fields="vector",
-            exhaustive=True,
-        )
-        # Use the below query to pass in the raw vector query instead of the query vectorization
-        # vector_query = RawVectorQuery(vector=generate_embeddings(query), k_nearest_neighbors=3, fields="vector")
+        if _args.backend == "local":
+            from local_index import LocalSearchClient
 
-        _results = _search_client.search(
-            search_text=None, vector_queries=[_vector_query], top=1
+            _search_client = LocalSearchClient(
+                _args.local_index_path,
+                embed=_engine.embed_query if _engine else None,
+                algorithm=_args.local_algorithm,
+            )
+        else:
+            _search_client = get_factory(_search_endpoint).search_client(_index_name)
+        self.planner = QueryPlanner(
+            _search_client,
+            mode=_args.plan,
+            exhaustive_threshold=_args.exhaustive_threshold,
+            selectivity_threshold=_args.selectivity_threshold,
+            plan_log=_args.plan_log,
         )
+        try:
+            for _ in range(_args.repeat):
+                _results = self.retrieve(
+                    _search_client,
+                    _query,
+                    _engine.embed_query if _engine else None,
+                    filter_from_args(_args),
+                    _args.vector_filter_mode,
+                )
+        finally:
+            if _engine is not None:
+                _engine.close()
 
         for _result in _results:
             print(f"parent_id: {_result['parent_id']}")
@@ -50,13 +144,20 @@ class AISearchTest:
             _chunk = _result["chunk"].replace("\n", " ")
             print(f"Content: {_chunk}")
 
+        logging.info("Query plans %s", self.planner.stats())
+        if self.query_cache is not None:
+            logging.info("Query embedding cache %s", self.query_cache.stats())
+        if self.result_cache is not None:
+            logging.info("Search result cache %s", self.result_cache.stats())
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--search-endpoint",
-        required=True,
+        required=False,
         help="Search endpoint",
+        default=None,
     )
     parser.add_argument(
         "--index-name",
@@ -75,6 +176,93 @@ def main():
         required=True,
         help="Query",
     )
+    parser.add_argument(
+        "--azure-openai-endpoint",
+        required=False,
+        help="Embed the query client-side with this Azure OpenAI endpoint",
+        default=None,
+    )
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        required=False,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument(
+        "--azure-openai-model-dimensions",
+        type=int,
+        required=False,
+        help="Azure OpenAI model dimensions",
+        default=None,
+    )
+    add_filter_arguments(parser)
+    parser.add_argument(
+        "--plan",
+        choices=PLAN_MODES,
+        required=False,
+        help="Let the planner choose exhaustive KNN or ANN, or force one",
+        default="auto",
+    )
+    parser.add_argument(
+        "--exhaustive-threshold",
+        type=int,
+        required=False,
+        help="Scan exhaustively when at most this many documents pass the filter",
+        default=5000,
+    )
+    parser.add_argument(
+        "--selectivity-threshold",
+        type=float,
+        required=False,
+        help="Scan exhaustively when at most this fraction of the index passes the filter",
+        default=0.01,
+    )
+    parser.add_argument(
+        "--plan-log",
+        required=False,
+        help="Append every query plan and its latency to this JSON lines file",
+        default=None,
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("service", "local"),
+        required=False,
+        help="Query the Azure AI Search service or a local index",
+        default="service",
+    )
+    parser.add_argument(
+        "--local-index-path",
+        required=False,
+        help="Local index directory for --backend local",
+        default=None,
+    )
+    parser.add_argument(
+        "--local-algorithm",
+        choices=("exhaustive", "hnsw"),
+        required=False,
+        help="Vector algorithm of the local backend for non-exhaustive queries",
+        default="exhaustive",
+    )
+    parser.add_argument(
+        "--query-cache-path",
+        required=False,
+        help="On-disk store for query embeddings, shared between runs",
+        default=None,
+    )
+    parser.add_argument(
+        "--result-cache-ttl",
+        type=float,
+        required=False,
+        help="Seconds to cache search results (0 disables)",
+        default=60.0,
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        required=False,
+        help="Run the query this many times, e.g. to measure cache hit rates",
+        default=1,
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -83,6 +271,16 @@ def main():
         default=False,
     )
     _args = parser.parse_args()
+    try:
+        filter_from_args(_args)
+    except ValueError as e:
+        parser.error(str(e))
+    if _args.backend == "local" and not _args.local_index_path:
+        parser.error("--backend local requires --local-index-path")
+    if _args.backend == "service" and not _args.search_endpoint:
+        parser.error("--search-endpoint is required")
+    if _args.repeat < 1:
+        parser.error("--repeat must be at least 1")
 
     if _args.verbose:
         logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from query_cache import register_result_cache
+
+
+_logger = logging.getLogger(__name__)
+
+# gpt-4o-mini list prices, USD per million tokens
+PROMPT_TOKEN_PRICE = 0.15
+COMPLETION_TOKEN_PRICE = 0.60
+
+
+class SemanticAnswerCache:
+    """Answers reused across paraphrased questions, looked up by query-embedding similarity.
+
+    A question hits when the cosine similarity between its vector and that of
+    a cached question reaches ``threshold``, within the same scope (filter,
+    top, ...). Entries expire after ``ttl_seconds``, the least recently used
+    one is evicted beyond ``max_entries``, and an entry is dropped when any
+    ``chunk_id`` it was answered from is upserted or deleted (see
+    :func:`query_cache.invalidate_chunks`). Vectors live in one preallocated
+    matrix so a lookup is a single matrix-vector product.
+
+    Args:
+        threshold (float): cosine similarity at or above which a cached answer is reused
+        ttl_seconds (float): entry lifetime
+        max_entries (int): entries kept
+        prompt_token_price (float): USD per million prompt tokens, for the saved cost
+        completion_token_price (float): USD per million completion tokens
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl_seconds: float = 3600.0,
+        max_entries: int = 1024,
+        prompt_token_price: float = PROMPT_TOKEN_PRICE,
+        completion_token_price: float = COMPLETION_TOKEN_PRICE,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prompt_token_price = prompt_token_price
+        self.completion_token_price = completion_token_price
+        self._vectors = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._free = list(range(max_entries - 1, -1, -1))
+        # slot -> (expires, scope, answer, chunk_ids, seconds, cost), in LRU order
+        self._entries = OrderedDict()
+        self._by_chunk = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+        self._similarity = 0.0
+        self._saved_seconds = 0.0
+        self._saved_cost = 0.0
+        register_result_cache(self)
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """USD cost of one completion."""
+        return (prompt_tokens * self.prompt_token_price + completion_tokens * self.completion_token_price) / 1e6
+
+    def _drop(self, slot: int):
+        _expires, _scope, _answer, _chunk_ids, _seconds, _cost = self._entries.pop(slot)
+        self._valid[slot] = False
+        self._free.append(slot)
+        for _chunk_id in _chunk_ids:
+            _slots = self._by_chunk.get(_chunk_id)
+            if _slots is not None:
+                _slots.discard(slot)
+                if not _slots:
+                    del self._by_chunk[_chunk_id]
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        _vector = np.asarray(vector, dtype=np.float32)
+        return _vector / max(float(np.linalg.norm(_vector)), 1e-12)
+
+    def get(self, vector, scope=None):
+        """(answer, similarity) of the closest live entry in ``scope``, ``None`` on a miss."""
+        if not self.max_entries:
+            return None
+        _vector = self._normalize(vector)
+        _now = time.monotonic()
+        with self._lock:
+            if self._vectors is None or not self._entries or _vector.shape[0] != self._vectors.shape[1]:
+                self.misses += 1
+                return None
+            _scores = np.where(self._valid, self._vectors @ _vector, -np.inf)
+            _candidates = np.flatnonzero(_scores >= self.threshold)
+            for _slot in _candidates[np.argsort(-_scores[_candidates])].tolist():
+                _expires, _scope, _answer, _chunk_ids, _seconds, _cost = self._entries[_slot]
+                if _scope != scope:
+                    continue
+                if _expires < _now:
+                    self._drop(_slot)
+                    self.expired += 1
+                    continue
+                self._entries.move_to_end(_slot)
+                self.hits += 1
+                self._similarity += float(_scores[_slot])
+                self._saved_seconds += _seconds
+                self._saved_cost += _cost
+                return _answer, round(float(_scores[_slot]), 4)
+            self.misses += 1
+            return None
+
+    def put(self, vector, answer: dict, chunk_ids, scope=None, seconds: float = 0.0, cost: float = 0.0):
+        """Cache ``answer`` for the question embedded as ``vector``.
+
+        ``seconds`` and ``cost`` are what the answer took to produce past the
+        embedding; every later hit counts them as saved.
+        """
+        if not self.max_entries:
+            return
+        _vector = self._normalize(vector)
+        _chunk_ids = {_chunk_id for _chunk_id in chunk_ids if _chunk_id}
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != _vector.shape[0]:
+                # First entry, or the embedding model changed: start over at its dimensions
+                for _slot in list(self._entries):
+                    self._drop(_slot)
+                self._vectors = np.zeros((self.max_entries, _vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                self._drop(next(iter(self._entries)))
+                self.evicted += 1
+            _slot = self._free.pop()
+            self._vectors[_slot] = _vector
+            self._valid[_slot] = True
+            self._entries[_slot] = (time.monotonic() + self.ttl_seconds, scope, answer, _chunk_ids, seconds, cost)
+            for _chunk_id in _chunk_ids:
+                self._by_chunk.setdefault(_chunk_id, set()).add(_slot)
+
+    def invalidate(self, chunk_ids) -> int:
+        with self._lock:
+            _slots = set()
+            for _chunk_id in chunk_ids:
+                _slots.update(self._by_chunk.get(_chunk_id, ()))
+            for _slot in _slots:
+                self._drop(_slot)
+            self.invalidated += len(_slots)
+        if _slots:
+            _logger.info("Invalidated %d cached answers", len(_slots))
+        return len(_slots)
+
+    def clear(self):
+        with self._lock:
+            for _slot in list(self._entries):
+                self._drop(_slot)
+
+    def stats(self):
+        _lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / _lookups, 4) if _lookups else 0.0,
+            "avg_hit_similarity": round(self._similarity / self.hits, 4) if self.hits else 0.0,
+            "saved_ms": round(self._saved_seconds * 1000, 2),
+            "saved_usd": round(self._saved_cost, 6),
+        }
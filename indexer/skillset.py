@@ -17,8 +17,11 @@ from azure.search.documents.indexes.models import (
     AIServicesAccountIdentity,
     DocumentIntelligenceLayoutSkill,
 )
-from azure.search.documents.indexes import SearchIndexerClient
-from azure.core.credentials import AzureKeyCredential
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from chunker import DEFAULT_MAXIMUM_PAGE_LENGTH, DEFAULT_PAGE_OVERLAP_LENGTH
+from clients import get_factory
 
 
 class AISearchSkillset:
@@ -34,6 +37,8 @@ class AISearchSkillset:
         self.skillset_name = f"{self.index_name}-skillset"
         self.use_ocr = args.use_ocr
         self.use_document_layout = args.use_document_layout
+        self.maximum_page_length = args.maximum_page_length
+        self.page_overlap_length = args.page_overlap_length
 
     def create_ocr_skillset(self):
         ocr_skill = OcrSkill(
@@ -57,8 +62,8 @@ class AISearchSkillset:
             description="Split skill to chunk documents",
             text_split_mode="pages",
             context="/document/normalized_images/*",
-            maximum_page_length=2000,
-            page_overlap_length=500,
+            maximum_page_length=self.maximum_page_length,
+            page_overlap_length=self.page_overlap_length,
             inputs=[
                 InputFieldMappingEntry(
                     name="text", source="/document/normalized_images/*/text"
@@ -151,8 +156,8 @@ class AISearchSkillset:
             description="Split skill to chunk documents",
             text_split_mode="pages",
             context="/document/markdownDocument/*",
-            maximum_page_length=2000,
-            page_overlap_length=500,
+            maximum_page_length=self.maximum_page_length,
+            page_overlap_length=self.page_overlap_length,
             inputs=[
                 InputFieldMappingEntry(
                     name="text", source="/document/markdownDocument/*/content"
@@ -238,8 +243,8 @@ class AISearchSkillset:
             description="Split skill to chunk documents",
             text_split_mode="pages",
             context="/document",
-            maximum_page_length=2000,
-            page_overlap_length=500,
+            maximum_page_length=self.maximum_page_length,
+            page_overlap_length=self.page_overlap_length,
             inputs=[
                 InputFieldMappingEntry(name="text", source="/document/content"),
             ],
@@ -293,10 +298,25 @@ class AISearchSkillset:
             index_projection=index_projections,
         )
 
-    def create_skillset(self):
+    def check_index_dimensions(self):
+        """Fail before deploying when the embedding skill's dimensions differ from the index vector field."""
+        try:
+            index = get_factory(self.azure_search_endpoint).index_client().get_index(self.index_name)
+        except ResourceNotFoundError:
+            logging.warning("Index %s not found, skipping the dimensions check", self.index_name)
+            return
+        for field in index.fields:
+            dimensions = field.vector_search_dimensions
+            if dimensions and dimensions != int(self.azure_openai_model_dimensions):
+                raise ValueError(
+                    f"Embedding skill dimensions {self.azure_openai_model_dimensions} do not match "
+                    f"{dimensions} of vector field {field.name} in index {self.index_name}"
+                )
+
+    def skillset_definition(self):
         use_ocr = self.use_ocr
         use_document_layout = self.use_document_layout
-        skillset = (
+        return (
             self.create_ocr_skillset()
             if use_ocr
             else (
@@ -306,10 +326,11 @@ class AISearchSkillset:
             )
         )
 
-        client = SearchIndexerClient(
-            self.azure_search_endpoint,
-            AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY")),
-        )
+    def create_skillset(self):
+        self.check_index_dimensions()
+        skillset = self.skillset_definition()
+
+        client = get_factory(self.azure_search_endpoint).indexer_client()
         client.create_or_update_skillset(skillset)
         logging.info("Skillset %s created", skillset.name)
 
@@ -323,6 +344,8 @@ def main():
     parser.add_argument("--azure-ai-services-endpoint", type=str, required=True)
     parser.add_argument("--azure-search-endpoint", type=str, required=True)
     parser.add_argument("--index-name", type=str, required=True)
+    parser.add_argument("--maximum-page-length", type=int, required=False, default=DEFAULT_MAXIMUM_PAGE_LENGTH)
+    parser.add_argument("--page-overlap-length", type=int, required=False, default=DEFAULT_PAGE_OVERLAP_LENGTH)
     parser.add_argument("--use-ocr", action="store_true", default=False)
     parser.add_argument("--use-document-layout", action="store_true", default=False)
     parser.add_argument("--verbose", action="store_true", required=False, default=False)
@@ -347,6 +370,8 @@ def main():
         "Azure OpenAI Model Dimensions: %s", args.azure_openai_model_dimensions
     )
     logging.debug("Azure AI Services Endpoint: %s", args.azure_ai_services_endpoint)
+    logging.debug("Maximum Page Length: %s", args.maximum_page_length)
+    logging.debug("Page Overlap Length: %s", args.page_overlap_length)
 
     skillset = AISearchSkillset(args)
     skillset.create_skillset()
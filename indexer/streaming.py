@@ -0,0 +1,307 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from async_embedder import TokenCounter
+from metrics import percentile
+
+
+_logger = logging.getLogger(__name__)
+
+_CITATION_PATTERN = re.compile(r"\[([^\[\]]+)\]")
+_CITATION_SEPARATOR = re.compile(r"\s*[,;]\s*")
+# An open bracket not closed within this many characters is not a citation
+MAX_CITATION_LENGTH = 512
+
+
+class CitationExtractor:
+    """Finds ``[title]`` source citations in an answer while it streams.
+
+    Deltas are fed as they arrive; a marker split across deltas is held back
+    until its closing bracket. Markers naming several sources
+    (``[a.pdf, b.pdf]``) are split when the whole marker is not a title.
+    Titles are matched case-insensitively against the retrieved documents.
+
+    Args:
+        documents (list): sources passed to the model, best first
+    """
+
+    def __init__(self, documents: list):
+        self._sources = {}
+        for _document in documents:
+            _title = (_document.get("title") or "").strip()
+            if _title:
+                self._sources.setdefault(_title.casefold(), _document)
+        self._buffer = ""
+        self._seen = set()
+        self.citations = []
+        self.unmatched = []
+
+    def _cite(self, title: str):
+        _document = self._sources.get(title.strip().casefold())
+        if _document is None:
+            return None
+        _key = _document["title"]
+        if _key in self._seen:
+            return None
+        self._seen.add(_key)
+        _citation = {
+            "title": _document["title"],
+            "parent_id": _document.get("parent_id"),
+            "chunk_id": _document.get("chunk_id"),
+        }
+        self.citations.append(_citation)
+        return _citation
+
+    def feed(self, text: str) -> list:
+        """Add a delta, returns the citations first seen in it."""
+        self._buffer += text
+        _new = []
+        _end = 0
+        for _match in _CITATION_PATTERN.finditer(self._buffer):
+            _end = _match.end()
+            _marker = _match.group(1).strip()
+            _titles = [_marker] if _marker.casefold() in self._sources else _CITATION_SEPARATOR.split(_marker)
+            for _title in _titles:
+                if _title.casefold() not in self._sources:
+                    if _title not in self.unmatched:
+                        self.unmatched.append(_title)
+                    continue
+                _citation = self._cite(_title)
+                if _citation is not None:
+                    _new.append(_citation)
+        _open = self._buffer.rfind("[", _end)
+        if _open == -1 or len(self._buffer) - _open > MAX_CITATION_LENGTH:
+            self._buffer = ""
+        else:
+            self._buffer = self._buffer[_open:]
+        return _new
+
+
+class StreamStats:
+    """Timings of one streamed answer, measured from the arrival of its request.
+
+    ``ttft`` is the wait from the request to the first answer token and so
+    includes retrieval and prompt building; ``generate_ttft`` only covers the
+    model. ``tokens_per_second`` is the decode rate after the first token.
+
+    Args:
+        token_counter (TokenCounter): counts completion tokens, estimated when tiktoken is missing
+        started (float): ``time.perf_counter()`` of the request, defaults to now
+    """
+
+    def __init__(self, token_counter: TokenCounter = None, started: float = None):
+        self.token_counter = token_counter or TokenCounter()
+        self.started = started if started is not None else time.perf_counter()
+        self.retrieved = None
+        self.generate_started = None
+        self.prompt_tokens = 0
+        self.first_token = None
+        self.finished = None
+        self.deltas = 0
+        self.error = False
+        self._parts = []
+
+    def mark_retrieved(self):
+        self.retrieved = time.perf_counter()
+
+    def start_generation(self, prompt_tokens: int = 0):
+        self.generate_started = time.perf_counter()
+        self.prompt_tokens = prompt_tokens
+
+    def add(self, delta: str):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.deltas += 1
+        self._parts.append(delta)
+
+    def finish(self, error: bool = False):
+        self.finished = time.perf_counter()
+        self.error = error
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def summary(self) -> dict:
+        _finished = self.finished if self.finished is not None else time.perf_counter()
+
+        def _ms(_from, _to):
+            return round((_to - _from) * 1000, 2) if _from is not None and _to is not None else None
+
+        _tokens = self.token_counter.count(self.text) if self._parts else 0
+        _decode = _finished - self.first_token if self.first_token is not None else 0
+        return {
+            "ttft_ms": _ms(self.started, self.first_token),
+            "generate_ttft_ms": _ms(self.generate_started, self.first_token),
+            "retrieve_ms": _ms(self.started, self.retrieved),
+            "total_ms": _ms(self.started, _finished),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": _tokens,
+            "deltas": self.deltas,
+            "tokens_per_second": round((_tokens - 1) / _decode, 2) if _tokens > 1 and _decode > 0 else None,
+            "error": self.error,
+        }
+
+
+class StreamRecorder:
+    """Recent per-request stream summaries with percentile rollups.
+
+    Args:
+        max_samples (int): summaries kept for the rollup
+        stream_log (str): optional JSON lines file receiving every summary
+    """
+
+    def __init__(self, max_samples: int = 10000, stream_log: str = None):
+        self.stream_log = stream_log
+        self._samples = deque(maxlen=max_samples)
+        self._count = 0
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, summary: dict, question: str = None):
+        with self._lock:
+            self._samples.append(summary)
+            self._count += 1
+            if summary.get("error"):
+                self._errors += 1
+            if self.stream_log:
+                with open(self.stream_log, "a", encoding="utf-8") as _file:
+                    _file.write(json.dumps({"time": time.time(), "question": question, **summary}) + "\n")
+
+    def summary(self) -> dict:
+        with self._lock:
+            _samples = list(self._samples)
+            _count, _errors = self._count, self._errors
+        _summary = {"count": _count, "errors": _errors}
+        for _name in ("ttft_ms", "generate_ttft_ms", "total_ms", "tokens_per_second"):
+            _values = [_sample[_name] for _sample in _samples if _sample.get(_name) is not None]
+            _summary[_name] = {
+                "mean": round(sum(_values) / len(_values), 2) if _values else 0.0,
+                "p50": percentile(_values, 50),
+                "p95": percentile(_values, 95),
+            }
+        return _summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-endpoint", type=str, help="Azure AI Search endpoint", required=True)
+    parser.add_argument("--index-name", type=str, help="Azure AI Search index name", required=True)
+    parser.add_argument("--azure-openai-endpoint", type=str, help="Azure OpenAI endpoint", required=True)
+    parser.add_argument(
+        "--azure-openai-embedding-deployment",
+        type=str,
+        help="Azure OpenAI embedding deployment",
+        default="text-embedding-ada-002",
+    )
+    parser.add_argument("--azure-openai-model-dimensions", type=int, help="Azure OpenAI model dimensions", default=None)
+    parser.add_argument(
+        "--azure-openai-chat-deployment", type=str, help="Azure OpenAI chat deployment", default="gpt-4o-mini"
+    )
+    parser.add_argument("--azure-openai-api-version", type=str, help="Azure OpenAI API version", default="2024-06-01")
+    parser.add_argument("--query", nargs="+", help="Questions to answer", required=True)
+    parser.add_argument("--top", type=int, help="Number of sources passed to the model", default=5)
+    parser.add_argument("--temperature", type=float, help="Chat completion temperature", default=0.7)
+    parser.add_argument("--context-max-tokens", type=int, help="Token budget of the sources, 0 for none", default=3000)
+    parser.add_argument("--stream-log", type=str, help="Append every request's timings to this JSON lines file")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Increase output verbosity",
+        required=False,
+        default=False,
+    )
+    _args = parser.parse_args()
+
+    if _args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        for _name in ("azure", "httpx", "openai"):
+            logging.getLogger(_name).setLevel(logging.WARNING)
+
+    from openai import AzureOpenAI
+
+    from async_embedder import EmbeddingEngine
+    from clients import get_factory
+    from context_builder import ContextBuilder
+    from hybrid_search import HybridRetriever
+    from rag_service import build_messages
+
+    _engine = EmbeddingEngine(
+        endpoint=_args.azure_openai_endpoint,
+        deployment=_args.azure_openai_embedding_deployment,
+        dimensions=_args.azure_openai_model_dimensions,
+    )
+    _retriever = HybridRetriever(
+        get_factory(_args.search_endpoint).search_client(_args.index_name),
+        embed=_engine.embed_query,
+        top=_args.top,
+        select=None,
+    )
+    _builder = ContextBuilder(max_tokens=_args.context_max_tokens)
+    _chat_client = AzureOpenAI(
+        api_version=_args.azure_openai_api_version,
+        azure_endpoint=_args.azure_openai_endpoint,
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+    )
+    _recorder = StreamRecorder(stream_log=_args.stream_log)
+
+    try:
+        for _query in _args.query:
+            _stats = StreamStats(_builder.token_counter)
+            _documents = _retriever.retrieve(_query).documents
+            _stats.mark_retrieved()
+            _extractor = CitationExtractor(_documents)
+            _messages = build_messages(_query, _documents, _builder.build(_documents).text)
+            _stats.start_generation()
+            _error = True
+            try:
+                _stream = _chat_client.chat.completions.create(
+                    model=_args.azure_openai_chat_deployment,
+                    temperature=_args.temperature,
+                    messages=_messages,
+                    stream=True,
+                )
+                print(f"> {_query}")
+                for _chunk in _stream:
+                    if not _chunk.choices or not _chunk.choices[0].delta.content:
+                        continue
+                    _delta = _chunk.choices[0].delta.content
+                    _stats.add(_delta)
+                    sys.stdout.write(_delta)
+                    sys.stdout.flush()
+                    for _citation in _extractor.feed(_delta):
+                        _logger.debug("Cited %s after %s deltas", _citation["title"], _stats.deltas)
+                _error = False
+            finally:
+                _stats.finish(error=_error)
+                _summary = _stats.summary()
+                _recorder.record(_summary, _query)
+            print()
+            logging.info(
+                "TTFT %s ms (model %s ms), %s tokens at %s tokens/s, total %s ms, cited %s",
+                _summary["ttft_ms"],
+                _summary["generate_ttft_ms"],
+                _summary["completion_tokens"],
+                _summary["tokens_per_second"],
+                _summary["total_ms"],
+                [_citation["title"] for _citation in _extractor.citations],
+            )
+    finally:
+        _retriever.close()
+        _engine.close()
+        _chat_client.close()
+    print(json.dumps(_recorder.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from azure.search.documents.models import IndexingResult
+
+from push_indexer import AISearchPushIndexer, build_parser
+
+
+class _FakeSearchClient:
+    """Records every indexing action and fails the chunk ids for which ``fail`` returns true."""
+
+    def __init__(self):
+        self.fail = lambda action, key: False
+        self.actions = []
+        self.documents = set()
+
+    def get_document_count(self):
+        return len(self.documents)
+
+    def index_documents(self, batch):
+        _results = []
+        for _action in batch.actions:
+            _key = _action.additional_properties["chunk_id"]
+            self.actions.append((_action.action_type, _key))
+            _result = IndexingResult()
+            _result.key = _key
+            _result.succeeded = not self.fail(_action.action_type, _key)
+            _result.status_code = 200 if _result.succeeded else 503
+            _result.error_message = None if _result.succeeded else "Service unavailable"
+            if _result.succeeded and _action.action_type == "delete":
+                self.documents.discard(_key)
+            elif _result.succeeded:
+                self.documents.add(_key)
+            _results.append(_result)
+        return _results
+
+
+def _push_indexer(tmp_path, search_client):
+    _args = build_parser().parse_args(
+        [
+            "--index-name", "test",
+            "--source-dir", str(tmp_path / "docs"),
+            "--manifest-path", str(tmp_path / "manifest.json"),
+            "--azure-openai-endpoint", "https://example.openai.azure.com",
+            "--azure-openai-embedding-deployment", "embedding",
+            "--maximum-page-length", "40",
+            "--page-overlap-length", "0",
+        ]
+    )
+    _push_indexer = AISearchPushIndexer(_args)
+    _push_indexer._search_client = search_client
+    _push_indexer._embed_uncached = lambda texts: [[0.0] for _ in texts]
+    return _push_indexer
+
+
+def _write(tmp_path, text):
+    (tmp_path / "docs").mkdir(exist_ok=True)
+    (tmp_path / "docs" / "a.txt").write_text(text)
+
+
+def test_failed_upload_is_retried(tmp_path):
+    _write(tmp_path, "first sentence here. second sentence here. third sentence here.")
+    _search_client = _FakeSearchClient()
+    _search_client.fail = lambda action, key: not _search_client.actions[1:]
+    _result = _push_indexer(tmp_path, _search_client).run()
+    assert _result["failed"] == 1
+    assert _result["documents"] > 0
+    _failed_key = _search_client.actions[0][1]
+
+    _search_client.actions = []
+    _search_client.fail = lambda action, key: False
+    _push_indexer(tmp_path, _search_client).run()
+    assert _search_client.actions == [("mergeOrUpload", _failed_key)]
+
+
+def test_failed_delete_is_retried(tmp_path):
+    _write(tmp_path, "first sentence here. second sentence here. third sentence here.")
+    _search_client = _FakeSearchClient()
+    _push_indexer(tmp_path, _search_client).run()
+
+    _search_client.actions = []
+    _search_client.fail = lambda action, key: action == "delete"
+    _write(tmp_path, "first sentence here.")
+    _result = _push_indexer(tmp_path, _search_client).run()
+    _deleted = {_key for _action, _key in _search_client.actions if _action == "delete"}
+    assert _deleted and _result["failed"] == len(_deleted)
+
+    _search_client.actions = []
+    _search_client.fail = lambda action, key: False
+    _push_indexer(tmp_path, _search_client).run()
+    assert sorted(_search_client.actions) == sorted(("delete", _key) for _key in _deleted)